@@ -0,0 +1,284 @@
+"""Re-embed every image in the property-images bucket.
+
+Images are listed from storage, downloaded with bounded concurrency,
+decoded on a thread pool and embedded in batches on one inference thread.
+Rows are written to property_images in chunks; each chunk replaces the
+earlier rows of its urls, so rerunning replaces rows instead of duplicating
+them. The path of every image whose row has been written is appended to the
+checkpoint file, and a rerun after a crash skips those images. Images that
+fail to download, decode or embed, and chunks that still fail to write after
+a few attempts, are reported and left out of the checkpoint, so the next run
+retries them.
+
+Run from the embeddings directory:
+
+  python backfill.py --checkpoint backfill.checkpoint
+
+--local-dir reads a directory laid out like the bucket
+(<property_id>/<file>) instead of Supabase Storage, and --dry-run embeds
+without writing rows.
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+from batcher import MicroBatcher
+from images import classify, preprocess_image, property_id_of
+from pipeline import Stage
+
+BUCKET = "property-images"
+LIST_PAGE_SIZE = 100
+
+
+class LocalStorage:
+  """A directory standing in for one Supabase Storage bucket.
+
+  Implements the part of the bucket API the backfill uses: paged `list`,
+  where folders have no id, `download` and `get_public_url`.
+  """
+
+  def __init__(self, root: str, base_url: str = "file://"):
+    self.root = root
+    self.base_url = base_url
+
+  def list(self, path: str = "", options: Optional[dict] = None) -> List[dict]:
+    options = options or {}
+    directory = os.path.join(self.root, path)
+    if not os.path.isdir(directory):
+      return []
+    names = sorted(os.listdir(directory))
+    offset = options.get("offset", 0)
+    names = names[offset:offset + options.get("limit", LIST_PAGE_SIZE)]
+    return [
+      {"name": name, "id": None if os.path.isdir(os.path.join(directory, name)) else name}
+      for name in names
+    ]
+
+  def download(self, path: str) -> bytes:
+    with open(os.path.join(self.root, path), "rb") as f:
+      return f.read()
+
+  def get_public_url(self, path: str) -> str:
+    return self.base_url + path
+
+
+def list_images(storage, prefix: str = "", page_size: int = LIST_PAGE_SIZE) -> Iterator[str]:
+  """Yield the path of every file under `prefix`, descending into folders."""
+  offset = 0
+  while True:
+    entries = storage.list(prefix, {"limit": page_size, "offset": offset, "sortBy": {"column": "name", "order": "asc"}})
+    for entry in entries:
+      path = f"{prefix}/{entry['name']}" if prefix else entry["name"]
+      if entry.get("id") is None:
+        yield from list_images(storage, path, page_size)
+      elif not entry["name"].startswith("."):
+        # Supabase keeps a .emptyFolderPlaceholder in empty folders
+        yield path
+    if len(entries) < page_size:
+      return
+    offset += page_size
+
+
+class Checkpoint:
+  """Append-only file of finished image paths, one per line."""
+
+  def __init__(self, path: str):
+    self.path = path
+    self.done = set()
+    if os.path.exists(path):
+      with open(path) as f:
+        text = f.read()
+      # A crash mid-write leaves an unterminated last line. It is cut off,
+      # so the next append starts a fresh line, and that image is redone
+      complete = text[:text.rfind("\n") + 1]
+      if complete != text:
+        with open(path, "w") as f:
+          f.write(complete)
+      self.done.update(line for line in complete.split("\n") if line)
+
+  def add(self, paths: Sequence[str]):
+    with open(self.path, "a") as f:
+      f.write("".join(f"{path}\n" for path in paths))
+      f.flush()
+      os.fsync(f.fileno())
+    self.done.update(paths)
+
+
+def replace_rows(client, rows: List[dict]):
+  """Write rows to property_images, replacing earlier rows of the same urls.
+
+  The new rows are inserted before the old ones are deleted, so a failure
+  part way never leaves an image without a row; at worst it leaves a
+  duplicate, which the rerun of that chunk deletes.
+  """
+  table = client.table("property_images")
+  inserted = table.insert(rows).execute().data
+  table.delete().in_("url", [row["url"] for row in rows])\
+    .not_.in_("id", [row["id"] for row in inserted]).execute()
+
+
+@dataclass
+class BackfillStats:
+  listed: int = 0
+  skipped: int = 0
+  embedded: int = 0
+  written: int = 0
+  failed: int = 0
+  seconds: float = 0.0
+
+  @property
+  def images_per_second(self) -> float:
+    return self.embedded / self.seconds if self.seconds else 0.0
+
+
+async def backfill(storage,
+                   write_rows: Callable[[List[dict]], None],
+                   embed_batch: Callable,
+                   checkpoint: Checkpoint,
+                   concurrency: int = 32,
+                   decode_workers: int = 2,
+                   batch_size: int = 16,
+                   chunk_size: int = 500,
+                   report_every: float = 10.0,
+                   write_attempts: int = 3,
+                   retry_delay: float = 1.0) -> BackfillStats:
+  """Embed every image in `storage` not in the checkpoint and write its row.
+
+  `embed_batch` is run on a dedicated thread with stacked preprocessed
+  images and returns (embedding, exterior score) pairs, as in main.py.
+  A chunk is written up to `write_attempts` times, `retry_delay` seconds
+  apart, doubling, before its images are counted as failed.
+  """
+  stats = BackfillStats()
+  start = time.perf_counter()
+  io_stage = Stage("backfill-io", concurrency)
+  decode_stage = Stage("backfill-decode", decode_workers)
+  inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+  # Every worker can have an image waiting, so batches fill up
+  batcher = MicroBatcher(embed_batch, max_batch=batch_size, executor=inference_executor)
+
+  paths = await io_stage.run(lambda: list(list_images(storage)))
+  stats.listed = len(paths)
+  pending = [path for path in paths if path not in checkpoint.done]
+  stats.skipped = stats.listed - len(pending)
+  todo = iter(pending)
+  # (path, row) pairs not yet written
+  rows: List[Tuple[str, dict]] = []
+  last_report = start
+
+  async def flush():
+    nonlocal rows
+    if not rows:
+      return
+    chunk, rows = rows, []
+    for attempt in range(write_attempts):
+      try:
+        await io_stage.run(write_rows, [row for _, row in chunk])
+        break
+      except Exception as e:
+        print(f"Writing {len(chunk)} rows failed (attempt {attempt + 1}/{write_attempts}): {e}")
+        if attempt + 1 < write_attempts:
+          await asyncio.sleep(retry_delay * 2 ** attempt)
+    else:
+      stats.failed += len(chunk)
+      return
+    checkpoint.add([path for path, _ in chunk])
+    stats.written += len(chunk)
+
+  def report():
+    stats.seconds = time.perf_counter() - start
+    print(f"{stats.written + stats.skipped}/{stats.listed} images written, {stats.failed} failed, "
+          f"{stats.images_per_second:.1f} images/s")
+
+  async def worker():
+    nonlocal last_report
+    # All workers share one iterator, so each image is taken exactly once
+    for path in todo:
+      try:
+        image_bytes = await io_stage.run(storage.download, path)
+        image = await decode_stage.run(preprocess_image, image_bytes)
+        embedding, score = await batcher.submit(image[0])
+      except Exception as e:
+        print(f"Skipping {path}: {e}")
+        stats.failed += 1
+        continue
+      aspect, confidence = classify(score)
+      rows.append((path, {
+        "property_id": property_id_of(path),
+        "aspect": aspect,
+        "embedding": embedding,
+        "confidence": confidence,
+        "url": storage.get_public_url(path),
+      }))
+      stats.embedded += 1
+      if len(rows) >= chunk_size:
+        await flush()
+      if time.perf_counter() - last_report >= report_every:
+        last_report = time.perf_counter()
+        report()
+
+  workers = [asyncio.ensure_future(worker()) for _ in range(max(1, min(concurrency, len(pending))))]
+  try:
+    await asyncio.gather(*workers)
+    await flush()
+  finally:
+    # Stop the other workers before closing what they are waiting on
+    for task in workers:
+      task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await batcher.close()
+    io_stage.shutdown()
+    decode_stage.shutdown()
+    inference_executor.shutdown(wait=False)
+  report()
+  return stats
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--checkpoint", default="backfill.checkpoint")
+  parser.add_argument("--local-dir", help="Read images from this directory instead of Supabase Storage")
+  parser.add_argument("--dry-run", action="store_true", help="Embed without writing rows")
+  parser.add_argument("--concurrency", type=int, default=32)
+  parser.add_argument("--decode-workers", type=int, default=2)
+  parser.add_argument("--batch-size", type=int, default=16)
+  parser.add_argument("--chunk-size", type=int, default=500)
+  args = parser.parse_args()
+
+  # Imported here so --help needs neither TensorFlow nor Supabase credentials
+  from images import IMG_SIZE
+  from models import create_embedder
+
+  client = None
+  if args.local_dir:
+    storage = LocalStorage(args.local_dir)
+  else:
+    from supabase_client import supabase as client
+    storage = client.storage.from_(BUCKET)
+
+  if args.dry_run:
+    write_rows = lambda rows: None
+  elif client is None:
+    parser.error("--local-dir needs --dry-run")
+  else:
+    write_rows = lambda rows: replace_rows(client, rows)
+
+  stats = asyncio.run(backfill(
+    storage,
+    write_rows,
+    create_embedder(IMG_SIZE),
+    Checkpoint(args.checkpoint),
+    concurrency=args.concurrency,
+    decode_workers=args.decode_workers,
+    batch_size=args.batch_size,
+    chunk_size=args.chunk_size,
+  ))
+  print(f"Done: {stats.written} written, {stats.skipped} already done, {stats.failed} failed "
+        f"in {stats.seconds:.1f}s ({stats.images_per_second:.1f} images/s)")
+
+
+if __name__ == "__main__":
+  main()
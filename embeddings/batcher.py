@@ -0,0 +1,117 @@
+import asyncio
+import numpy as np
+from concurrent.futures import Executor
+from typing import Any, Callable, List, Optional, Sequence
+
+
+class MicroBatcher:
+  """Coalesce concurrent single-image requests into one model call.
+
+  `submit` queues one preprocessed image and waits for its result. A worker
+  task takes the first queued image, keeps collecting for up to `max_wait_ms`
+  or until `max_batch` images are waiting, stacks them and calls
+  `run_batch` once. `run_batch` receives an array of shape
+  (batch, *image_shape) and must return one result per image, in order. If it
+  raises, every request of that batch gets the exception.
+
+  With an `executor`, batches run there, so the event loop keeps collecting
+  the next batch meanwhile. At most `max_queue` images wait for inference
+  (0 for unbounded); beyond that `submit` blocks, pushing back on callers.
+  `close` fails every request not yet answered with a RuntimeError.
+  """
+
+  def __init__(self,
+               run_batch: Callable[[np.ndarray], Sequence[Any]],
+               max_batch: int = 16,
+               max_wait_ms: float = 5.0,
+               executor: Optional[Executor] = None,
+               max_queue: int = 0):
+    self.run_batch = run_batch
+    self.max_batch = max_batch
+    self.max_wait = max_wait_ms / 1000
+    self.executor = executor
+    self.max_queue = max_queue
+    self._queue: Optional[asyncio.Queue] = None
+    self._worker: Optional[asyncio.Task] = None
+    # The batch being collected or run, taken off the queue but unanswered
+    self._batch: List = []
+    self.batches = 0
+    self.images = 0
+
+  def _ensure_worker(self):
+    # Started on first use, so the queue belongs to the serving event loop
+    if self._worker is None or self._worker.done():
+      self._queue = asyncio.Queue(self.max_queue)
+      self._worker = asyncio.get_running_loop().create_task(self._run())
+
+  async def submit(self, image: np.ndarray) -> Any:
+    self._ensure_worker()
+    queue = self._queue
+    future = asyncio.get_running_loop().create_future()
+    await queue.put((image, future))
+    if queue is not self._queue:
+      # Closed while waiting for room; nothing reads that queue any more
+      raise RuntimeError("batcher closed")
+    return await future
+
+  async def _collect(self) -> List:
+    batch = self._batch = [await self._queue.get()]
+    deadline = asyncio.get_running_loop().time() + self.max_wait
+    while len(batch) < self.max_batch:
+      remaining = deadline - asyncio.get_running_loop().time()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+      except asyncio.TimeoutError:
+        break
+    # Anything that queued up meanwhile rides along without further waiting
+    while len(batch) < self.max_batch and not self._queue.empty():
+      batch.append(self._queue.get_nowait())
+    return batch
+
+  async def _run(self):
+    while True:
+      batch = await self._collect()
+      # Requests whose caller went away are dropped before inference
+      batch = self._batch = [(image, future) for image, future in batch if not future.done()]
+      if not batch:
+        continue
+      try:
+        images = np.stack([image for image, _ in batch])
+        if self.executor is None:
+          results = self.run_batch(images)
+        else:
+          results = await asyncio.get_running_loop().run_in_executor(self.executor, self.run_batch, images)
+      except Exception as e:
+        for _, future in batch:
+          if not future.done():
+            future.set_exception(e)
+        self._batch = []
+        continue
+      self.batches += 1
+      self.images += len(batch)
+      for (_, future), result in zip(batch, results):
+        if not future.done():
+          future.set_result(result)
+      self._batch = []
+
+  @property
+  def queued(self) -> int:
+    return self._queue.qsize() if self._queue is not None else 0
+
+  async def close(self):
+    if self._worker is not None:
+      self._worker.cancel()
+      try:
+        await self._worker
+      except asyncio.CancelledError:
+        pass
+      self._worker = None
+    pending, self._batch = self._batch, []
+    while self._queue is not None and not self._queue.empty():
+      pending.append(self._queue.get_nowait())
+    self._queue = None
+    for _, future in pending:
+      if not future.done():
+        future.set_exception(RuntimeError("batcher closed"))
@@ -0,0 +1,79 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+def content_hash(image_bytes: bytes) -> str:
+  return hashlib.sha256(image_bytes).hexdigest()
+
+
+class EmbeddingCache:
+  """Persistent map from image content hash to embedding and exterior score.
+
+  Entries live in a SQLite file, so they survive restarts. At most
+  `max_entries` are kept; beyond that the least recently used are evicted.
+  The cache belongs to one `model_version`: opening it with another drops
+  every entry, so a changed model never serves stale embeddings. Storage
+  errors are reported and treated as misses, so a broken cache only costs
+  the inference it would have saved.
+  """
+
+  def __init__(self, path: str, model_version: str, max_entries: int = 50000):
+    self.path = path
+    self.max_entries = max_entries
+    self._lock = threading.Lock()
+    self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    self._db.execute("PRAGMA journal_mode=WAL")
+    self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    self._db.execute(
+      "CREATE TABLE IF NOT EXISTS embeddings "
+      "(hash TEXT PRIMARY KEY, embedding BLOB, score REAL, last_used REAL)")
+    self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    row = self._db.execute("SELECT value FROM meta WHERE key = 'model_version'").fetchone()
+    if row is None or row[0] != model_version:
+      self._db.execute("DELETE FROM embeddings")
+      self._db.execute("INSERT OR REPLACE INTO meta VALUES ('model_version', ?)", (model_version,))
+    self._count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self) -> int:
+    return self._count
+
+  def get(self, key: str) -> Optional[Tuple[List[float], float]]:
+    try:
+      with self._lock:
+        row = self._db.execute("SELECT embedding, score FROM embeddings WHERE hash = ?", (key,)).fetchone()
+        if row is not None:
+          self._db.execute("UPDATE embeddings SET last_used = ? WHERE hash = ?", (time.time(), key))
+    except sqlite3.Error as e:
+      print("Error reading embedding cache:", str(e))
+      row = None
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return np.frombuffer(row[0], dtype=np.float32).tolist(), row[1]
+
+  def put(self, key: str, embedding: List[float], score: float):
+    blob = np.asarray(embedding, dtype=np.float32).tobytes()
+    try:
+      with self._lock:
+        cursor = self._db.execute(
+          "INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", (key, blob, float(score), time.time()))
+        self._count += cursor.rowcount
+        if self._count > self.max_entries:
+          cursor = self._db.execute(
+            "DELETE FROM embeddings WHERE hash IN "
+            "(SELECT hash FROM embeddings ORDER BY last_used LIMIT ?)", (self._count - self.max_entries,))
+          self._count -= cursor.rowcount
+    except sqlite3.Error as e:
+      print("Error writing embedding cache:", str(e))
+
+  def close(self):
+    with self._lock:
+      self._db.close()
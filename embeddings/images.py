@@ -0,0 +1,25 @@
+import io
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = 224
+
+
+def preprocess_image(image_bytes):
+  """Preprocess the uploaded image for MobileNetV2"""
+  image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+  image = image.resize((IMG_SIZE, IMG_SIZE))
+  array = np.array(image).astype("float32") / 255.0
+  return np.expand_dims(array, axis=0)
+
+
+def classify(score):
+  """Aspect of an image and the confidence in it, from the exterior score"""
+  aspect = "exterior" if score > 0.5 else "interior"
+  confidence = float(score) if aspect == "exterior" else 1 - float(score)
+  return aspect, confidence
+
+
+def property_id_of(file_path):
+  """Images are stored under a folder named after their property"""
+  return file_path.split("/")[0]
@@ -1,36 +1,75 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
-import io
+import asyncio
+import os
 import numpy as np
-from PIL import Image
 import tensorflow as tf
 import uvicorn
 from supabase_client import supabase
-from models import create_models
-
-# Constants
-IMG_SIZE = 224
-
-# Load models
-base_model = tf.keras.applications.MobileNetV2(
-  input_shape=(IMG_SIZE, IMG_SIZE, 3),
-  include_top=False,
-  weights="imagenet"
+from images import IMG_SIZE, classify, preprocess_image, property_id_of
+from models import create_embedder, model_version
+from embedding_cache import EmbeddingCache, content_hash
+from batcher import MicroBatcher
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import Stage
+
+# TF's own thread pools have to be sized before the first op runs
+if os.getenv("EMBEDDINGS_TF_INTRA_OP_THREADS"):
+  tf.config.threading.set_intra_op_parallelism_threads(int(os.getenv("EMBEDDINGS_TF_INTRA_OP_THREADS")))
+if os.getenv("EMBEDDINGS_TF_INTER_OP_THREADS"):
+  tf.config.threading.set_inter_op_parallelism_threads(int(os.getenv("EMBEDDINGS_TF_INTER_OP_THREADS")))
+
+# One fused model, traced once for any batch size
+embed_batch = create_embedder(IMG_SIZE)
+
+# Blocking work runs in bounded stages so the event loop stays free:
+# storage and table calls, image decoding, and one inference thread that
+# concurrent uploads share through the batcher
+io_stage = Stage("storage-io", int(os.getenv("EMBEDDINGS_IO_CONCURRENCY", "8")))
+decode_stage = Stage("decode", int(os.getenv("EMBEDDINGS_DECODE_WORKERS", "2")))
+inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+batcher = MicroBatcher(
+  embed_batch,
+  max_batch=int(os.getenv("EMBEDDINGS_MAX_BATCH", "16")),
+  max_wait_ms=float(os.getenv("EMBEDDINGS_BATCH_WAIT_MS", "5")),
+  executor=inference_executor,
+  max_queue=int(os.getenv("EMBEDDINGS_INFERENCE_QUEUE", "64"))
 )
-base_model.trainable = False
-
-# Create the base and top models
-base_model, top_model = create_models(IMG_SIZE)
-
+# Bounds the uploads between download and insert, so images held in memory
+# stay bounded however far a later stage falls behind
+upload_slots = asyncio.Semaphore(int(os.getenv("EMBEDDINGS_MAX_IN_FLIGHT", "128")))
+
+# Re-uploads of the same photo reuse its embedding instead of running the model
+cache_entries = int(os.getenv("EMBEDDINGS_CACHE_ENTRIES", "50000"))
+cache = None
+if cache_entries > 0:
+  cache = EmbeddingCache(
+    os.getenv("EMBEDDINGS_CACHE_PATH", "embedding_cache.sqlite3"),
+    model_version(IMG_SIZE),
+    max_entries=cache_entries
+  )
+
+# Set once the first batches have run, so the first upload does not pay for
+# graph tracing and kernel setup
+ready = False
+
+def warm_up():
+  global ready
+  try:
+    for size in sorted({1, batcher.max_batch}):
+      embed_batch(np.zeros((size, IMG_SIZE, IMG_SIZE, 3), dtype=np.float32))
+  except Exception as e:
+    print("Error warming up model:", str(e))
+    return
+  ready = True
+  print("Model warmed up")
 
 app = FastAPI()
 
-def preprocess_image(image_bytes):
-  """Preprocess the uploaded image for MobileNetV2"""
-  image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-  image = image.resize((IMG_SIZE, IMG_SIZE))
-  array = np.array(image).astype("float32") / 255.0
-  return np.expand_dims(array, axis=0)
+@app.on_event("startup")
+async def start_warm_up():
+  # In the background, so /health can answer while it runs
+  asyncio.get_running_loop().run_in_executor(inference_executor, warm_up)
 
 @app.get("/")
 def read_root():
@@ -57,6 +96,10 @@ def insert_property_image(property_id, aspect, embedding, confidence, image_url)
       return resp.data
     except Exception as e:
         raise Exception(f"Failed to insert property image: {str(e)}")
+
+# Helper to delete the property_images rows of an image url
+def delete_property_images(image_url):
+    return supabase.table("property_images").delete().eq("url", image_url).execute()
     
 
 @app.post("/on-upload")
@@ -80,29 +123,32 @@ async def embed_image(request: Request):
       print(f"Skipping non-property image: {file_path}")
       return JSONResponse({"status": "skipped", "reason": "not a property image"})
 
-    # Download image from Supabase Storage
-    image_bytes = download_image_from_supabase(bucket_id, file_path)
-    print(f"Downloaded image: {file_path} ({len(image_bytes)} bytes)")
-
-    # Preprocess and embed
-    img_tensor = preprocess_image(image_bytes)
-    feature_map = base_model(img_tensor, training=False)
-    prediction = top_model(feature_map, training=False)
-    pooled_embedding = tf.keras.layers.GlobalAveragePooling2D()(feature_map)
-    embedding_vector = pooled_embedding.numpy()[0].tolist()
-    aspect = "exterior" if prediction.numpy()[0][0] > 0.5 else "interior"
-    confidence = float(prediction.numpy()[0][0])
-
-    # Extract property_id from file_path (after 'property_image/' and before the next slash)
-    property_id = file_path.split("/")[0]
-
-    # Get public URL for the image
-    public_url = supabase.storage.from_(bucket_id).get_public_url(file_path)
-
-    confidence = 1 - confidence if aspect == "interior" else confidence
-
-    # Insert into property_images table
-    insert_property_image(property_id, aspect, embedding_vector, confidence, public_url)
+    async with upload_slots:
+      # Download image from Supabase Storage
+      image_bytes = await io_stage.run(download_image_from_supabase, bucket_id, file_path)
+      print(f"Downloaded image: {file_path} ({len(image_bytes)} bytes)")
+
+      # Embed, unless an image with the same content has been embedded before
+      key = content_hash(image_bytes)
+      cached = await io_stage.run(cache.get, key) if cache is not None else None
+      if cached is not None:
+        print(f"Embedding cache hit: {file_path}")
+        embedding_vector, score = cached
+      else:
+        img_tensor = await decode_stage.run(preprocess_image, image_bytes)
+        embedding_vector, score = await batcher.submit(img_tensor[0])
+        if cache is not None:
+          await io_stage.run(cache.put, key, embedding_vector, score)
+      aspect, confidence = classify(score)
+
+      # Extract property_id from file_path (after 'property_image/' and before the next slash)
+      property_id = property_id_of(file_path)
+
+      # Get public URL for the image
+      public_url = supabase.storage.from_(bucket_id).get_public_url(file_path)
+
+      # Insert into property_images table
+      await io_stage.run(insert_property_image, property_id, aspect, embedding_vector, confidence, public_url)
 
     return JSONResponse({"status": "ok"})
   except Exception as e:
@@ -134,15 +180,26 @@ async def on_delete(request: Request):
     public_url = supabase.storage.from_(bucket_id).get_public_url(file_path)
 
     # Delete entry with image url from property_images table
-    supabase.table("property_images").delete().eq("url", public_url).execute()
+    await io_stage.run(delete_property_images, public_url)
 
     return JSONResponse({"status": "ok"})
   except Exception as e:
     print("Error in /on-delete:", str(e))
     return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.on_event("shutdown")
+async def stop_pipeline():
+  await batcher.close()
+  for stage in (io_stage, decode_stage):
+    stage.shutdown()
+  inference_executor.shutdown(wait=False, cancel_futures=True)
+  if cache is not None:
+    cache.close()
+
 @app.get("/health")
 def health_check():
+  if not ready:
+    return JSONResponse(status_code=503, content={"status": "warming_up"})
   return {"status": "ok"}
 
 
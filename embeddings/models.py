@@ -1,5 +1,8 @@
+import hashlib
 import tensorflow as tf
 
+TOP_MODEL_PATH = "model/top_classifier_head.h5"
+
 
 def create_models(IMG_SIZE):
   """Create and return the base and top models"""
@@ -10,6 +13,43 @@ def create_models(IMG_SIZE):
   )
   base_model.trainable = False
 
-  top_model = tf.keras.models.load_model("model/top_classifier_head.h5")
+  top_model = tf.keras.models.load_model(TOP_MODEL_PATH)
   
-  return base_model, top_model
\ No newline at end of file
+  return base_model, top_model
+
+
+def create_embedding_model(IMG_SIZE):
+  """Create one model mapping an image batch to its pooled embeddings and
+  exterior scores, sharing a single MobileNetV2 forward pass"""
+  base_model, top_model = create_models(IMG_SIZE)
+  images = tf.keras.Input(shape=(IMG_SIZE, IMG_SIZE, 3))
+  feature_maps = base_model(images, training=False)
+  embeddings = tf.keras.layers.GlobalAveragePooling2D()(feature_maps)
+  scores = top_model(feature_maps, training=False)
+  return tf.keras.Model(images, [embeddings, scores])
+
+
+def create_embedder(IMG_SIZE):
+  """Return a function mapping a batch of preprocessed images to a list of
+  (pooled embedding, exterior score) pairs. The fused model runs in a
+  tf.function with a fixed signature, so it traces once for any batch size."""
+  embedding_model = create_embedding_model(IMG_SIZE)
+
+  @tf.function(input_signature=[tf.TensorSpec([None, IMG_SIZE, IMG_SIZE, 3], tf.float32)])
+  def infer(images):
+    embeddings, scores = embedding_model(images, training=False)
+    return embeddings, scores[:, 0]
+
+  def embed_batch(images):
+    embeddings, scores = infer(images)
+    return list(zip(embeddings.numpy().tolist(), scores.numpy().tolist()))
+
+  return embed_batch
+
+
+def model_version(IMG_SIZE):
+  """Identify the embedder's outputs: the base model, input size and top
+  model weights. Anything that caches embeddings should key on it."""
+  with open(TOP_MODEL_PATH, "rb") as f:
+    top_digest = hashlib.sha256(f.read()).hexdigest()[:16]
+  return f"mobilenet_v2-imagenet-{IMG_SIZE}-{top_digest}"
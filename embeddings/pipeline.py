@@ -0,0 +1,37 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class Stage:
+  """A bounded pool of threads for one kind of blocking work.
+
+  At most `concurrency` calls run at once. Further callers wait on the
+  stage's semaphore inside the event loop rather than piling work onto the
+  executor's unbounded queue, so a slow stage holds back the stages feeding
+  it instead of buffering their output.
+  """
+
+  def __init__(self, name: str, concurrency: int):
+    self.name = name
+    self.concurrency = concurrency
+    self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=name)
+    self._slots = asyncio.Semaphore(concurrency)
+    self.running = 0
+    self.waiting = 0
+
+  async def run(self, fn: Callable[..., Any], *args) -> Any:
+    self.waiting += 1
+    try:
+      await self._slots.acquire()
+    finally:
+      self.waiting -= 1
+    self.running += 1
+    try:
+      return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+    finally:
+      self.running -= 1
+      self._slots.release()
+
+  def shutdown(self):
+    self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Tests import the service as the embeddings package, while its modules import
+# each other by bare name, as they do when uvicorn runs main from this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
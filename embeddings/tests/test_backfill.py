@@ -0,0 +1,176 @@
+import asyncio
+import os
+import shutil
+import pytest
+from embeddings.backfill import Checkpoint, LocalStorage, backfill, list_images, replace_rows
+
+SAMPLES = os.path.join(os.path.dirname(__file__), "..", "sample-images")
+
+
+@pytest.fixture
+def bucket(tmp_path):
+  """A local bucket of the sample images spread over two properties."""
+  root = tmp_path / "bucket"
+  for i, name in enumerate(sorted(os.listdir(SAMPLES))):
+    folder = root / f"property-{i % 2}"
+    folder.mkdir(parents=True, exist_ok=True)
+    shutil.copy(os.path.join(SAMPLES, name), folder / name)
+  (root / "property-1" / ".emptyFolderPlaceholder").write_bytes(b"")
+  (root / "property-1" / "broken.jpg").write_bytes(b"not an image")
+  return LocalStorage(str(root))
+
+
+def fake_embed_batch(images):
+  # Brightness as the "exterior score", so results depend on the image
+  return [([float(image.mean())] * 4, float(image.mean())) for image in images]
+
+
+def run(storage, checkpoint, written, **kw):
+  return asyncio.run(backfill(storage, written.extend, fake_embed_batch, checkpoint,
+                              concurrency=4, batch_size=2, chunk_size=2, **kw))
+
+
+def test_list_images_pages_through_folders(bucket):
+  paths = list(list_images(bucket, page_size=2))
+  assert len(paths) == 6
+  assert "property-1/broken.jpg" in paths
+  assert not any(".emptyFolderPlaceholder" in path for path in paths)
+
+
+def test_backfill_writes_every_image_once(bucket, tmp_path):
+  written = []
+  stats = run(bucket, Checkpoint(str(tmp_path / "checkpoint")), written)
+
+  assert stats.listed == 6
+  assert stats.written == 5
+  assert stats.failed == 1
+  assert sorted(row["url"] for row in written) == sorted(
+    f"file://{path}" for path in list_images(bucket) if not path.endswith("broken.jpg"))
+  for row in written:
+    assert row["property_id"] == row["url"][len("file://"):].split("/")[0]
+    assert row["aspect"] in ("interior", "exterior")
+    assert 0.5 <= row["confidence"] <= 1
+
+
+def test_backfill_resumes_from_the_checkpoint(bucket, tmp_path):
+  path = str(tmp_path / "checkpoint")
+  first = []
+  run(bucket, Checkpoint(path), first)
+  # Simulate a crash before the last chunk was recorded, mid-way through a line
+  with open(path) as f:
+    lines = f.read().splitlines()
+  with open(path, "w") as f:
+    f.write("\n".join(lines[:2]) + "\n" + lines[2][:3])
+
+  second = []
+  stats = run(bucket, Checkpoint(path), second)
+  assert stats.skipped == 2
+  assert {row["url"] for row in second} == {row["url"] for row in first} - {f"file://{p}" for p in lines[:2]}
+  assert Checkpoint(path).done == {row["url"][len("file://"):] for row in first}
+
+
+def test_inference_failures_skip_only_their_images(bucket, tmp_path):
+  def embed_batch(images):
+    if any(image.mean() > 0.5 for image in images):
+      raise RuntimeError("model failed")
+    return fake_embed_batch(images)
+
+  written = []
+  stats = asyncio.run(backfill(bucket, written.extend, embed_batch, Checkpoint(str(tmp_path / "checkpoint")),
+                               concurrency=4, batch_size=1, chunk_size=2))
+  assert stats.written == len(written) and stats.written + stats.failed == 6
+  assert stats.failed > 1
+
+
+def test_failed_writes_are_retried_then_left_for_the_next_run(bucket, tmp_path):
+  attempts = []
+
+  def flaky(rows):
+    attempts.append(len(rows))
+    if len(attempts) % 2:
+      raise ConnectionError("timed out")
+    written.extend(rows)
+
+  written = []
+  path = str(tmp_path / "checkpoint")
+  stats = asyncio.run(backfill(bucket, flaky, fake_embed_batch, Checkpoint(path),
+                               concurrency=4, batch_size=2, chunk_size=2, retry_delay=0))
+  assert stats.written == 5 and len(attempts) == 6
+
+  def down(rows):
+    raise ConnectionError("down")
+
+  stats = asyncio.run(backfill(bucket, down, fake_embed_batch, Checkpoint(str(tmp_path / "other")),
+                               chunk_size=2, retry_delay=0))
+  assert stats.written == 0 and stats.failed == 6
+  assert not Checkpoint(str(tmp_path / "other")).done
+
+
+def test_errors_stop_the_run_without_hanging(bucket, tmp_path):
+  # The checkpoint cannot be written, so the first flush raises
+  checkpoint = Checkpoint(str(tmp_path / "missing" / "checkpoint"))
+
+  async def scenario():
+    return await asyncio.wait_for(backfill(bucket, [].extend, fake_embed_batch, checkpoint,
+                                           concurrency=4, batch_size=2, chunk_size=2), 5)
+
+  with pytest.raises(OSError):
+    asyncio.run(scenario())
+
+
+class FakeTable:
+  """Just enough of a supabase-py table for replace_rows."""
+
+  def __init__(self, rows):
+    self.rows = rows
+    self.calls = []
+
+  def insert(self, rows):
+    self.calls.append("insert")
+    self.data = [dict(row, id=f"new-{i}") for i, row in enumerate(rows)]
+    self.rows.extend(self.data)
+    return self
+
+  def delete(self):
+    self.calls.append("delete")
+    self.data, self._filters, self._negate = None, [], False
+    return self
+
+  @property
+  def not_(self):
+    self._negate = True
+    return self
+
+  def in_(self, column, values):
+    self._filters.append((column, set(values), self._negate))
+    self._negate = False
+    return self
+
+  def execute(self):
+    if self.data is None:
+      self.rows[:] = [row for row in self.rows
+                      if not all((row[column] in values) != negate for column, values, negate in self._filters)]
+    return self
+
+
+class FakeClient:
+  def __init__(self, table):
+    self._table = table
+
+  def table(self, name):
+    return self._table
+
+
+def test_replace_rows_inserts_before_deleting():
+  table = FakeTable([{"id": "old-0", "url": "a"}, {"id": "old-1", "url": "b"}, {"id": "other", "url": "c"}])
+  replace_rows(FakeClient(table), [{"url": "a"}, {"url": "b"}])
+  assert table.calls == ["insert", "delete"]
+  assert sorted(row["id"] for row in table.rows) == ["new-0", "new-1", "other"]
+
+  def fail(rows):
+    raise ConnectionError("down")
+
+  table.insert = fail
+  with pytest.raises(ConnectionError):
+    replace_rows(FakeClient(table), [{"url": "a"}])
+  assert len(table.rows) == 3
@@ -0,0 +1,74 @@
+import asyncio
+import threading
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from embeddings.batcher import MicroBatcher
+
+
+def test_concurrent_requests_share_a_batch():
+  calls = []
+
+  def run_batch(images):
+    calls.append(len(images))
+    return [float(image.sum()) for image in images]
+
+  async def scenario():
+    batcher = MicroBatcher(run_batch, max_batch=4, max_wait_ms=20)
+    images = [np.full((2, 2), i, dtype=np.float32) for i in range(6)]
+    results = await asyncio.gather(*(batcher.submit(image) for image in images))
+    await batcher.close()
+    return results
+
+  results = asyncio.run(scenario())
+  assert results == [4.0 * i for i in range(6)]
+  assert calls == [4, 2]
+
+
+def test_batch_errors_reach_every_request():
+  def run_batch(images):
+    raise RuntimeError("model failed")
+
+  async def scenario():
+    batcher = MicroBatcher(run_batch, max_wait_ms=5)
+    results = await asyncio.gather(*(batcher.submit(np.zeros(3)) for _ in range(3)), return_exceptions=True)
+    await batcher.close()
+    return results
+
+  results = asyncio.run(scenario())
+  assert len(results) == 3
+  assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_lone_request_waits_at_most_the_window():
+  async def scenario():
+    batcher = MicroBatcher(lambda images: list(images.sum(axis=1)), max_wait_ms=10)
+    result = await asyncio.wait_for(batcher.submit(np.ones(3)), 1)
+    await batcher.close()
+    return result
+
+  assert asyncio.run(scenario()) == pytest.approx(3.0)
+
+
+def test_close_fails_unanswered_requests():
+  release = threading.Event()
+
+  def run_batch(images):
+    release.wait(5)
+    return list(images.sum(axis=1))
+
+  async def scenario():
+    executor = ThreadPoolExecutor(max_workers=1)
+    batcher = MicroBatcher(run_batch, max_batch=2, max_wait_ms=1, executor=executor, max_queue=2)
+    # One batch running, two queued and one waiting for room in the queue
+    requests = [asyncio.ensure_future(batcher.submit(np.ones(3))) for _ in range(5)]
+    await asyncio.sleep(0.05)
+    assert batcher.queued == 2
+    await batcher.close()
+    results = await asyncio.wait_for(asyncio.gather(*requests, return_exceptions=True), 1)
+    release.set()
+    executor.shutdown()
+    return results
+
+  results = asyncio.run(scenario())
+  assert all(isinstance(result, RuntimeError) and str(result) == "batcher closed" for result in results)
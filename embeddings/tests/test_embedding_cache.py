@@ -0,0 +1,47 @@
+from embeddings.embedding_cache import EmbeddingCache, content_hash
+
+
+def test_round_trip_persists_across_reopening(tmp_path):
+  path = str(tmp_path / "cache.sqlite3")
+  cache = EmbeddingCache(path, "v1")
+  key = content_hash(b"image")
+  assert cache.get(key) is None
+  cache.put(key, [0.25, 0.5, 1.0], 0.75)
+  cache.put(key, [0.25, 0.5, 1.0], 0.75)
+  assert len(cache) == 1
+  cache.close()
+
+  cache = EmbeddingCache(path, "v1")
+  assert cache.get(key) == ([0.25, 0.5, 1.0], 0.75)
+  assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_model_change_drops_entries(tmp_path):
+  path = str(tmp_path / "cache.sqlite3")
+  cache = EmbeddingCache(path, "v1")
+  cache.put("a", [1.0], 0.9)
+  cache.close()
+
+  cache = EmbeddingCache(path, "v2")
+  assert len(cache) == 0
+  assert cache.get("a") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+  cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), "v1", max_entries=2)
+  cache.put("a", [1.0], 0.1)
+  cache.put("b", [2.0], 0.2)
+  assert cache.get("a") is not None
+  cache.put("c", [3.0], 0.3)
+
+  assert len(cache) == 2
+  assert cache.get("b") is None
+  assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_storage_errors_are_misses(tmp_path):
+  cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), "v1")
+  cache.put("a", [1.0], 0.1)
+  cache._db.execute("DROP TABLE embeddings")
+  assert cache.get("a") is None
+  cache.put("b", [2.0], 0.2)
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import time
+from embeddings.pipeline import Stage
+
+
+def test_stage_bounds_concurrent_calls():
+  lock = threading.Lock()
+  active = []
+  peak = []
+
+  def work(i):
+    with lock:
+      active.append(i)
+      peak.append(len(active))
+    time.sleep(0.01)
+    with lock:
+      active.remove(i)
+    return i * 2
+
+  async def scenario():
+    stage = Stage("test", 2)
+    results = await asyncio.gather(*(stage.run(work, i) for i in range(8)))
+    assert stage.running == 0 and stage.waiting == 0
+    stage.shutdown()
+    return results
+
+  assert asyncio.run(scenario()) == [i * 2 for i in range(8)]
+  assert max(peak) == 2
+
+
+def test_stage_keeps_the_event_loop_free():
+  async def scenario():
+    stage = Stage("test", 1)
+    ticks = 0
+
+    async def tick():
+      nonlocal ticks
+      while True:
+        ticks += 1
+        await asyncio.sleep(0.001)
+
+    ticker = asyncio.get_running_loop().create_task(tick())
+    await stage.run(time.sleep, 0.05)
+    ticker.cancel()
+    stage.shutdown()
+    return ticks
+
+  assert asyncio.run(scenario()) > 5
@@ -0,0 +1,234 @@
+import copy
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from embedding_store import EmbeddingStore
+from property_embedding import ASPECTS
+from similarity_matrix import select_top_k
+
+
+class IVFIndex:
+  """Inverted-file approximate nearest-neighbour index over an EmbeddingStore.
+
+  Rows are clustered with spherical k-means on their combined weighted aspect
+  vectors (each normalised aspect scaled by sqrt(aspect_weight)). A query
+  probes the `n_probe` closest clusters and re-ranks the rows found there
+  with the exact confidence-weighted score, so only the candidate set is
+  ever scored. Raising `n_probe` trades latency for recall; probing every
+  list gives exact results.
+  """
+
+  def __init__(self,
+               embeddings: EmbeddingStore,
+               aspect_weights: Dict[str, float],
+               top_k: int = 10,
+               n_lists: Optional[int] = None,
+               n_probe: int = 8,
+               iterations: int = 10,
+               train_size: int = 20000,
+               block_size: int = 4096,
+               seed: int = 0,
+               centroids: Optional[Dict[str, np.ndarray]] = None,
+               assignments: Optional[np.ndarray] = None):
+    self.embeddings = embeddings
+    self.aspect_weights = aspect_weights
+    self.top_k = top_k
+    # Defaults to sqrt(N) lists
+    self.n_lists = n_lists
+    self.n_probe = n_probe
+    self.iterations = iterations
+    self.train_size = train_size
+    self.block_size = block_size
+    self.rng = np.random.default_rng(seed)
+
+    # Per-aspect centroid blocks, the list each row is assigned to, and the
+    # rows of each list
+    self.centroids: Dict[str, np.ndarray] = {}
+    self.assignments = np.full(embeddings.size, -1, dtype=np.int32)
+    self.lists: List[np.ndarray] = []
+    if centroids is not None and assignments is not None:
+      # Restore a previously trained index (e.g. from a snapshot)
+      self.centroids = dict(centroids)
+      self.assignments = np.array(assignments, dtype=np.int32)
+      if self.centroids:
+        self._split_lists(np.flatnonzero(self.assignments >= 0).astype(np.int32))
+    else:
+      self._build()
+
+  @property
+  def nbytes(self) -> int:
+    arrays = [self.assignments, *self.centroids.values(), *self.lists]
+    return sum(array.nbytes for array in arrays)
+
+  def _routing_aspects(self) -> List[str]:
+    return [
+      aspect for aspect in ASPECTS
+      if self.aspect_weights.get(aspect, 0.0) > 0 and self.embeddings.vectors(aspect).shape[1] > 0
+    ]
+
+  def _centroid_scores(self, vectors: Dict[str, np.ndarray]) -> np.ndarray:
+    """Dot product of combined weighted vectors with every centroid."""
+    n = len(next(iter(vectors.values())))
+    n_lists = len(next(iter(self.centroids.values())))
+    scores = np.zeros((n, n_lists), dtype=np.float32)
+    for aspect, centroids in self.centroids.items():
+      scores += self.aspect_weights.get(aspect, 0.0) * (vectors[aspect] @ centroids.T)
+    return scores
+
+  def _normalize_centroids(self, centroids: Dict[str, np.ndarray]):
+    norms = np.sqrt(sum(
+      self.aspect_weights.get(aspect, 0.0) * np.square(block).sum(axis=1)
+      for aspect, block in centroids.items()
+    ))
+    for block in centroids.values():
+      np.divide(block, norms[:, None], out=block, where=norms[:, None] > 0)
+
+  def _train(self, rows: np.ndarray, n_lists: int):
+    aspects = self._routing_aspects()
+    sample = self.rng.choice(rows, min(self.train_size, len(rows)), replace=False)
+    data = {aspect: self.embeddings.vectors(aspect)[sample] for aspect in aspects}
+
+    seeds = self.rng.choice(len(sample), n_lists, replace=False)
+    self.centroids = {aspect: data[aspect][seeds].copy() for aspect in aspects}
+    self._normalize_centroids(self.centroids)
+
+    for _ in range(self.iterations):
+      labels = np.argmax(self._centroid_scores(data), axis=1)
+      counts = np.bincount(labels, minlength=n_lists)
+      order = np.argsort(labels, kind="stable")
+      filled = np.flatnonzero(counts)
+      starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+
+      # Empty lists keep their previous centroid
+      for aspect in aspects:
+        sums = np.add.reduceat(data[aspect][order], starts, axis=0)
+        self.centroids[aspect][filled] = sums / counts[filled, None]
+      self._normalize_centroids(self.centroids)
+
+  def _assign(self, rows: np.ndarray) -> np.ndarray:
+    labels = np.empty(len(rows), dtype=np.int32)
+    for start in range(0, len(rows), self.block_size):
+      block = rows[start:start + self.block_size]
+      vectors = {aspect: self.embeddings.vectors(aspect)[block] for aspect in self.centroids}
+      labels[start:start + self.block_size] = np.argmax(self._centroid_scores(vectors), axis=1)
+    return labels
+
+  def _build(self):
+    rows = np.flatnonzero(self.embeddings.active).astype(np.int32)
+    self.assignments = np.full(self.embeddings.size, -1, dtype=np.int32)
+    if len(rows) == 0 or not self._routing_aspects():
+      self.centroids, self.lists = {}, []
+      return
+
+    n_lists = self.n_lists or int(round(np.sqrt(len(rows))))
+    n_lists = max(1, min(n_lists, len(rows), self.train_size))
+    self._train(rows, n_lists)
+
+    self.assignments[rows] = self._assign(rows)
+    self._split_lists(rows)
+
+  def _split_lists(self, rows: np.ndarray):
+    labels = self.assignments[rows]
+    n_lists = len(next(iter(self.centroids.values())))
+    order = np.argsort(labels, kind="stable")
+    bounds = np.cumsum(np.bincount(labels, minlength=n_lists))[:-1]
+    self.lists = np.split(rows[order], bounds)
+
+  def _detach(self, row: int):
+    if row < len(self.assignments) and self.assignments[row] >= 0:
+      label = self.assignments[row]
+      self.lists[label] = self.lists[label][self.lists[label] != row]
+      self.assignments[row] = -1
+
+  def update_row(self, row: int):
+    """Assign an inserted or overwritten store row to its closest list."""
+    if not self.lists:
+      # Nothing to route against yet, so train on what the store has now
+      self._build()
+      return
+
+    missing = self.embeddings.size - len(self.assignments)
+    if missing > 0:
+      self.assignments = np.concatenate([self.assignments, np.full(missing, -1, dtype=np.int32)])
+
+    self._detach(row)
+    label = self._assign(np.array([row]))[0]
+    self.assignments[row] = label
+    self.lists[label] = np.append(self.lists[label], np.int32(row))
+
+  def copy(self, embeddings: EmbeddingStore) -> "IVFIndex":
+    """A copy over `embeddings` that can be patched while readers keep
+    using this one. Lists are replaced, never resized, so they are shared."""
+    index = copy.copy(self)
+    index.embeddings = embeddings
+    index.assignments = self.assignments.copy()
+    index.lists = list(self.lists)
+    return index
+
+  def move_row(self, old: int, new: int):
+    self._detach(old)
+
+  def remove_row(self, row: int):
+    self._detach(row)
+
+  def search(self,
+             vectors: Dict[str, np.ndarray],
+             confidences: Dict[str, np.ndarray],
+             k: Optional[int] = None,
+             n_probe: Optional[int] = None,
+             exclude: Optional[int] = None,
+             aspect_weights: Optional[Dict[str, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k rows and exact scores for a single normalised query.
+
+    `aspect_weights` overrides the weights candidates are scored with;
+    lists are still probed with the index's own.
+    """
+    k = k or self.top_k
+    if not self.lists:
+      return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+    n_probe = min(n_probe or self.n_probe, len(self.lists))
+    centroid_scores = self._centroid_scores({aspect: vectors[aspect] for aspect in self.centroids})[0]
+    probed = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+    candidates = np.concatenate([self.lists[label] for label in probed])
+
+    scores = self.embeddings.score(vectors, confidences, aspect_weights or self.aspect_weights, columns=candidates)
+    if exclude is not None:
+      scores[0, candidates == exclude] = -np.inf
+
+    columns, top_scores = select_top_k(scores, k)
+    found = columns[0] >= 0
+    return candidates[columns[0][found]], top_scores[0][found]
+
+  def search_row(self,
+                 row: int,
+                 k: Optional[int] = None,
+                 n_probe: Optional[int] = None,
+                 aspect_weights: Optional[Dict[str, float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    return self.search(
+      {aspect: self.embeddings.vectors(aspect)[[row]] for aspect in ASPECTS},
+      {aspect: self.embeddings.confidences(aspect)[[row]] for aspect in ASPECTS},
+      k, n_probe, exclude=row, aspect_weights=aspect_weights
+    )
+
+  def get_similar_rows(self, rows: np.ndarray, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbour rows and scores of many rows, padded with -1 / -inf.
+
+    Each row probes its own lists: scoring a batch against the union of its
+    probed lists would approach a full scan on large catalogs.
+    """
+    k = k or self.top_k
+    neighbours = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    for i, row in enumerate(rows):
+      found, found_scores = self.search_row(row, k)
+      neighbours[i, :len(found)] = found
+      scores[i, :len(found)] = found_scores
+    return neighbours, scores
+
+  def get_similar_properties(self, property_id: str) -> List[Tuple[str, float]]:
+    row = self.embeddings.rows.get(property_id)
+    if row is None:
+      return []
+    rows, scores = self.search_row(row)
+    ids = self.embeddings.ids
+    return [(ids[r], float(score)) for r, score in zip(rows, scores)]
@@ -0,0 +1,148 @@
+import numpy as np
+from typing import Dict, Optional, Tuple
+from embedding_store import EmbeddingStore
+from property_embedding import ASPECTS
+from similarity_matrix import select_top_k
+
+
+class AspectComponents:
+  """Per-aspect score components of every row's likely neighbours.
+
+  A row's candidates are the union of its `per_aspect` best rows by each
+  aspect's component alone and by the combined score under the build
+  weights. Each candidate keeps its unweighted component per aspect,
+  cosine * (conf_a + conf_b) / 2, so any aspect weights can be recombined
+  into top-k lists with one small matrix product instead of an O(N^2)
+  rebuild.
+
+  Candidate sets are fixed at build time: incremental updates refresh the
+  components of rows already listed, but a new property only becomes a
+  candidate of other rows at the next rebuild.
+  """
+
+  def __init__(self,
+               embeddings: EmbeddingStore,
+               aspect_weights: Dict[str, float],
+               per_aspect: int = 10,
+               block_size: int = 256,
+               candidates: Optional[np.ndarray] = None,
+               components: Optional[np.ndarray] = None):
+    self.embeddings = embeddings
+    self.aspect_weights = aspect_weights
+    self.per_aspect = per_aspect
+    self.block_size = block_size
+    self.width = per_aspect * (len(ASPECTS) + 1)
+
+    # Candidate rows, padded with -1, and their (rows, width, aspects) components
+    if candidates is not None and components is not None:
+      self.candidates, self.components = candidates, components
+    else:
+      self.candidates, self.components = self._compute(np.arange(embeddings.size))
+
+  @property
+  def nbytes(self) -> int:
+    return self.candidates.nbytes + self.components.nbytes
+
+  def _select_candidates(self, rows: np.ndarray) -> np.ndarray:
+    store = self.embeddings
+    queries = {aspect: store.vectors(aspect)[rows] for aspect in ASPECTS}
+    confidences = {aspect: store.confidences(aspect)[rows] for aspect in ASPECTS}
+    excluded = ~store.active
+
+    selected = []
+    combined = np.zeros((len(rows), store.size), dtype=np.float32)
+    for aspect in ASPECTS:
+      if store.vectors(aspect).shape[1] == 0:
+        continue
+      component = store.component_scores(queries[aspect], confidences[aspect], aspect)
+      weight = self.aspect_weights.get(aspect, 0.0)
+      if weight:
+        combined += weight * component
+      component[:, excluded] = -np.inf
+      component[np.arange(len(rows)), rows] = -np.inf
+      selected.append(select_top_k(component, self.per_aspect)[0])
+
+    combined[:, excluded] = -np.inf
+    combined[np.arange(len(rows)), rows] = -np.inf
+    selected.append(select_top_k(combined, self.per_aspect)[0])
+
+    candidates = np.full((len(rows), self.width), -1, dtype=np.int32)
+    stacked = np.sort(np.hstack(selected), axis=1)
+    # Drop repeats so each candidate appears once per row
+    stacked[:, 1:][stacked[:, 1:] == stacked[:, :-1]] = -1
+    candidates[:, :stacked.shape[1]] = stacked
+    return candidates
+
+  def _compute(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    candidates = np.full((len(rows), self.width), -1, dtype=np.int32)
+    components = np.zeros((len(rows), self.width, len(ASPECTS)), dtype=np.float32)
+    for start in range(0, len(rows), self.block_size):
+      block = slice(start, start + self.block_size)
+      candidates[block] = self._select_candidates(rows[block])
+      components[block] = self.embeddings.pair_components(rows[block], candidates[block])
+    return candidates, components
+
+  def _ensure_rows(self):
+    missing = self.embeddings.size - len(self.candidates)
+    if missing > 0:
+      self.candidates = np.vstack([self.candidates, np.full((missing, self.width), -1, dtype=np.int32)])
+      self.components = np.concatenate([
+        self.components, np.zeros((missing, self.width, len(ASPECTS)), dtype=np.float32)
+      ])
+
+  def update_row(self, row: int):
+    """Recompute a row's own candidates and refresh its components in the
+    rows that already list it."""
+    self._ensure_rows()
+    self.candidates[[row]], self.components[[row]] = self._compute(np.array([row]))
+
+    listing, slots = np.nonzero(self.candidates == row)
+    if listing.size:
+      columns = np.full((listing.size, 1), row, dtype=np.int32)
+      self.components[listing, slots] = self.embeddings.pair_components(listing, columns)[:, 0]
+
+  def copy(self, embeddings: EmbeddingStore) -> "AspectComponents":
+    """A copy over `embeddings` that can be patched while readers keep
+    using this one."""
+    return AspectComponents(embeddings, self.aspect_weights, per_aspect=self.per_aspect, block_size=self.block_size,
+                            candidates=self.candidates.copy(), components=self.components.copy())
+
+  def move_row(self, old: int, new: int):
+    """Point every candidate list at a property's new store row before
+    `update_row` refreshes its components."""
+    self._ensure_rows()
+    self.candidates[self.candidates == old] = new
+    self.remove_row(old)
+
+  def remove_row(self, row: int):
+    # Other rows' references are masked by the store's active flags
+    self.candidates[row] = -1
+    self.components[row] = 0
+
+  def row_candidates(self, row: int) -> np.ndarray:
+    candidates = self.candidates[row]
+    return candidates[candidates >= 0]
+
+  def recombine(self,
+                aspect_weights: Dict[str, float],
+                top_k: int,
+                rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbour rows and scores under new aspect weights, from the
+    stored components only. Padded with -1 / -inf like SimilarityMatrix.
+    """
+    rows = np.arange(len(self.candidates)) if rows is None else rows
+    weights = np.array([aspect_weights.get(aspect, 0.0) for aspect in ASPECTS], dtype=np.float32)
+    neighbours = np.full((len(rows), top_k), -1, dtype=np.int32)
+    scores = np.full((len(rows), top_k), -np.inf, dtype=np.float32)
+    active = self.embeddings.active
+
+    for start in range(0, len(rows), 4096):
+      block = slice(start, start + 4096)
+      candidates = self.candidates[rows[block]]
+      combined = self.components[rows[block]] @ weights
+      combined[(candidates < 0) | ~active[np.maximum(candidates, 0)]] = -np.inf
+
+      columns, scores[block] = select_top_k(combined, top_k)
+      found = np.take_along_axis(candidates, np.maximum(columns, 0), axis=1)
+      neighbours[block] = np.where(columns >= 0, found, -1)
+    return neighbours, scores
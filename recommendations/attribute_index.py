@@ -0,0 +1,177 @@
+"""Filterable property attributes and the indexes that answer filters.
+
+Categorical attributes (status, neighbourhood) are stored as integer codes
+with one boolean bitmap per value, kept up to date on every write, so a set
+of allowed values is an OR of bitmaps. Numeric attributes (price, bedrooms)
+are float64 columns, NaN when missing, served from a sorted copy of the
+column that is rebuilt lazily after writes, so a range is two binary
+searches.
+"""
+import numpy as np
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+CATEGORICAL_ATTRIBUTES = ["status", "neighbourhood"]
+NUMERIC_ATTRIBUTES = ["price", "bedrooms"]
+
+
+@dataclass
+class PropertyFilter:
+  """Allowed values per categorical attribute and inclusive numeric ranges.
+
+  Unset fields do not filter.
+  """
+  status: Optional[List[str]] = None
+  neighbourhood: Optional[List[str]] = None
+  min_price: Optional[float] = None
+  max_price: Optional[float] = None
+  min_bedrooms: Optional[float] = None
+  max_bedrooms: Optional[float] = None
+
+  def categories(self) -> Dict[str, List[str]]:
+    return {name: getattr(self, name) for name in CATEGORICAL_ATTRIBUTES if getattr(self, name)}
+
+  def ranges(self) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    ranges = {name: (getattr(self, f"min_{name}"), getattr(self, f"max_{name}")) for name in NUMERIC_ATTRIBUTES}
+    return {name: bounds for name, bounds in ranges.items() if bounds != (None, None)}
+
+  def __bool__(self) -> bool:
+    return bool(self.categories() or self.ranges())
+
+
+class AttributeIndex:
+  def __init__(self, capacity: int = 0):
+    self.categories: Dict[str, List[str]] = {name: [] for name in CATEGORICAL_ATTRIBUTES}
+    self._codes = {name: np.full(capacity, -1, dtype=np.int32) for name in CATEGORICAL_ATTRIBUTES}
+    self._lookup: Dict[str, Dict[str, int]] = {name: {} for name in CATEGORICAL_ATTRIBUTES}
+    self._bitmaps: Dict[str, List[np.ndarray]] = {name: [] for name in CATEGORICAL_ATTRIBUTES}
+    self._numeric = {name: np.full(capacity, np.nan) for name in NUMERIC_ATTRIBUTES}
+
+    # Sorted numeric columns, tagged with the write version they were built at
+    self._version = 0
+    self._sorted: Dict[str, Tuple[int, np.ndarray, np.ndarray]] = {}
+
+  @classmethod
+  def from_columns(cls,
+                   codes: Dict[str, np.ndarray],
+                   categories: Dict[str, List[str]],
+                   numeric: Dict[str, np.ndarray]) -> "AttributeIndex":
+    """Wrap existing columns (e.g. from a snapshot) and derive the bitmaps."""
+    index = cls()
+    index._codes = dict(codes)
+    index._numeric = dict(numeric)
+    for name in CATEGORICAL_ATTRIBUTES:
+      index.categories[name] = list(categories[name])
+      index._lookup[name] = {value: code for code, value in enumerate(index.categories[name])}
+      index._bitmaps[name] = [index._codes[name] == code for code in range(len(index.categories[name]))]
+    return index
+
+  def copy(self) -> "AttributeIndex":
+    """A copy sharing the column and bitmap arrays, for an EmbeddingStore
+    copy, which only writes rows the original does not use."""
+    index = AttributeIndex()
+    index.categories = {name: list(values) for name, values in self.categories.items()}
+    index._codes = dict(self._codes)
+    index._lookup = {name: dict(lookup) for name, lookup in self._lookup.items()}
+    index._bitmaps = {name: list(bitmaps) for name, bitmaps in self._bitmaps.items()}
+    index._numeric = dict(self._numeric)
+    index._version = self._version
+    index._sorted = dict(self._sorted)
+    return index
+
+  @property
+  def nbytes(self) -> int:
+    arrays = [*self._codes.values(), *self._numeric.values()]
+    arrays += [bitmap for bitmaps in self._bitmaps.values() for bitmap in bitmaps]
+    return sum(array.nbytes for array in arrays)
+
+  def codes(self, name: str) -> np.ndarray:
+    return self._codes[name]
+
+  def numeric(self, name: str) -> np.ndarray:
+    return self._numeric[name]
+
+  def grow(self, capacity: int):
+    for name, codes in self._codes.items():
+      self._codes[name] = np.concatenate([codes, np.full(capacity - len(codes), -1, dtype=np.int32)])
+      self._bitmaps[name] = [
+        np.concatenate([bitmap, np.zeros(capacity - len(bitmap), dtype=bool)]) for bitmap in self._bitmaps[name]
+      ]
+    for name, column in self._numeric.items():
+      self._numeric[name] = np.concatenate([column, np.full(capacity - len(column), np.nan)])
+
+  def _code(self, name: str, value: str) -> int:
+    code = self._lookup[name].get(value)
+    if code is None:
+      code = len(self.categories[name])
+      self.categories[name].append(value)
+      self._lookup[name][value] = code
+      self._bitmaps[name].append(np.zeros(len(self._codes[name]), dtype=bool))
+    return code
+
+  def set(self, row: int, attributes: Optional[dict]):
+    """Overwrite one row's attributes; missing values never match a filter."""
+    attributes = attributes or {}
+    for name in CATEGORICAL_ATTRIBUTES:
+      old = self._codes[name][row]
+      if 0 <= old < len(self._bitmaps[name]):
+        self._bitmaps[name][old][row] = False
+      value = attributes.get(name)
+      code = -1 if value is None else self._code(name, str(value))
+      self._codes[name][row] = code
+      if code >= 0:
+        self._bitmaps[name][code][row] = True
+
+    for name in NUMERIC_ATTRIBUTES:
+      value = attributes.get(name)
+      self._numeric[name][row] = np.nan if value is None else float(value)
+    self._version += 1
+
+  def clear(self, row: int):
+    self.set(row, None)
+
+  def get(self, row: int) -> dict:
+    attributes = {}
+    for name in CATEGORICAL_ATTRIBUTES:
+      code = self._codes[name][row]
+      attributes[name] = self.categories[name][code] if code >= 0 else None
+    for name in NUMERIC_ATTRIBUTES:
+      value = self._numeric[name][row]
+      attributes[name] = None if np.isnan(value) else float(value)
+    return attributes
+
+  def _sorted_column(self, name: str, size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows with a value for `name`, ordered by it, and the sorted values."""
+    version = self._version
+    cached = self._sorted.get(name)
+    if cached is not None and cached[0] == version:
+      return cached[1], cached[2]
+
+    column = self._numeric[name][:size]
+    rows = np.flatnonzero(~np.isnan(column))
+    order = rows[np.argsort(column[rows], kind="stable")]
+    values = column[order]
+    # Tagged with the version read before building, so a write that races
+    # with this rebuild invalidates it rather than being lost
+    self._sorted[name] = (version, order, values)
+    return order, values
+
+  def mask(self, filters: PropertyFilter, size: int) -> np.ndarray:
+    """Boolean mask over the first `size` rows of those matching `filters`."""
+    mask = np.ones(size, dtype=bool)
+    for name, values in filters.categories().items():
+      allowed = np.zeros(size, dtype=bool)
+      for value in values:
+        code = self._lookup[name].get(str(value))
+        if code is not None:
+          allowed |= self._bitmaps[name][code][:size]
+      mask &= allowed
+
+    for name, (low, high) in filters.ranges().items():
+      order, values = self._sorted_column(name, size)
+      start = 0 if low is None else np.searchsorted(values, low, side="left")
+      end = len(values) if high is None else np.searchsorted(values, high, side="right")
+      allowed = np.zeros(size, dtype=bool)
+      allowed[order[start:end]] = True
+      mask &= allowed
+    return mask
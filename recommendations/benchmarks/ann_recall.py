@@ -0,0 +1,57 @@
+"""Recall and latency of the IVF index against the exact similarity matrix.
+
+Run from the recommendations directory:
+
+  python -m benchmarks.ann_recall --properties 20000 --probes 1 2 4 8 16 32
+"""
+import argparse
+import time
+import numpy as np
+from ann_index import IVFIndex
+from similarity_matrix import SimilarityMatrix
+from benchmarks.synthetic import ASPECT_WEIGHTS, make_catalog
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--properties", type=int, default=20000)
+  parser.add_argument("--top-k", type=int, default=10)
+  parser.add_argument("--queries", type=int, default=500)
+  parser.add_argument("--lists", type=int, default=None)
+  parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  store = make_catalog(args.properties, seed=args.seed)
+
+  start = time.perf_counter()
+  exact = SimilarityMatrix(store, ASPECT_WEIGHTS, top_k=args.top_k)
+  print(f"exact matrix build: {time.perf_counter() - start:.2f}s")
+
+  start = time.perf_counter()
+  index = IVFIndex(store, ASPECT_WEIGHTS, top_k=args.top_k, n_lists=args.lists, seed=args.seed)
+  print(f"ivf build: {time.perf_counter() - start:.2f}s ({len(index.lists)} lists)")
+
+  rng = np.random.default_rng(args.seed)
+  queries = rng.choice(store.size, min(args.queries, store.size), replace=False)
+
+  for n_probe in args.probes:
+    latencies = []
+    hits = 0
+    for row in queries:
+      start = time.perf_counter()
+      rows, _ = index.search_row(row, n_probe=n_probe)
+      latencies.append((time.perf_counter() - start) * 1000)
+
+      truth = exact.neighbours[row]
+      hits += len(np.intersect1d(rows, truth[truth >= 0]))
+
+    recall = hits / (len(queries) * args.top_k)
+    print(
+      f"n_probe={n_probe:<4} recall@{args.top_k}={recall:.3f} "
+      f"p50={np.percentile(latencies, 50):.2f}ms p99={np.percentile(latencies, 99):.2f}ms"
+    )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,86 @@
+"""Recall, memory and scan time of quantized image aspects against float32.
+
+Each precision scans the catalog with approximate scores and re-ranks a
+shortlist of rerank_factor * k rows in float32; recall@k is measured
+against the exact float32 top-k of the same query rows. The synthetic
+catalog has exact ties, so a returned row counts as a hit when its exact
+score reaches the true k-th score.
+
+Run from the recommendations directory:
+
+  python -m benchmarks.quantization_recall --properties 20000 --factors 1 2 4 8
+"""
+import argparse
+import time
+import numpy as np
+from embedding_store import EmbeddingStore
+from property_embedding import ASPECTS, IMAGE_ASPECTS
+from similarity_matrix import SimilarityMatrix
+from benchmarks.synthetic import ASPECT_WEIGHTS, make_catalog
+
+
+def with_precision(store: EmbeddingStore, precision: str, rerank_factor: int) -> EmbeddingStore:
+  """The same rows as `store`, sharing its float32 arrays."""
+  quantized = EmbeddingStore.from_arrays(
+    store.ids,
+    {aspect: store.vectors(aspect) for aspect in ASPECTS},
+    {aspect: store.norms(aspect) for aspect in ASPECTS},
+    {aspect: store.confidences(aspect) for aspect in ASPECTS},
+    store.attributes,
+    precision=precision
+  )
+  quantized.rerank_factor = rerank_factor
+  return quantized
+
+
+def top_k(store: EmbeddingStore, rows: np.ndarray, k: int):
+  """Top-k of `rows` scored on the fly, timed in ms per query row."""
+  matrix = SimilarityMatrix(store, ASPECT_WEIGHTS, top_k=0,
+                            neighbours=np.zeros((store.size, 0), dtype=np.int32),
+                            scores=np.zeros((store.size, 0), dtype=np.float32))
+  start = time.perf_counter()
+  neighbours, scores = matrix.get_similar_rows(rows, k)
+  return neighbours, scores, (time.perf_counter() - start) * 1000 / len(rows)
+
+
+def image_bytes(store: EmbeddingStore) -> int:
+  if store.quantized:
+    return sum(store.quantized_vectors(aspect).nbytes for aspect in IMAGE_ASPECTS)
+  return sum(store.vectors(aspect).nbytes for aspect in IMAGE_ASPECTS)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--properties", type=int, default=20000)
+  parser.add_argument("--top-k", type=int, default=10)
+  parser.add_argument("--queries", type=int, default=1000)
+  parser.add_argument("--precisions", nargs="+", default=["float16", "int8"])
+  parser.add_argument("--factors", type=int, nargs="+", default=[1, 2, 4, 8])
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  store = make_catalog(args.properties, seed=args.seed)
+  rng = np.random.default_rng(args.seed)
+  queries = rng.choice(store.size, min(args.queries, store.size), replace=False)
+
+  truth, truth_scores, latency = top_k(store, queries, args.top_k)
+  floors = truth_scores[:, -1] - 1e-5
+  print(f"float32  image aspects {image_bytes(store) / 2**20:8.1f} MB  {latency:.2f}ms/query")
+
+  for precision in args.precisions:
+    for factor in args.factors:
+      quantized = with_precision(store, precision, factor)
+      found, _, latency = top_k(quantized, queries, args.top_k)
+      hits = 0
+      for row, columns, floor in zip(queries, found, floors):
+        exact = store.score_rows(np.array([row]), ASPECT_WEIGHTS, columns=columns[columns >= 0])[0]
+        hits += int((exact >= floor).sum())
+      recall = hits / max(1, (truth >= 0).sum())
+      print(
+        f"{precision:<8} image aspects {image_bytes(quantized) / 2**20:8.1f} MB  "
+        f"rerank x{factor:<3} recall@{args.top_k}={recall:.4f}  {latency:.2f}ms/query"
+      )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,150 @@
+"""End-to-end benchmarks of the RecommendationEngine on synthetic catalogs.
+
+Each catalog size runs in a fresh process so peak RSS is measured per
+case. Results are written as JSON; pass an earlier results file to
+--compare to see the ratio of every metric against it.
+
+Run from the recommendations directory:
+
+  python -m benchmarks.suite --sizes 1000 10000 50000 --output results.json
+  python -m benchmarks.suite --sizes 200000 --modes ann --compare results.json
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from attribute_index import PropertyFilter
+from embedding_store import EmbeddingStore
+from recommendation_engine import RecommendationEngine
+from benchmarks.synthetic import ASPECT_WEIGHTS, IMAGE_DIM, MAX_IMAGES, METADATA_WEIGHTS, make_properties
+
+# Metrics compared by --compare; lower is better for all of them
+METRICS = [
+  "embed_seconds", "build_seconds", "peak_rss_mb", "index_mb",
+  "get_recommendations_p50_ms", "get_recommendations_p99_ms",
+  "filtered_p50_ms", "filtered_p99_ms",
+  "from_history_p50_ms", "from_history_p99_ms",
+]
+
+
+def percentiles(latencies, name):
+  return {
+    f"{name}_p50_ms": float(np.percentile(latencies, 50)),
+    f"{name}_p99_ms": float(np.percentile(latencies, 99)),
+  }
+
+
+def timed(fn, arguments):
+  latencies = []
+  for args in arguments:
+    start = time.perf_counter()
+    fn(*args)
+    latencies.append((time.perf_counter() - start) * 1000)
+  return latencies
+
+
+def run_case(n_properties: int, mode: str, queries: int, image_dim: int, seed: int) -> dict:
+  """Build one catalog and index and measure it. Runs in a child process."""
+  start = time.perf_counter()
+  store = EmbeddingStore(capacity=n_properties)
+  for property_id, embedding in make_properties(n_properties, image_dim=image_dim, seed=seed):
+    store.upsert(property_id, embedding)
+  embed_seconds = time.perf_counter() - start
+
+  engine = RecommendationEngine(METADATA_WEIGHTS, MAX_IMAGES, ASPECT_WEIGHTS, top_k=10, mode=mode)
+  start = time.perf_counter()
+  engine.publish(engine.build_state(store))
+  build_seconds = time.perf_counter() - start
+
+  rng = np.random.default_rng(seed)
+  ids = [store.ids[row] for row in rng.choice(store.size, min(queries, store.size), replace=False)]
+  histories = [
+    [store.ids[row] for row in rng.choice(store.size, rng.integers(1, 21))]
+    for _ in range(len(ids))
+  ]
+  filters = PropertyFilter(status=["for_rent"], min_bedrooms=2, max_bedrooms=3)
+
+  result = {
+    "properties": n_properties,
+    "mode": mode,
+    "embed_seconds": embed_seconds,
+    "build_seconds": build_seconds,
+    "index_mb": store.nbytes / 2**20,
+  }
+  result.update(percentiles(timed(engine.get_recommendations, [(pid,) for pid in ids]), "get_recommendations"))
+  result.update(percentiles(timed(engine.get_recommendations, [(pid, filters) for pid in ids]), "filtered"))
+  result.update(percentiles(timed(engine.get_history_recommendations, [(h,) for h in histories]), "from_history"))
+  # ru_maxrss is reported in kilobytes on Linux
+  result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+  return result
+
+
+def environment() -> dict:
+  try:
+    revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+  except OSError:
+    revision = None
+  return {
+    "timestamp": time.time(),
+    "revision": revision or None,
+    "python": sys.version.split()[0],
+    "numpy": np.__version__,
+    "platform": platform.platform(),
+    "cpus": multiprocessing.cpu_count(),
+  }
+
+
+def compare(results, baseline):
+  previous = {(case["properties"], case["mode"]): case for case in baseline["results"]}
+  for case in results:
+    old = previous.get((case["properties"], case["mode"]))
+    if old is None:
+      continue
+    ratios = ", ".join(
+      f"{metric}={case[metric] / old[metric]:.2f}x" for metric in METRICS if old.get(metric)
+    )
+    print(f"{case['properties']:>7} {case['mode']:<5} vs baseline: {ratios}")
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+  parser.add_argument("--modes", nargs="+", choices=["exact", "ann", "lazy"], default=["exact", "ann"])
+  parser.add_argument("--queries", type=int, default=200)
+  parser.add_argument("--image-dim", type=int, default=IMAGE_DIM)
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--output", help="write results as JSON to this file")
+  parser.add_argument("--compare", help="earlier results file to compare against")
+  args = parser.parse_args()
+
+  results = []
+  context = multiprocessing.get_context("spawn")
+  for n_properties in args.sizes:
+    for mode in args.modes:
+      with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        case = executor.submit(run_case, n_properties, mode, args.queries, args.image_dim, args.seed).result()
+      results.append(case)
+      print(
+        f"{n_properties:>7} {mode:<5} build={case['build_seconds']:.2f}s rss={case['peak_rss_mb']:.0f}MB "
+        f"get p50/p99={case['get_recommendations_p50_ms']:.2f}/{case['get_recommendations_p99_ms']:.2f}ms "
+        f"filtered p50/p99={case['filtered_p50_ms']:.2f}/{case['filtered_p99_ms']:.2f}ms "
+        f"history p50/p99={case['from_history_p50_ms']:.2f}/{case['from_history_p99_ms']:.2f}ms"
+      )
+
+  report = {"environment": environment(), "arguments": vars(args), "results": results}
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+  if args.compare:
+    with open(args.compare) as f:
+      compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+  main()
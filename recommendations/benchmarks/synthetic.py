@@ -0,0 +1,88 @@
+import numpy as np
+from typing import Iterator, Tuple
+from embedding_store import EmbeddingStore
+from property_embedding import PropertyEmbedding
+
+# Mirrors the service configuration in main.py
+METADATA_WEIGHTS = {"bedrooms": 1.0, "bathrooms": 1.0, "price": 1.5, "interior_size_sqm": 1.2, "status": 3}
+ASPECT_WEIGHTS = {"metadata": 0.4, "interior": 0.3, "exterior": 0.2, "neighbourhood": 0.1}
+MAX_IMAGES = {"interior": 10, "exterior": 5}
+
+# MobileNetV2's pooled feature size
+IMAGE_DIM = 1280
+
+
+def image_counts(rng: np.random.Generator) -> Tuple[int, int]:
+  """Interior and exterior photo counts for one listing.
+
+  Listing photo counts are long-tailed: some listings have none, most have
+  a handful and a few have dozens, with interiors outnumbering exteriors.
+  """
+  if rng.random() < 0.1:
+    return 0, 0
+  total = min(1 + rng.negative_binomial(2, 0.2), 40)
+  interior = rng.binomial(total, 0.7)
+  return int(interior), int(total - interior)
+
+
+def make_properties(n_properties: int,
+                    image_dim: int = IMAGE_DIM,
+                    neighbourhood_dim: int = 64,
+                    n_styles: int = 64,
+                    n_neighbourhoods: int = 40,
+                    seed: int = 0) -> Iterator[Tuple[str, PropertyEmbedding]]:
+  """Yield synthetic (property_id, PropertyEmbedding) pairs.
+
+  Image aspects are drawn around a small number of shared "style" centres so
+  the catalog has the kind of structure nearest-neighbour search relies on.
+  Each aspect's mean is sampled directly, with noise shrinking with the
+  image count as it would when averaging that many photos.
+  """
+  rng = np.random.default_rng(seed)
+  styles = np.abs(rng.normal(size=(n_styles, image_dim))).astype(np.float32)
+  neighbourhoods = rng.normal(size=(n_neighbourhoods, neighbourhood_dim)).astype(np.float32)
+
+  for i in range(n_properties):
+    style = styles[rng.integers(n_styles)]
+    bedrooms = int(rng.integers(1, 7))
+    status = ["for_rent", "for_sale"][rng.integers(0, 2)]
+    price = float(rng.lognormal(13, 1))
+    neighbourhood = int(rng.integers(n_neighbourhoods))
+    counts = dict(zip(["interior", "exterior"], image_counts(rng)))
+
+    metadata = {
+      "bedrooms": bedrooms,
+      "bathrooms": max(1, bedrooms - int(rng.integers(0, 2))),
+      "price": price,
+      "interior_size_sqm": float(rng.normal(40 * bedrooms, 10)),
+      "status": 0 if status == "for_rent" else 1,
+    }
+
+    def image_mean(count):
+      if count == 0:
+        return None
+      noise = rng.normal(scale=0.5 / np.sqrt(count), size=image_dim)
+      return np.abs(style + noise).astype(np.float32)
+
+    yield f"property-{i}", PropertyEmbedding.from_aggregates(
+      metadata=metadata,
+      image_means={aspect: image_mean(count) for aspect, count in counts.items()},
+      image_counts=counts,
+      neighbourhood=neighbourhoods[neighbourhood],
+      max_images=MAX_IMAGES,
+      metadata_weights=METADATA_WEIGHTS,
+      attributes={
+        "status": status,
+        "price": price,
+        "bedrooms": bedrooms,
+        "neighbourhood": f"neighbourhood-{neighbourhood}",
+      }
+    )
+
+
+def make_catalog(n_properties: int, precision: str = "float32", **kwargs) -> EmbeddingStore:
+  """Generate a synthetic catalog straight into an EmbeddingStore."""
+  store = EmbeddingStore(capacity=n_properties, precision=precision)
+  for property_id, embedding in make_properties(n_properties, **kwargs):
+    store.upsert(property_id, embedding)
+  return store
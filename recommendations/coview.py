@@ -0,0 +1,176 @@
+import threading
+import numpy as np
+from scipy import sparse
+from typing import Dict, List, Optional, Tuple
+from views import SESSION_GAP, ViewLog, sessionize
+
+
+class CoViewIndex:
+  """Item-item co-view counts as a sparse CSR matrix.
+
+  Two properties are co-viewed when a signed-in user views them within
+  `window` views of each other in one session. Memory grows with the
+  number of observed pairs, never with N^2. Scores are co-view counts
+  normalised by the geometric mean of both properties' view counts, so
+  popular listings do not dominate every list.
+
+  Views can be appended as they happen: their pairs are buffered and merged
+  into the matrix every `merge_every` pairs, and queries see buffered pairs
+  immediately.
+  """
+
+  def __init__(self, window: int = 5, gap: float = SESSION_GAP, merge_every: int = 10000):
+    self.window = window
+    self.gap = gap
+    self.merge_every = merge_every
+
+    self.ids: List[str] = []
+    self.rows: Dict[str, int] = {}
+    self.matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+    self._views = np.zeros(0, dtype=np.float32)
+    # Changes with every accepted view, so cached blends can be told apart
+    self.version = 0
+
+    # Pairs appended since the last merge, and each user's latest views
+    self._pending_rows: List[int] = []
+    self._pending_cols: List[int] = []
+    self._recent: Dict[str, List[Tuple[int, float]]] = {}
+    self._lock = threading.Lock()
+
+  @classmethod
+  def from_views(cls, views: ViewLog, window: int = 5, gap: float = SESSION_GAP, **kwargs) -> "CoViewIndex":
+    """Build from a whole view log in one vectorized pass."""
+    index = cls(window, gap, **kwargs)
+    index.ids = list(views.property_ids)
+    index.rows = {pid: row for row, pid in enumerate(index.ids)}
+    n = len(index.ids)
+
+    sessions = sessionize(views, gap)
+    viewed = views.properties[sessions.order]
+    index._views = np.bincount(viewed, minlength=n).astype(np.float32)
+    index.version = len(viewed)
+
+    rows, cols = [], []
+    for back in range(1, window + 1):
+      later = np.flatnonzero(sessions.position >= back)
+      first, second = viewed[later - back], viewed[later]
+      distinct = first != second
+      rows += [first[distinct], second[distinct]]
+      cols += [second[distinct], first[distinct]]
+
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+    cols = np.concatenate(cols) if cols else np.zeros(0, dtype=np.int32)
+    # Duplicate pairs are summed into counts
+    index.matrix = sparse.csr_matrix(
+      (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n, n), dtype=np.float32)
+    return index
+
+  @property
+  def nnz(self) -> int:
+    return self.matrix.nnz + len(self._pending_rows)
+
+  @property
+  def nbytes(self) -> int:
+    matrix = self.matrix
+    pending = 2 * 8 * len(self._pending_rows)
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes + self._views.nbytes + pending
+
+  def _row(self, property_id: str) -> int:
+    row = self.rows.get(property_id)
+    if row is None:
+      row = len(self.ids)
+      self.ids.append(property_id)
+      self.rows[property_id] = row
+      if row == len(self._views):
+        self._views = np.concatenate([self._views, np.zeros(max(row, 16), dtype=np.float32)])
+    return row
+
+  def add_view(self, property_id: str, user_id: Optional[str], timestamp: float):
+    """Append one view. Anonymous views cannot be sessionized and are ignored."""
+    if not user_id:
+      return
+    with self._lock:
+      row = self._row(property_id)
+      recent = self._recent.get(user_id, [])
+      if recent and timestamp - recent[-1][1] > self.gap:
+        recent = []
+      if recent and recent[-1][0] == row:
+        # A repeat view of the same property only extends the session
+        recent[-1] = (row, timestamp)
+        return
+
+      self._views[row] += 1
+      self.version += 1
+      for other, _ in recent:
+        if other != row:
+          self._pending_rows += [row, other]
+          self._pending_cols += [other, row]
+      self._recent[user_id] = (recent + [(row, timestamp)])[-self.window:]
+
+      if len(self._pending_rows) >= self.merge_every:
+        self._merge()
+        # Forget users whose sessions have ended
+        self._recent = {
+          user: views for user, views in self._recent.items() if timestamp - views[-1][1] <= self.gap
+        }
+
+  def _merge(self):
+    n = len(self.ids)
+    pending = sparse.csr_matrix(
+      (np.ones(len(self._pending_rows), dtype=np.float32), (self._pending_rows, self._pending_cols)),
+      shape=(n, n), dtype=np.float32)
+    matrix = self.matrix.copy()
+    matrix.resize((n, n))
+    # Replaced in one assignment so readers never see a half-merged matrix
+    self.matrix = (matrix + pending).tocsr()
+    self._pending_rows, self._pending_cols = [], []
+
+  def merge(self):
+    """Fold buffered pairs into the CSR matrix."""
+    with self._lock:
+      self._merge()
+
+  def _row_scores(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Co-viewed rows of `row` and their normalised scores."""
+    with self._lock:
+      matrix = self.matrix
+      pending_rows = np.array(self._pending_rows, dtype=np.int64)
+      pending_cols = np.array(self._pending_cols, dtype=np.int64)
+      views = self._views[:len(self.ids)].copy()
+
+    cols = np.zeros(0, dtype=np.int64)
+    counts = np.zeros(0, dtype=np.float32)
+    if row < matrix.shape[0]:
+      start, end = matrix.indptr[row], matrix.indptr[row + 1]
+      cols, counts = matrix.indices[start:end], matrix.data[start:end]
+    extra = pending_cols[pending_rows == row]
+    if extra.size:
+      cols, inverse = np.unique(np.concatenate([cols, extra]), return_inverse=True)
+      counts = np.bincount(inverse, weights=np.concatenate([counts, np.ones(extra.size)])).astype(np.float32)
+
+    scores = counts / np.sqrt(views[row] * views[cols])
+    return cols, scores.astype(np.float32)
+
+  def get_similar_properties(self, property_id: str, k: int = 10) -> List[Tuple[str, float]]:
+    """Top-k co-viewed properties by normalised count."""
+    row = self.rows.get(property_id)
+    if row is None:
+      return []
+    cols, scores = self._row_scores(row)
+    if len(cols) > k:
+      top = np.argpartition(-scores, k - 1)[:k]
+      cols, scores = cols[top], scores[top]
+    order = np.argsort(-scores, kind="stable")
+    return [(self.ids[col], float(score)) for col, score in zip(cols[order], scores[order])]
+
+  def scores(self, property_id: str, others: List[str]) -> np.ndarray:
+    """Normalised co-view score of `property_id` with each of `others`, 0 if never co-viewed."""
+    result = np.zeros(len(others), dtype=np.float32)
+    row = self.rows.get(property_id)
+    if row is None:
+      return result
+    cols, scores = self._row_scores(row)
+    lookup = dict(zip(cols.tolist(), scores.tolist()))
+    for i, other in enumerate(others):
+      result[i] = lookup.get(self.rows.get(other, -1), 0.0)
+    return result
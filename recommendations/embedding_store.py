@@ -0,0 +1,435 @@
+import copy
+import os
+import tempfile
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Tuple
+from attribute_index import AttributeIndex
+from property_embedding import ASPECTS, IMAGE_ASPECTS, PropertyEmbedding
+from quantization import PRECISIONS, QuantizedMatrix
+
+
+class EmbeddingStore:
+  """Columnar storage for property embeddings.
+
+  Each aspect is held as one contiguous float32 matrix of L2-normalised rows,
+  together with the original vector norms and a confidence vector. Rows are
+  addressed through an id <-> row mapping. Removed properties leave an
+  inactive row behind so that row numbers held elsewhere stay valid; a full
+  rebuild compacts them away. Filterable raw attributes live alongside in an
+  AttributeIndex.
+
+  With a `precision` of "float16" or "int8", the image aspects also keep a
+  QuantizedMatrix copy. Full-catalog scans pass `approximate=True` to score
+  against it, and callers re-rank their shortlist, `rerank_factor` times
+  longer than the list they need, against the float32 rows. When the
+  float32 matrices are memory-mapped, from a snapshot or by `spill()`, only
+  shortlisted rows are ever paged in, so the quantized copies replace them
+  in memory rather than adding to them.
+
+  Stores are updated copy-on-write once readers can see them: `copy()`
+  shares the row arrays and copies only the bookkeeping, and a copy never
+  writes a row it shares. Overwriting a shared row's property moves it to
+  a new row instead, so readers of the original never see a row change.
+  The old row stays inactive until the next full build; see
+  `inactive_rows`.
+  """
+
+  def __init__(self, capacity: int = 0, precision: str = "float32", rerank_factor: int = 4):
+    if precision not in PRECISIONS:
+      raise ValueError(f"Unknown precision: {precision}")
+    self.precision = precision
+    self.rerank_factor = rerank_factor
+    self._quantized: Dict[str, QuantizedMatrix] = {}
+    self.ids: List[Optional[str]] = []
+    self.rows: Dict[str, int] = {}
+    self._active = np.zeros(capacity, dtype=bool)
+    self._vectors = {aspect: np.zeros((capacity, 0), dtype=np.float32) for aspect in ASPECTS}
+    self._norms = {aspect: np.zeros(capacity, dtype=np.float32) for aspect in ASPECTS}
+    self._confidences = {aspect: np.zeros(capacity, dtype=np.float32) for aspect in ASPECTS}
+    self.attributes = AttributeIndex(capacity)
+    # Rows below this are shared with the store this one was copied from
+    self._shared_rows = 0
+    # Where memory-mapped matrices are re-created when the store grows
+    self._spill_dir: Optional[str] = None
+
+  @classmethod
+  def from_embeddings(cls, embeddings: Dict[str, PropertyEmbedding], **kwargs) -> "EmbeddingStore":
+    store = cls(capacity=len(embeddings), **kwargs)
+    for property_id, embedding in embeddings.items():
+      store.upsert(property_id, embedding)
+    return store
+
+  @classmethod
+  def from_arrays(cls,
+                  ids: List[Optional[str]],
+                  vectors: Dict[str, np.ndarray],
+                  norms: Dict[str, np.ndarray],
+                  confidences: Dict[str, np.ndarray],
+                  attributes: Optional[AttributeIndex] = None,
+                  precision: str = "float32",
+                  quantized: Optional[Dict[str, QuantizedMatrix]] = None) -> "EmbeddingStore":
+    """Wrap existing column arrays (e.g. memory-mapped snapshot files) without
+    copying them. `None` ids mark inactive rows. Quantized copies are built
+    from the vectors unless given.
+    """
+    store = cls(precision=precision)
+    store.ids = list(ids)
+    store.rows = {pid: row for row, pid in enumerate(store.ids) if pid is not None}
+    store._active = np.array([pid is not None for pid in store.ids], dtype=bool)
+    store._vectors = dict(vectors)
+    store._norms = dict(norms)
+    store._confidences = dict(confidences)
+    if attributes is not None:
+      store.attributes = attributes
+    else:
+      store.attributes.grow(len(store.ids))
+    if quantized is not None:
+      store._quantized = dict(quantized)
+    elif store.quantized:
+      store._quantized = {
+        aspect: QuantizedMatrix.quantize(store._vectors[aspect], precision)
+        for aspect in IMAGE_ASPECTS if store._vectors[aspect].shape[1] > 0
+      }
+    return store
+
+  def copy(self) -> "EmbeddingStore":
+    """A copy to update while readers keep using this store. Only ids,
+    active flags and the column dicts are copied; row data is shared."""
+    store = copy.copy(self)
+    store.ids = list(self.ids)
+    store.rows = dict(self.rows)
+    store._active = self._active.copy()
+    store._vectors = dict(self._vectors)
+    store._norms = dict(self._norms)
+    store._confidences = dict(self._confidences)
+    store._quantized = {aspect: matrix.copy() for aspect, matrix in self._quantized.items()}
+    store.attributes = self.attributes.copy()
+    store._shared_rows = self.size
+    return store
+
+  @property
+  def size(self) -> int:
+    """Number of rows in use, including inactive ones."""
+    return len(self.ids)
+
+  @property
+  def active(self) -> np.ndarray:
+    return self._active[:self.size]
+
+  @property
+  def inactive_rows(self) -> int:
+    """Rows left behind by removals and moved properties, which only a
+    full build drops."""
+    return int(self.size - self.active.sum())
+
+  def vectors(self, aspect: str) -> np.ndarray:
+    return self._vectors[aspect][:self.size]
+
+  def norms(self, aspect: str) -> np.ndarray:
+    return self._norms[aspect][:self.size]
+
+  def confidences(self, aspect: str) -> np.ndarray:
+    return self._confidences[aspect][:self.size]
+
+  @property
+  def quantized(self) -> bool:
+    return self.precision != "float32"
+
+  def quantized_vectors(self, aspect: str) -> Optional[QuantizedMatrix]:
+    return self._quantized.get(aspect)
+
+  @property
+  def nbytes(self) -> int:
+    """Bytes held in memory; memory-mapped matrices are paged in on use."""
+    arrays = [self._active, *self._vectors.values(), *self._norms.values(), *self._confidences.values()]
+    arrays = [array for array in arrays if not isinstance(array, np.memmap)]
+    quantized = sum(matrix.nbytes for matrix in self._quantized.values())
+    return sum(array.nbytes for array in arrays) + quantized + self.attributes.nbytes
+
+  def _mapped(self, shape: Tuple[int, int]) -> np.ndarray:
+    """A zeroed float32 matrix backed by an unlinked file in the spill directory."""
+    directory = self._spill_dir or tempfile.gettempdir()
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryFile(dir=directory) as f:
+      # The mapping keeps the data alive after the file is closed
+      return np.memmap(f, dtype=np.float32, mode="w+", shape=shape)
+
+  def spill(self, directory: Optional[str] = None):
+    """Move the float32 matrices of the quantized image aspects out of
+    memory into files under `directory` (the temp directory by default).
+
+    Full scans read the quantized copies, so only re-ranked rows are paged
+    back in. Matrices that are already memory-mapped are left as they are.
+    """
+    self._spill_dir = directory
+    for aspect in self._quantized:
+      matrix = self._vectors[aspect]
+      if isinstance(matrix, np.memmap) or matrix.shape[1] == 0:
+        continue
+      mapped = self._mapped(matrix.shape)
+      mapped[:] = matrix
+      self._vectors[aspect] = mapped
+
+  def _grow(self, capacity: int):
+    capacity = max(capacity, 2 * len(self._active), 16)
+    for columns in (self._norms, self._confidences):
+      for aspect, column in columns.items():
+        columns[aspect] = np.concatenate([column, np.zeros(capacity - len(column), dtype=np.float32)])
+    for aspect, matrix in self._vectors.items():
+      if isinstance(matrix, np.memmap) and aspect in self._quantized:
+        grown = self._mapped((capacity, matrix.shape[1]))
+      else:
+        grown = np.zeros((capacity, matrix.shape[1]), dtype=np.float32)
+      grown[:len(matrix)] = matrix
+      self._vectors[aspect] = grown
+    for matrix in self._quantized.values():
+      matrix.grow(capacity)
+    self._active = np.concatenate([self._active, np.zeros(capacity - len(self._active), dtype=bool)])
+    self.attributes.grow(capacity)
+
+  def _set_vector(self, aspect: str, row: int, vector: Optional[np.ndarray]):
+    matrix = self._vectors[aspect]
+    quantized = self._quantized.get(aspect)
+    if vector is None or not vector.any():
+      matrix[row] = 0
+      self._norms[aspect][row] = 0
+      if quantized is not None:
+        quantized.set_row(row, matrix[row])
+      return
+
+    if matrix.shape[1] == 0:
+      # First non-empty vector seen for this aspect fixes its dimension
+      matrix = np.zeros((len(matrix), vector.size), dtype=np.float32)
+      self._vectors[aspect] = matrix
+      if self.quantized and aspect in IMAGE_ASPECTS:
+        quantized = QuantizedMatrix.quantize(matrix, self.precision)
+        self._quantized[aspect] = quantized
+
+    norm = np.linalg.norm(vector)
+    matrix[row] = vector / norm
+    self._norms[aspect][row] = norm
+    if quantized is not None:
+      quantized.set_row(row, matrix[row])
+
+  def query(self, embedding: PropertyEmbedding) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Normalised (1, dim) query vectors and confidences of an embedding
+    that is not stored, for `score`. Raises ValueError on a dimension
+    mismatch with a non-empty aspect.
+    """
+    vectors, confidences = {}, {}
+    for aspect in ASPECTS:
+      dim = self._vectors[aspect].shape[1]
+      query = np.zeros((1, dim), dtype=np.float32)
+      vector = getattr(embedding, f"{aspect}_embedding")
+      if vector is not None and vector.any() and dim:
+        if vector.size != dim:
+          raise ValueError(f"{aspect} embedding has {vector.size} dimensions, expected {dim}")
+        query[0] = vector / np.linalg.norm(vector)
+      vectors[aspect] = query
+      confidences[aspect] = np.array([getattr(embedding, f"{aspect}_confidence")], dtype=np.float32)
+    return vectors, confidences
+
+  def upsert(self, property_id: str, embedding: PropertyEmbedding) -> int:
+    """Insert or overwrite a property's row and return its row number.
+
+    A property on a shared row moves to a new row, and the old row is left
+    inactive.
+    """
+    row = self.rows.get(property_id)
+    if row is not None and row < self._shared_rows:
+      self.ids[row] = None
+      self._active[row] = False
+      row = None
+    if row is None:
+      row = self.size
+      if row == len(self._active):
+        self._grow(row + 1)
+      self.ids.append(property_id)
+      self.rows[property_id] = row
+      self._active[row] = True
+
+    for aspect in ASPECTS:
+      self._set_vector(aspect, row, getattr(embedding, f"{aspect}_embedding"))
+      self._confidences[aspect][row] = getattr(embedding, f"{aspect}_confidence")
+    self.attributes.set(row, embedding.attributes)
+    return row
+
+  def remove(self, property_id: str) -> Optional[int]:
+    """Deactivate a property's row and return its row number, if it existed."""
+    row = self.rows.pop(property_id, None)
+    if row is None:
+      return None
+
+    self.ids[row] = None
+    self._active[row] = False
+    if row < self._shared_rows:
+      # Inactive rows are never scored, so shared data can stay as it is
+      return row
+    for aspect in ASPECTS:
+      self._vectors[aspect][row] = 0
+      self._norms[aspect][row] = 0
+      self._confidences[aspect][row] = 0
+    for matrix in self._quantized.values():
+      matrix.set_row(row, np.zeros(matrix.codes.shape[1], dtype=np.float32))
+    self.attributes.clear(row)
+    return row
+
+  def component_scores(self,
+                       vectors: np.ndarray,
+                       confidences: np.ndarray,
+                       aspect: str,
+                       columns: Optional[np.ndarray] = None,
+                       weight: float = 1.0,
+                       approximate: bool = False) -> np.ndarray:
+    """One aspect's score component, weight * cosine(a, b) * (conf_a + conf_b) / 2,
+    of a batch of normalised query vectors against every row or `columns`.
+    """
+    quantized = self._quantized.get(aspect) if approximate else None
+    column_confidences = self.confidences(aspect)
+    if columns is not None:
+      column_confidences = column_confidences[columns]
+    if quantized is not None:
+      sims = quantized.dot(vectors, self.size, columns)
+    else:
+      matrix = self.vectors(aspect)
+      if columns is not None:
+        matrix = matrix[columns]
+      if matrix.shape[1] == 0:
+        return np.zeros((len(confidences), len(matrix)), dtype=np.float32)
+      sims = vectors @ matrix.T
+    sims *= confidences[:, None] + column_confidences[None, :]
+    sims *= weight / 2
+    return sims
+
+  def score(self,
+            vectors: Dict[str, np.ndarray],
+            confidences: Dict[str, np.ndarray],
+            aspect_weights: Dict[str, float],
+            columns: Optional[np.ndarray] = None,
+            approximate: bool = False) -> np.ndarray:
+    """Score a batch of normalised query vectors against every row, or only
+    against `columns` when given.
+
+    Equivalent to summing, for each aspect,
+    cosine(a, b) * (conf_a + conf_b) / 2 * aspect_weight. Inactive rows
+    score -inf. `approximate` scores image aspects against their quantized
+    copies, if kept.
+    """
+    n_queries = len(next(iter(confidences.values())))
+    n_columns = self.size if columns is None else len(columns)
+    scores = np.zeros((n_queries, n_columns), dtype=np.float32)
+
+    for aspect in ASPECTS:
+      weight = aspect_weights.get(aspect, 0.0)
+      if weight == 0 or self.vectors(aspect).shape[1] == 0:
+        continue
+      scores += self.component_scores(vectors[aspect], confidences[aspect], aspect, columns, weight, approximate)
+
+    active = self.active if columns is None else self.active[columns]
+    scores[:, ~active] = -np.inf
+    return scores
+
+  def pair_components(self, rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    """Per-aspect score components of each row against its own list of columns.
+
+    `columns` is (len(rows), C), padded with -1; returns (len(rows), C,
+    len(ASPECTS)) with zeros at padding.
+    """
+    components = np.zeros((*columns.shape, len(ASPECTS)), dtype=np.float32)
+    valid = columns >= 0
+    safe = np.where(valid, columns, 0)
+    for a, aspect in enumerate(ASPECTS):
+      matrix = self.vectors(aspect)
+      if matrix.shape[1] == 0:
+        continue
+      confidences = self.confidences(aspect)
+      sims = np.einsum("rd,rcd->rc", matrix[rows], matrix[safe])
+      sims *= confidences[rows][:, None] + confidences[safe]
+      components[..., a] = np.where(valid, 0.5 * sims, 0)
+    return components
+
+  def score_rows(self,
+                 rows: np.ndarray,
+                 aspect_weights: Dict[str, float],
+                 columns: Optional[np.ndarray] = None,
+                 approximate: bool = False) -> np.ndarray:
+    return self.score(
+      {aspect: self.vectors(aspect)[rows] for aspect in ASPECTS},
+      {aspect: self.confidences(aspect)[rows] for aspect in ASPECTS},
+      aspect_weights,
+      columns,
+      approximate
+    )
+
+  def score_weighted_rows(self,
+                          rows: np.ndarray,
+                          row_weights: np.ndarray,
+                          aspect_weights: Dict[str, float],
+                          approximate: bool = False) -> np.ndarray:
+    """Weighted sum of the scores of `rows` against every row, in one pass.
+
+    Per aspect, sum_i r_i * score(i, j) expands to
+    weight / 2 * ((sum_i r_i c_i x_i) . x_j + c_j * (sum_i r_i x_i) . x_j),
+    so any number of rows collapses into two profile vectors per aspect.
+
+    `rows` and `row_weights` may also be (B, L) to score B row sets at once,
+    returning (B, size); rows of -1 are ignored.
+    """
+    batched = np.ndim(rows) == 2
+    rows = np.atleast_2d(rows)
+    row_weights = np.where(rows >= 0, np.atleast_2d(row_weights), 0).astype(np.float32)
+    rows = np.maximum(rows, 0)
+    scores = np.zeros((len(rows), self.size), dtype=np.float32)
+
+    for aspect in ASPECTS:
+      weight = aspect_weights.get(aspect, 0.0)
+      matrix = self.vectors(aspect)
+      if weight == 0 or matrix.shape[1] == 0:
+        continue
+
+      confidences = self.confidences(aspect)
+      vectors = matrix[rows]
+      confident = np.einsum("bl,bld->bd", row_weights * confidences[rows], vectors)
+      plain = np.einsum("bl,bld->bd", row_weights, vectors)
+      quantized = self._quantized.get(aspect) if approximate else None
+      if quantized is not None:
+        sims = quantized.dot(confident, self.size)
+        sims += confidences[None, :] * quantized.dot(plain, self.size)
+      else:
+        sims = confident @ matrix.T
+        sims += confidences[None, :] * (plain @ matrix.T)
+      sims *= weight / 2
+      scores += sims
+
+    scores[:, ~self.active] = -np.inf
+    return scores if batched else scores[0]
+
+  def get(self, property_id: str) -> PropertyEmbedding:
+    """Reconstruct a PropertyEmbedding view of one row."""
+    row = self.rows[property_id]
+    values = {}
+    for aspect in ASPECTS:
+      norm = self._norms[aspect][row]
+      if norm > 0:
+        vector = self._vectors[aspect][row] * norm
+      elif aspect == "metadata":
+        vector = np.zeros(self._vectors[aspect].shape[1], dtype=np.float32)
+      elif aspect == "neighbourhood":
+        vector = np.array([0], dtype=np.float32)
+      else:
+        vector = None
+      values[f"{aspect}_embedding"] = vector
+      values[f"{aspect}_confidence"] = float(self._confidences[aspect][row])
+    return PropertyEmbedding(**values, attributes=self.attributes.get(row))
+
+  def __getitem__(self, property_id: str) -> PropertyEmbedding:
+    return self.get(property_id)
+
+  def __contains__(self, property_id: str) -> bool:
+    return property_id in self.rows
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(list(self.rows))
+
+  def __len__(self) -> int:
+    return len(self.rows)
@@ -0,0 +1,124 @@
+"""Offline evaluation of recommendations by replaying property_views.
+
+Every view that follows another in the same session is a test event. In
+single-item mode the previous view is the query; in history mode the
+preceding `history_length` views are. An event is a hit when the viewed
+property is among the top k recommendations. All events of a mode are
+scored in one batched pass: single-item lists are a gather from the index,
+and histories are scored in blocks of profile vectors.
+
+Run from the recommendations directory against a snapshot of the index:
+
+  python evaluation.py --views property_views.csv --output evaluation.json
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+from typing import Dict, Optional
+from recommendation_engine import RecommendationEngine
+from snapshot import latest_manifest, load_snapshot
+from views import ViewLog, history_windows, load_views, sessionize
+
+
+def score_lists(lists: np.ndarray, targets: np.ndarray, catalog_size: int) -> Dict[str, float]:
+  """Hit rate, MRR and catalog coverage of (E, k) recommendation lists."""
+  hits = lists == targets[:, None]
+  hit = hits.any(axis=1)
+  rank = np.argmax(hits, axis=1) + 1
+  recommended = np.unique(lists[lists >= 0])
+  return {
+    "events": int(len(targets)),
+    "hit_rate": float(hit.mean()) if len(targets) else 0.0,
+    "mrr": float((hit / rank).mean()) if len(targets) else 0.0,
+    "coverage": len(recommended) / catalog_size if catalog_size else 0.0,
+  }
+
+
+def evaluate(engine: RecommendationEngine,
+             views: ViewLog,
+             k: Optional[int] = None,
+             history_length: int = 10,
+             history_sample: Optional[int] = 5000,
+             seed: int = 0) -> dict:
+  """Replay `views` against the engine's index in both modes.
+
+  History mode scores a full catalog pass per event, so at most
+  `history_sample` randomly chosen events are replayed (None for all).
+  Events whose target is not indexed, or was viewed earlier in the same
+  window, cannot be hit and are skipped.
+  """
+  k = k or engine.top_k
+  index = engine.index
+  store = engine.embeddings
+  rows = views.property_rows(store.rows)
+  sessions = sessionize(views)
+  session_rows = rows[sessions.order]
+  events = np.flatnonzero(sessions.continues & (session_rows >= 0))
+  targets = session_rows[events]
+
+  previous = session_rows[events - 1]
+  indexed = previous >= 0
+  queries, inverse = np.unique(previous[indexed], return_inverse=True)
+  neighbours, _ = index.get_similar_rows(queries, k)
+  single = score_lists(neighbours[inverse], targets[indexed], len(store))
+
+  windows = history_windows(sessions, session_rows, history_length)[events]
+  usable = np.flatnonzero((windows >= 0).any(axis=1) & ~(windows == targets[:, None]).any(axis=1))
+  if history_sample is not None and len(usable) > history_sample:
+    usable = np.sort(np.random.default_rng(seed).choice(usable, history_sample, replace=False))
+  neighbours, _ = engine.get_history_rows(windows[usable], k)
+  history = score_lists(neighbours, targets[usable], len(store))
+
+  return {
+    "k": k,
+    "views": len(views),
+    "sessions": int(sessions.session[-1] + 1) if len(sessions.session) else 0,
+    "catalog": len(store),
+    "single_item": single,
+    "from_history": history,
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--views", required=True, help="property_views export (.csv) or saved ViewLog (.npz)")
+  parser.add_argument("--snapshot-dir", default=os.path.join(os.path.dirname(__file__), "snapshots"))
+  parser.add_argument("--k", type=int, default=None)
+  parser.add_argument("--history-length", type=int, default=10)
+  parser.add_argument("--history-sample", type=int, default=5000)
+  parser.add_argument("--aspect-weights", help="JSON aspect weights to recombine before evaluating")
+  parser.add_argument("--save-views", help="save the parsed views as .npz for faster reloads")
+  parser.add_argument("--output", help="write the metrics as JSON to this file")
+  args = parser.parse_args()
+
+  manifest = latest_manifest(args.snapshot_dir)
+  if manifest is None:
+    parser.error(f"No snapshot found in {args.snapshot_dir}")
+  engine = RecommendationEngine(
+    {}, {}, manifest["aspect_weights"], top_k=manifest["top_k"], mode=manifest["mode"],
+    aspect_candidates=manifest.get("aspect_candidates", 0), precision=manifest.get("precision", "float32")
+  )
+  if not load_snapshot(engine, args.snapshot_dir):
+    parser.error(f"Could not load a snapshot from {args.snapshot_dir}")
+  if args.aspect_weights:
+    engine.apply_aspect_weights(json.loads(args.aspect_weights))
+
+  start = time.perf_counter()
+  views = load_views(args.views)
+  print(f"Loaded {len(views)} views in {time.perf_counter() - start:.1f}s")
+  if args.save_views:
+    views.save(args.save_views)
+
+  start = time.perf_counter()
+  report = evaluate(engine, views, args.k, args.history_length, args.history_sample)
+  report["seconds"] = time.perf_counter() - start
+  print(json.dumps(report, indent=2))
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,142 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from embedding_store import EmbeddingStore
+from similarity_matrix import top_k_rows
+
+
+class LazySimilarityIndex:
+  """Top-k neighbour lists computed on first request and kept in a bounded LRU.
+
+  Building is instant since only the store is needed. A row's list is
+  computed with one vectorized scan the first time it is requested, and at
+  most `max_rows` lists are kept, so memory follows the working set rather
+  than the catalog. When a row changes, its own list is dropped along with
+  every cached list it enters or leaves.
+  """
+
+  def __init__(self,
+               embeddings: EmbeddingStore,
+               aspect_weights: Dict[str, float],
+               top_k: int = 10,
+               max_rows: int = 50000,
+               block_size: int = 256):
+    self.embeddings = embeddings
+    self.aspect_weights = aspect_weights
+    self.top_k = top_k
+    self.max_rows = max_rows
+    self.block_size = block_size
+
+    self._lists: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+    # Bumped by every invalidation, so a list computed concurrently with
+    # one is not cached
+    self._version = 0
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def cached_rows(self) -> int:
+    return len(self._lists)
+
+  @property
+  def nbytes(self) -> int:
+    return len(self._lists) * self.top_k * 8
+
+  def _compute(self, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    neighbours = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    for start in range(0, len(rows), self.block_size):
+      block = slice(start, start + self.block_size)
+      neighbours[block], scores[block] = top_k_rows(self.embeddings, rows[block], self.aspect_weights, k)
+    return neighbours, scores
+
+  def get_similar_rows(self, rows: np.ndarray, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbour rows and scores of many rows, padded with -1 / -inf.
+
+    Up to top_k, lists come from the cache and all missing rows are
+    computed in one batch; longer lists are computed and not cached.
+    """
+    k = k or self.top_k
+    if k > self.top_k:
+      return self._compute(np.asarray(rows), k)
+
+    neighbours = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    missing = []
+    with self._lock:
+      for i, row in enumerate(np.asarray(rows).tolist()):
+        cached = self._lists.get(row)
+        if cached is None:
+          missing.append(i)
+          continue
+        self._lists.move_to_end(row)
+        neighbours[i], scores[i] = cached[0][:k], cached[1][:k]
+      self.hits += len(rows) - len(missing)
+      self.misses += len(missing)
+      version = self._version
+    if not missing:
+      return neighbours, scores
+
+    missing = np.array(missing)
+    unique, inverse = np.unique(np.asarray(rows)[missing], return_inverse=True)
+    found, found_scores = self._compute(unique, self.top_k)
+    neighbours[missing], scores[missing] = found[inverse, :k], found_scores[inverse, :k]
+
+    with self._lock:
+      if version == self._version:
+        for row, row_neighbours, row_scores in zip(unique.tolist(), found, found_scores):
+          self._lists[row] = (row_neighbours, row_scores)
+          self._lists.move_to_end(row)
+        while len(self._lists) > self.max_rows:
+          self._lists.popitem(last=False)
+    return neighbours, scores
+
+  def _invalidate(self, row: int, may_enter: bool):
+    """Drop `row`'s list and the cached lists that contain it or, if
+    `may_enter`, that it now scores high enough to enter."""
+    with self._lock:
+      self._version += 1
+      self._lists.pop(row, None)
+      cached = list(self._lists.items())
+    if not cached:
+      return
+
+    cached_rows = np.array([r for r, _ in cached])
+    stale = np.array([(neighbours == row).any() for _, (neighbours, _) in cached])
+    if may_enter:
+      # Similarity is symmetric, so these are also the row's scores in each list
+      scores = self.embeddings.score_rows(np.array([row]), self.aspect_weights, columns=cached_rows)[0]
+      floors = np.array([row_scores[-1] for _, (_, row_scores) in cached])
+      stale |= scores > floors
+    with self._lock:
+      for r in cached_rows[stale].tolist():
+        self._lists.pop(r, None)
+
+  def copy(self, embeddings: EmbeddingStore) -> "LazySimilarityIndex":
+    """A copy over `embeddings` that starts with this index's cached
+    lists and can be invalidated while readers keep using this one."""
+    index = LazySimilarityIndex(embeddings, self.aspect_weights, top_k=self.top_k,
+                                max_rows=self.max_rows, block_size=self.block_size)
+    with self._lock:
+      index._lists = OrderedDict(self._lists)
+      index.hits, index.misses = self.hits, self.misses
+    return index
+
+  def update_row(self, row: int):
+    self._invalidate(row, may_enter=True)
+
+  def move_row(self, old: int, new: int):
+    self._invalidate(old, may_enter=False)
+
+  def remove_row(self, row: int):
+    self._invalidate(row, may_enter=False)
+
+  def get_similar_properties(self, property_id: str) -> List[Tuple[str, float]]:
+    row = self.embeddings.rows.get(property_id)
+    if row is None:
+      return []
+    neighbours, scores = self.get_similar_rows(np.array([row]))
+    ids = self.embeddings.ids
+    return [(ids[col], float(score)) for col, score in zip(neighbours[0], scores[0]) if col >= 0]
@@ -0,0 +1,183 @@
+"""Paginated, concurrent loading of the catalog from Supabase.
+
+PostgREST silently caps every response at its max-rows setting, so each
+table is read with keyset pagination (`id > last_id ORDER BY id`). The uuid
+keyspace is split into ranges that are paged concurrently. Image embeddings
+are parsed one page at a time into float32 arrays and summed straight into
+preallocated per-property buffers, so load time grows linearly with the
+number of images and no per-image arrays are kept.
+"""
+import threading
+import uuid
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+from metrics import phase
+from property_embedding import IMAGE_ASPECTS
+from views import ViewLog, parse_timestamp
+
+PROPERTY_FIELDS = "id,bedrooms,bathrooms,price,status,neighbourhood,interior_size_sqm"
+PROPERTY_IMAGE_FIELDS = "id,property_id,aspect,embedding"
+NEIGHBOURHOOD_FIELDS = "id,embeddings"
+PROPERTY_VIEW_FIELDS = "id,property_id,user_id,viewed_at"
+# Only these statuses are recommended
+LISTED_STATUSES = ["for_rent", "for_sale"]
+
+
+@dataclass
+class Catalog:
+  properties: List[dict]
+  rows: Dict[str, int]
+  image_sums: Dict[str, np.ndarray] = field(default_factory=dict)
+  image_counts: Dict[str, np.ndarray] = field(default_factory=dict)
+  neighbourhoods: Dict[str, np.ndarray] = field(default_factory=dict)
+
+  def images(self, row: int) -> Tuple[Dict[str, Optional[np.ndarray]], Dict[str, int]]:
+    """Per-aspect image mean and count for one property row."""
+    means, counts = {}, {}
+    for aspect in IMAGE_ASPECTS:
+      count = int(self.image_counts[aspect][row]) if aspect in self.image_counts else 0
+      counts[aspect] = count
+      means[aspect] = self.image_sums[aspect][row] / count if count else None
+    return means, counts
+
+
+class CatalogLoader:
+  def __init__(self, client, page_size: int = 1000, partitions: int = 8, workers: int = 4):
+    self.client = client
+    # Must not exceed the PostgREST max-rows setting
+    self.page_size = page_size
+    self.partitions = partitions
+    self.workers = workers
+
+  def _ranges(self) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Split the uuid keyspace into `partitions` contiguous [lower, upper) ranges."""
+    bounds = [str(uuid.UUID(int=i * (1 << 128) // self.partitions)) for i in range(1, self.partitions)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+  def _pages(self,
+             table: str,
+             fields: str,
+             lower: Optional[str] = None,
+             upper: Optional[str] = None,
+             filters: Optional[Callable] = None):
+    """Yield pages of `table` within [lower, upper) using keyset pagination."""
+    last_id = None
+    while True:
+      query = self.client.table(table).select(fields).order("id").limit(self.page_size)
+      if last_id is not None:
+        query = query.gt("id", last_id)
+      elif lower is not None:
+        query = query.gte("id", lower)
+      if upper is not None:
+        query = query.lt("id", upper)
+      if filters is not None:
+        query = filters(query)
+
+      page = query.execute().data
+      if page:
+        yield page
+      if len(page) < self.page_size:
+        return
+      last_id = page[-1]["id"]
+
+  def _fetch(self, table: str, fields: str, consume: Callable[[List[dict]], None], filters=None):
+    """Page through every range of `table` concurrently, passing each page to `consume`."""
+    def fetch_range(bounds):
+      for page in self._pages(table, fields, *bounds, filters=filters):
+        consume(page)
+
+    with ThreadPoolExecutor(max_workers=self.workers) as executor:
+      # list() re-raises the first worker exception
+      list(executor.map(fetch_range, self._ranges()))
+
+  def load_properties(self) -> List[dict]:
+    pages = []
+    self._fetch("properties", PROPERTY_FIELDS, pages.append,
+                filters=lambda query: query.in_("status", LISTED_STATUSES))
+    return [prop for page in pages for prop in page]
+
+  def load_neighbourhoods(self) -> Dict[str, np.ndarray]:
+    neighbourhoods = {}
+    for page in self._pages("neighbourhoods", NEIGHBOURHOOD_FIELDS):
+      for n in page:
+        if n["embeddings"] is not None:
+          neighbourhoods[n["id"]] = np.array(n["embeddings"], dtype=np.float32)
+    return neighbourhoods
+
+  def load_images(self, rows: Dict[str, int]) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Per-property sums and counts of image embeddings for each aspect."""
+    sums: Dict[str, np.ndarray] = {}
+    counts = {aspect: np.zeros(len(rows), dtype=np.int32) for aspect in IMAGE_ASPECTS}
+    lock = threading.Lock()
+
+    def consume(page):
+      for aspect in IMAGE_ASPECTS:
+        selected = [
+          img for img in page
+          if img["aspect"] == aspect and img["embedding"] and img["property_id"] in rows
+        ]
+        if not selected:
+          continue
+        # One C-level conversion per page rather than one array per image
+        with phase("parse"):
+          vectors = np.array([img["embedding"] for img in selected], dtype=np.float32)
+          indices = np.array([rows[img["property_id"]] for img in selected], dtype=np.int64)
+
+        with lock:
+          if aspect not in sums:
+            sums[aspect] = np.zeros((len(rows), vectors.shape[1]), dtype=np.float32)
+          np.add.at(sums[aspect], indices, vectors)
+          counts[aspect] += np.bincount(indices, minlength=len(rows)).astype(np.int32)
+
+    self._fetch("property_images", PROPERTY_IMAGE_FIELDS, consume)
+    return sums, counts
+
+  def load_views(self) -> ViewLog:
+    """The whole property_views table as a ViewLog."""
+    pages = []
+    self._fetch("property_views", PROPERTY_VIEW_FIELDS, pages.append)
+    return ViewLog.from_records(
+      (view["property_id"], view["user_id"], parse_timestamp(view["viewed_at"]))
+      for page in pages for view in page
+    )
+
+  def load(self) -> Catalog:
+    with phase("fetch"), ThreadPoolExecutor(max_workers=2) as executor:
+      # Neighbourhoods are small and independent of the other tables
+      neighbourhoods = executor.submit(self.load_neighbourhoods)
+      properties = self.load_properties()
+      rows = {prop["id"]: row for row, prop in enumerate(properties)}
+      image_sums, image_counts = self.load_images(rows)
+      return Catalog(properties, rows, image_sums, image_counts, neighbourhoods.result())
+
+  def load_property(self, property_id: str) -> Optional[Catalog]:
+    """Load a single property as a one-row Catalog, or None if it does not exist."""
+    properties = self.client.table("properties").select(PROPERTY_FIELDS).eq("id", property_id).execute().data
+    if not properties:
+      return None
+    prop = properties[0]
+
+    catalog = Catalog([prop], {property_id: 0})
+    images = self.client.table("property_images").select(PROPERTY_IMAGE_FIELDS)\
+      .eq("property_id", property_id).execute().data
+    for aspect in IMAGE_ASPECTS:
+      vectors = [img["embedding"] for img in images if img["aspect"] == aspect and img["embedding"]]
+      if vectors:
+        catalog.image_sums[aspect] = np.array(vectors, dtype=np.float32).sum(axis=0, keepdims=True)
+        catalog.image_counts[aspect] = np.array([len(vectors)], dtype=np.int32)
+
+    if prop["neighbourhood"] is not None:
+      neighbourhood = self.load_neighbourhood(prop["neighbourhood"])
+      if neighbourhood is not None:
+        catalog.neighbourhoods[prop["neighbourhood"]] = neighbourhood
+
+    return catalog
+
+  def load_neighbourhood(self, neighbourhood_id: str) -> Optional[np.ndarray]:
+    neighbourhoods = self.client.table("neighbourhoods").select(NEIGHBOURHOOD_FIELDS)\
+      .eq("id", neighbourhood_id).execute().data
+    if neighbourhoods and neighbourhoods[0]["embeddings"] is not None:
+      return np.array(neighbourhoods[0]["embeddings"], dtype=np.float32)
+    return None
@@ -1,13 +1,28 @@
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
 import os
+import json
+import hashlib
+import threading
+import time
 import numpy as np
 from collections import defaultdict
 from supabase import create_client
 from recommendation_engine import RecommendationEngine
+from attribute_index import PropertyFilter
 from property_embedding import PropertyEmbedding
+from embedding_store import EmbeddingStore
+from snapshot import load_snapshot, save_snapshot
+from loader import Catalog, CatalogLoader
+from rebuild_worker import IndexRebuilder
+from shared_index import SharedIndex
+from response_cache import ResponseCache
+from coview import CoViewIndex
+from views import parse_timestamp
+from metrics import REQUEST_SECONDS, IndexCollector, phase
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 import uvicorn
 
 if os.getenv("ENV") != "production":
@@ -18,6 +33,11 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+loader = CatalogLoader(
+  supabase,
+  page_size=int(os.getenv("RECOMMENDATIONS_PAGE_SIZE", "1000")),
+  workers=int(os.getenv("RECOMMENDATIONS_LOAD_WORKERS", "4"))
+)
 app = FastAPI()
 
 # Config
@@ -38,82 +58,379 @@ aspect_weights = {
 
 max_images = {"interior": 10, "exterior": 5 }
 
+# Aspect weights can be tuned without a code change, e.g. '{"metadata": 0.5, ...}'
+if os.getenv("RECOMMENDATIONS_ASPECT_WEIGHTS"):
+  aspect_weights = json.loads(os.getenv("RECOMMENDATIONS_ASPECT_WEIGHTS"))
+
+# "exact" precomputes every top-k list, "ann" serves from an IVF index,
+# "lazy" computes exact lists on demand
+index_mode = os.getenv("RECOMMENDATIONS_INDEX_MODE", "exact")
+ann_probes = int(os.getenv("RECOMMENDATIONS_ANN_PROBES", "8"))
+# Neighbour lists kept by the "lazy" mode, which computes them on first request
+lazy_rows = int(os.getenv("RECOMMENDATIONS_LAZY_ROWS", "50000"))
+# Per-aspect candidates kept so weights can be re-ranked without a rebuild
+aspect_candidates = int(os.getenv("RECOMMENDATIONS_ASPECT_CANDIDATES", "0"))
+# float32 | float16 | int8 storage of the image aspects for full scans
+vector_precision = os.getenv("RECOMMENDATIONS_VECTOR_PRECISION", "float32")
+
+# Co-view signal from property_views, blended in with ?coview_weight=
+coview_enabled = os.getenv("RECOMMENDATIONS_COVIEW") == "1"
+coview_window = int(os.getenv("RECOMMENDATIONS_COVIEW_WINDOW", "5"))
+
+# Incremental updates leave inactive rows behind; a rebuild is scheduled to
+# drop them once they make up this fraction of the index
+max_inactive_fraction = float(os.getenv("RECOMMENDATIONS_MAX_INACTIVE_FRACTION", "0.2"))
+
+# Index snapshots used for warm startup
+snapshot_dir = os.getenv(
+  "RECOMMENDATIONS_SNAPSHOT_DIR", os.path.join(os.path.dirname(__file__), "snapshots"))
+
 # Internal state
+# Neighbourhood embeddings seen at the last load, for query-time embedding
+neighbourhood_vectors: Dict[str, np.ndarray] = {}
 engine = RecommendationEngine(
-  metadata_weights, max_images, aspect_weights, top_k=10
+  metadata_weights, max_images, aspect_weights, top_k=10,
+  mode=index_mode, n_probe=ann_probes, aspect_candidates=aspect_candidates,
+  precision=vector_precision, lazy_rows=lazy_rows,
+  # The float32 re-rank rows of quantized stores are paged in from here
+  spill_dir=os.path.join(snapshot_dir, "spill")
 )
 
+# Serialized recommendation responses, keyed by index generation and
+# invalidated per property on incremental updates
+response_cache = ResponseCache(int(os.getenv("RECOMMENDATIONS_CACHE_SIZE", "10000")),
+                               current_generation=lambda: engine.index_generation)
+cache_control = f"public, max-age={int(os.getenv('RECOMMENDATIONS_CACHE_MAX_AGE', '30'))}"
+
+REGISTRY.register(IndexCollector(engine, response_cache))
+
 
 class ViewHistoryRequest(BaseModel):
   viewed_ids: List[str]
+  k: int = Field(10, ge=1, le=100)
+  # "profile" scores the whole catalog against the history in one pass,
+  # "merge" combines the precomputed top-k lists of each viewed property
+  mode: Literal["profile", "merge"] = "profile"
+
+
+class RerankRequest(BaseModel):
+  property_id: str
+  aspect_weights: Dict[str, float]
+  k: Optional[int] = Field(None, ge=1, le=100)
+
+
+class BatchRequest(BaseModel):
+  property_ids: List[str] = Field(..., min_length=1, max_length=200)
+  k: Optional[int] = Field(None, ge=1, le=100)
+
+
+class QueryRequest(BaseModel):
+  """A listing that is not indexed, e.g. a draft or one whose images are
+  still being embedded."""
+  status: Literal["for_rent", "for_sale"]
+  bedrooms: Optional[float] = None
+  bathrooms: Optional[float] = None
+  price: Optional[float] = None
+  interior_size_sqm: Optional[float] = None
+  neighbourhood: Optional[str] = None
+  # Image embeddings per aspect, as stored in property_images
+  images: Dict[Literal["interior", "exterior"], List[List[float]]] = {}
+  # Never recommended, e.g. the listing's own out-of-date row
+  property_id: Optional[str] = None
+  k: int = Field(10, ge=1, le=100)
+
+
+class WebhookRequest(BaseModel):
+  type: Literal["INSERT", "UPDATE", "DELETE"]
+  table: str
+  record: Optional[dict] = None
+  old_record: Optional[dict] = None
+
+
+def build_property_embedding(prop, catalog):
+  """Build a PropertyEmbedding for one properties row of a loaded Catalog.
+
+  Returns None for properties that are neither for rent nor for sale.
+  """
+  metadata = {k: v for k, v in prop.items() if not k in ["id", "neighbourhood"]}
+
+  if metadata["status"] == "for_rent":
+    metadata["status"] = 0
+  elif metadata["status"] == "for_sale":
+    metadata["status"] = 1
+  else:
+    return None
+
+  image_means, image_counts = catalog.images(catalog.rows[prop["id"]])
+  return PropertyEmbedding.from_aggregates(
+    metadata=metadata,
+    image_means=image_means,
+    image_counts=image_counts,
+    neighbourhood=catalog.neighbourhoods.get(prop["neighbourhood"]),
+    max_images=max_images,
+    metadata_weights=metadata_weights,
+    attributes={
+      "status": prop["status"],
+      "price": prop["price"],
+      "bedrooms": prop["bedrooms"],
+      "neighbourhood": prop["neighbourhood"],
+    }
+  )
 
 
 def load_embeddings():
-  property_fields = "id,bedrooms,bathrooms,price,status,neighbourhood,interior_size_sqm"
-  properties = supabase.table("properties").select(property_fields).execute().data
+  """Fetch the whole catalog into a new EmbeddingStore, without touching the engine."""
+  catalog = loader.load()
+  neighbourhood_vectors.update(catalog.neighbourhoods)
 
-  property_image_fields = "property_id,aspect,embedding"
-  images = supabase.table("property_images").select(property_image_fields).execute().data
+  embeddings = EmbeddingStore(capacity=len(catalog.properties), precision=vector_precision)
+  with phase("embed"):
+    for prop in catalog.properties:
+      embedding = build_property_embedding(prop, catalog)
 
-  neighbourhood_fields = "id,embeddings"
-  neighbourhoods = supabase.table("neighbourhoods").select(neighbourhood_fields).execute().data
+      # Ignore properties that are not for rent or sale
+      if embedding is not None:
+        embeddings.upsert(prop["id"], embedding)
+
+  return embeddings
 
-  neighbhourhoods_map = {
-    n["id"]: np.array(n["embeddings"], dtype=np.float32) for n in neighbourhoods
-  }
 
-  grouped = defaultdict(lambda: defaultdict(list))
-  for img in images:
-    grouped[img["property_id"]][img["aspect"]].append(
-      np.array(img["embedding"], dtype=np.float32))
+def refresh_property(property_id):
+  """Re-fetch a single property and patch it into the index in place."""
+  catalog = loader.load_property(property_id)
+  with phase("embed"):
+    embedding = build_property_embedding(catalog.properties[0], catalog) if catalog else None
 
-  embeddings = {}
-  for prop in properties:
-    pid = prop["id"]
-    metadata = {k: v for k, v in prop.items() if not k in ["id", "neighbourhood"]}
+  if embedding is None:
+    return engine.remove_property(property_id)
+  return engine.upsert_property(property_id, embedding)
 
-    if metadata["status"] == "for_rent":
-      metadata["status"] = 0
-    elif metadata["status"] == "for_sale":
-      metadata["status"] = 1
+
+def refresh_coview():
+  try:
+    engine.coview = CoViewIndex.from_views(loader.load_views(), window=coview_window)
+    print(f"Loaded co-view index with {engine.coview.nnz} pairs")
+  except Exception as e:
+    print(f"Failed to load co-view index: {e}")
+
+
+def persist_snapshot():
+  try:
+    if shared_index:
+      shared_index.publish()
     else:
-      # Ignore properties that are not for rent or sale
-      continue
-
-    prop_data = {
-      "metadata": metadata,
-      "images": {
-        "interior": grouped[pid].get("interior", []),
-        "exterior": grouped[pid].get("exterior", []),
-      },
-      "neighbourhood": neighbhourhoods_map.get(prop["neighbourhood"], None)
-    }
+      save_snapshot(engine, snapshot_dir)
+  except OSError as e:
+    print(f"Failed to save index snapshot: {e}")
+
+
+rebuilder = IndexRebuilder(
+  engine,
+  load_embeddings,
+  delay=float(os.getenv("RECOMMENDATIONS_REBUILD_DELAY", "5")),
+  on_published=persist_snapshot
+)
+
+
+def apply_update(update):
+  """Apply a webhook update or rebuild request to this process's index."""
+  if update["type"] == "rebuild":
+    rebuilder.request()
+    return
+
+  if update["type"] == "remove":
+    changed = engine.remove_property(update["property_id"])
+  else:
+    changed = refresh_property(update["property_id"])
+  # Drops the responses read from any list the update changed
+  response_cache.invalidate(changed)
+  store = engine.embeddings
+  if store.inactive_rows > max_inactive_fraction * store.size:
+    rebuilder.request()
+  if shared_index:
+    shared_index.mark_dirty()
+
+
+def dispatch_update(update):
+  """Apply an update here, or forward it when another worker owns the index."""
+  if shared_index and not shared_index.is_publisher:
+    shared_index.submit(update)
+  else:
+    apply_update(update)
 
-    embeddings[pid] = PropertyEmbedding.from_property(prop_data, max_images, metadata_weights)
 
-  engine.embeddings = embeddings
-  engine.build_similarity_index()
+def start_publishing():
+  rebuilder.start()
+  if engine.index:
+    # Serve from the snapshot right away and catch up with the database
+    rebuilder.request(delay=0)
+  else:
+    rebuilder.rebuild_now()
+
+
+# With several workers, one publishes the index and the rest map its snapshots
+shared_index = None
+if os.getenv("RECOMMENDATIONS_SHARED_INDEX") == "1":
+  shared_index = SharedIndex(
+    engine,
+    snapshot_dir,
+    poll_interval=float(os.getenv("RECOMMENDATIONS_SHARED_POLL_INTERVAL", "1")),
+    snapshot_interval=float(os.getenv("RECOMMENDATIONS_SHARED_SNAPSHOT_INTERVAL", "10")),
+    handle_update=apply_update,
+    on_promoted=start_publishing
+  )
 
 
 @app.on_event("startup")
 def startup_event():
-  load_embeddings()
+  if coview_enabled:
+    # Recommendations are served content-only until it is loaded
+    threading.Thread(target=refresh_coview, daemon=True).start()
+
+  if shared_index:
+    shared_index.attach()
+    if shared_index.try_promote():
+      start_publishing()
+    shared_index.start()
+    return
+
+  snapshot = load_snapshot(engine, snapshot_dir)
+  if snapshot:
+    print(f"Loaded index snapshot {snapshot}")
+  start_publishing()
+
+def etag_matches(if_none_match, etag):
+  if not if_none_match:
+    return False
+  tags = [tag.strip() for tag in if_none_match.split(",")]
+  tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+  return "*" in tags or etag in tags
+
+
+def cached_response(request, key, compute, ids=None):
+  """Serve `compute()` as JSON, cached per index generation and
+  revalidated through its ETag. `key` names the route and its parameters.
+  `ids` are the properties whose precomputed lists the response is read
+  from; it is dropped when an update changes one of them. Responses that
+  scan beyond those lists pass None and are dropped by every update.
+  """
+  key = (engine.index_generation, *key)
+  version = response_cache.version
+  body = response_cache.get(key)
+  if body is None:
+    result = compute()
+    body = json.dumps(result, separators=(",", ":")).encode()
+    response_cache.put(key, body, ids, version)
+
+  # Entries outlive incremental updates, so the tag follows the content
+  etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+  headers = {"ETag": etag, "Cache-Control": cache_control}
+  if etag_matches(request.headers.get("if-none-match"), etag):
+    return Response(status_code=304, headers=headers)
+  return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+  start = time.perf_counter()
+  response = await call_next(request)
+  # Label by route template, not raw path, to bound the number of series
+  route = request.scope.get("route")
+  REQUEST_SECONDS.labels(
+    request.method, route.path if route else "unmatched", str(response.status_code)
+  ).observe(time.perf_counter() - start)
+  return response
+
+
+@app.get("/metrics")
+def metrics():
+  return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
 
 @app.get("/")
 def root():
   return {"message": "API is live!"}
 
 @app.get("/recommendations/{property_id}")
-def get_similar(property_id: str):
-  try:
-    recommendations = engine.get_recommendations(property_id)
+def get_similar(property_id: str,
+                request: Request,
+                status: Optional[List[str]] = Query(None),
+                neighbourhood: Optional[List[str]] = Query(None),
+                min_price: Optional[float] = None,
+                max_price: Optional[float] = None,
+                min_bedrooms: Optional[float] = None,
+                max_bedrooms: Optional[float] = None,
+                coview_weight: float = Query(0.0, ge=0.0, le=1.0)):
+  filters = PropertyFilter(
+    status=status,
+    neighbourhood=neighbourhood,
+    min_price=min_price,
+    max_price=max_price,
+    min_bedrooms=min_bedrooms,
+    max_bedrooms=max_bedrooms
+  )
+  if coview_weight and filters:
+    raise HTTPException(400, detail="coview_weight cannot be combined with filters")
+
+  def compute():
+    if coview_weight:
+      recommendations = engine.get_blended_recommendations(property_id, coview_weight)
+    else:
+      recommendations = engine.get_recommendations(property_id, filters)
+    return {"recommended_ids": [rec[0] for rec in recommendations]}
+
+  key = ("similar", property_id, tuple(status or ()), tuple(neighbourhood or ()),
+         min_price, max_price, min_bedrooms, max_bedrooms)
+  if coview_weight:
+    coview = engine.coview
+    key += (coview_weight, coview.nnz if coview else 0, coview.version if coview else 0)
+  # Unknown ids get an empty list on every path. Filtered and blended
+  # results are scored beyond the precomputed list
+  return cached_response(request, key, compute, None if filters or coview_weight else [property_id])
+
+
+@app.post("/recommendations/rerank")
+def rerank(req: RerankRequest, request: Request):
+  """Recommendations under trial aspect weights, scored at query time."""
+  unknown = set(req.aspect_weights) - set(aspect_weights)
+  if unknown:
+    raise HTTPException(400, detail=f"Unknown aspects: {sorted(unknown)}")
+
+  def compute():
+    recommendations = engine.rerank_recommendations(req.property_id, req.aspect_weights, k=req.k)
     return {"recommended_ids": [rec[0] for rec in recommendations]}
-  except KeyError:
-    raise HTTPException(404, detail="Property not found")
+
+  key = ("rerank", req.property_id, tuple(sorted(req.aspect_weights.items())), req.k)
+  return cached_response(request, key, compute)
+
+
+@app.post("/recommendations/batch")
+def get_batch(req: BatchRequest, request: Request):
+  """Recommended ids for every requested property, e.g. all cards of a
+  listing page. Unknown ids are returned under "missing".
+  """
+  def compute():
+    recommendations = engine.get_batch_recommendations(req.property_ids, k=req.k)
+    missing = [pid for pid in dict.fromkeys(req.property_ids) if pid not in recommendations]
+    return {"recommended_ids": recommendations, "missing": missing}
+
+  # Lists longer than the precomputed ones are scored over the catalog
+  ids = req.property_ids if (req.k or engine.top_k) <= engine.top_k else None
+  return cached_response(request, ("batch", tuple(req.property_ids), req.k), compute, ids)
 
 
 @app.post("/recommendations/from-history")
-def get_from_history(req: ViewHistoryRequest):
+def get_from_history(req: ViewHistoryRequest, request: Request):
+  return cached_response(
+    request, ("history", tuple(req.viewed_ids), req.k, req.mode), lambda: history_recommendations(req),
+    req.viewed_ids if req.mode == "merge" else None)
+
+
+def history_recommendations(req: ViewHistoryRequest):
+  if req.mode == "profile":
+    recommendations = engine.get_history_recommendations(req.viewed_ids, k=req.k)
+    return {"recommended_ids": [rec[0] for rec in recommendations]}
+
   all_recs = []
   for i, pid in enumerate(reversed(req.viewed_ids)):
     weight = 1 / (i + 1)
@@ -126,12 +443,84 @@ def get_from_history(req: ViewHistoryRequest):
   for score, rid in all_recs:
     score_map[rid] += score
 
-  sorted_recs = sorted(score_map.items(), key=lambda x: x[0], reverse=True)[:10]
+  sorted_recs = sorted(score_map.items(), key=lambda x: x[1], reverse=True)[:req.k]
   return {"recommended_ids": [r[0] for r in sorted_recs]}
 
+@app.post("/recommendations/query")
+def query_recommendations(req: QueryRequest):
+  """Recommendations for a listing given as raw fields rather than an
+  indexed id, scored against the catalog without touching the index.
+  """
+  prop = {
+    "id": req.property_id or "query",
+    "bedrooms": req.bedrooms,
+    "bathrooms": req.bathrooms,
+    "price": req.price,
+    "status": req.status,
+    "neighbourhood": req.neighbourhood,
+    "interior_size_sqm": req.interior_size_sqm,
+  }
+  catalog = Catalog([prop], {prop["id"]: 0})
+  for aspect, vectors in req.images.items():
+    if vectors:
+      if len({len(vector) for vector in vectors}) > 1:
+        raise HTTPException(400, detail=f"{aspect} embeddings differ in length")
+      catalog.image_sums[aspect] = np.array(vectors, dtype=np.float32).sum(axis=0, keepdims=True)
+      catalog.image_counts[aspect] = np.array([len(vectors)], dtype=np.int32)
+  if req.neighbourhood is not None:
+    vector = neighbourhood_vectors.get(req.neighbourhood)
+    if vector is None:
+      vector = loader.load_neighbourhood(req.neighbourhood)
+    if vector is not None:
+      catalog.neighbourhoods[req.neighbourhood] = vector
+
+  try:
+    recommendations = engine.get_embedding_recommendations(
+      build_property_embedding(prop, catalog), k=req.k, exclude=req.property_id)
+  except ValueError as e:
+    raise HTTPException(400, detail=str(e))
+  return {"recommended_ids": [rec[0] for rec in recommendations]}
+
+
 @app.get("/on-properties-update/")
 def add_property():
-  load_embeddings()
+  """Schedule a full rebuild. Bursts of calls are debounced into one."""
+  dispatch_update({"type": "rebuild"})
+  return {"status": "scheduled"}
+
+
+@app.post("/on-properties-update/")
+def on_properties_update(req: WebhookRequest):
+  """Incrementally patch the index from a Supabase database webhook on
+  the properties or property_images table, or record a new row of
+  property_views in the co-view index.
+  """
+  record = req.record or req.old_record or {}
+  if req.table == "property_views":
+    # Co-views are kept per worker and are not forwarded to the publisher
+    if req.type == "INSERT" and engine.coview is not None and record.get("property_id"):
+      # viewed_at defaults to now() in the table, so a missing one is a view made just now
+      try:
+        viewed_at = parse_timestamp(record["viewed_at"]) if record.get("viewed_at") else time.time()
+      except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+      engine.coview.add_view(record["property_id"], record.get("user_id"), viewed_at)
+    return {"status": "ok"}
+
+  if req.table == "properties":
+    property_id = record.get("id")
+  elif req.table == "property_images":
+    property_id = record.get("property_id")
+  else:
+    raise HTTPException(400, detail=f"Unsupported table: {req.table}")
+
+  if not property_id:
+    raise HTTPException(400, detail="Missing property id in webhook record")
+
+  removed = req.table == "properties" and req.type == "DELETE"
+  dispatch_update({"type": "remove" if removed else "refresh", "property_id": property_id})
+
+  return {"status": "ok"}
 
 
 if __name__ == "__main__":
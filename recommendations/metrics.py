@@ -0,0 +1,94 @@
+"""Prometheus metrics of the recommendations service.
+
+Phase timings are observed where the work happens: "fetch" is a whole
+catalog load, "parse" one page of image embeddings, "embed" building the
+PropertyEmbeddings of a catalog (or of one refreshed property), "build"
+indexing a store and "swap" replaying the journal and publishing. Index
+gauges are read from the engine's published state at scrape time, so they
+cost nothing between scrapes.
+"""
+import time
+from contextlib import contextmanager
+from prometheus_client import Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from property_embedding import ASPECTS
+
+PHASE_SECONDS = Histogram(
+  "recommendations_phase_seconds",
+  "Duration of index loading and building phases",
+  ["phase"],
+  buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600),
+)
+
+REQUEST_SECONDS = Histogram(
+  "recommendations_request_seconds",
+  "HTTP request latency by route",
+  ["method", "route", "status"],
+  buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+@contextmanager
+def phase(name: str):
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    PHASE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+class IndexCollector:
+  """Gauges describing the engine's currently published index."""
+
+  def __init__(self, engine, response_cache=None):
+    self.engine = engine
+    self.response_cache = response_cache
+
+  def collect(self):
+    engine = self.engine
+    state = engine.state
+    store = state.embeddings
+
+    properties = GaugeMetricFamily("recommendations_properties", "Properties in the index")
+    properties.add_metric([], len(store))
+    yield properties
+
+    active = store.active
+    missing = GaugeMetricFamily(
+      "recommendations_rows_missing_aspect", "Indexed properties without a vector for an aspect", labels=["aspect"])
+    for aspect in ASPECTS:
+      missing.add_metric([aspect], int((active & (store.norms(aspect) == 0)).sum()))
+    yield missing
+
+    inactive = GaugeMetricFamily("recommendations_inactive_rows", "Removed rows kept until the next rebuild")
+    inactive.add_metric([], store.inactive_rows)
+    yield inactive
+
+    index_bytes = GaugeMetricFamily("recommendations_index_bytes", "Bytes held by the index", labels=["part"])
+    index_bytes.add_metric(["embeddings"], store.nbytes)
+    for part, index in [("similarity_matrix", state.similarity_matrix), ("ann_index", state.ann_index),
+                        ("lazy_index", state.lazy_index), ("aspect_components", state.components),
+                        ("coview", engine.coview)]:
+      if index is not None:
+        index_bytes.add_metric([part], index.nbytes)
+    yield index_bytes
+
+    if state.lazy_index is not None:
+      rows = GaugeMetricFamily("recommendations_lazy_rows", "Neighbour lists held by the lazy index")
+      rows.add_metric([], state.lazy_index.cached_rows)
+      yield rows
+      lookups = CounterMetricFamily(
+        "recommendations_lazy_lookups", "Lazy index lookups of neighbour lists", labels=["result"])
+      lookups.add_metric(["hit"], state.lazy_index.hits)
+      lookups.add_metric(["miss"], state.lazy_index.misses)
+      yield lookups
+
+    if self.response_cache is not None:
+      entries = GaugeMetricFamily("recommendations_response_cache_entries", "Cached responses")
+      entries.add_metric([], len(self.response_cache))
+      yield entries
+      lookups = CounterMetricFamily(
+        "recommendations_response_cache_lookups", "Response cache lookups", labels=["result"])
+      lookups.add_metric(["hit"], self.response_cache.hits)
+      lookups.add_metric(["miss"], self.response_cache.misses)
+      yield lookups
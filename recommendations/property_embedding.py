@@ -4,6 +4,10 @@ from typing import Dict, List, Optional
 from dataclasses import dataclass
 
 
+ASPECTS = ["metadata", "interior", "exterior", "neighbourhood"]
+IMAGE_ASPECTS = ["interior", "exterior"]
+
+
 @dataclass
 class PropertyEmbedding:
   metadata_embedding: np.ndarray
@@ -16,35 +20,57 @@ class PropertyEmbedding:
   exterior_confidence: float = 0.0
   neighbourhood_confidence: float = 0.0
 
+  # Raw filterable fields (status, price, bedrooms, neighbourhood id)
+  attributes: Optional[dict] = None
+
   @classmethod
   def from_property(cls,
                     property_data: dict,
                     max_images: Dict[str, int],
                     metadata_weights: Dict[str, float]):
-    metadata = property_data.get('metadata', {})
     images = property_data.get('images', {})
+    return cls.from_aggregates(
+      metadata=property_data.get('metadata', {}),
+      image_means={aspect: cls.average_embedding(images.get(aspect, [])) for aspect in IMAGE_ASPECTS},
+      image_counts={aspect: len(images.get(aspect, [])) for aspect in IMAGE_ASPECTS},
+      neighbourhood=property_data.get('neighbourhood'),
+      max_images=max_images,
+      metadata_weights=metadata_weights,
+      attributes=property_data.get('attributes')
+    )
 
+  @classmethod
+  def from_aggregates(cls,
+                      metadata: dict,
+                      image_means: Dict[str, Optional[np.ndarray]],
+                      image_counts: Dict[str, int],
+                      neighbourhood: Optional[np.ndarray],
+                      max_images: Dict[str, int],
+                      metadata_weights: Dict[str, float],
+                      attributes: Optional[dict] = None):
+    """Build from per-aspect image means and counts instead of raw image lists."""
     metadata_emb = cls.embed_metadata(metadata, metadata_weights)
-    interior_emb = cls.average_embedding(images.get('interior', []))
-    exterior_emb = cls.average_embedding(images.get('exterior', []))
     # If neighbourhood is not defined, we return the zero vector
     # When calculating the similarity, the cosine similarity will handle cases when the vector is zero
-    neighbourhood_emb = property_data.get('neighbourhood', np.array([0], dtype=np.float32))
+    neighbourhood_emb = neighbourhood
+    if neighbourhood_emb is None:
+      neighbourhood_emb = np.array([0], dtype=np.float32)
 
     metadata_conf = cls.compute_metadata_confidence(metadata, metadata_weights)
-    interior_conf = cls.compute_image_confidence(images.get('interior', []), max_images.get('interior', 1))
-    exterior_conf = cls.compute_image_confidence(images.get('exterior', []), max_images.get('exterior', 1))
+    interior_conf = cls.image_count_confidence(image_counts.get('interior', 0), max_images.get('interior', 1))
+    exterior_conf = cls.image_count_confidence(image_counts.get('exterior', 0), max_images.get('exterior', 1))
     neighbourhood_conf = 1.0 if neighbourhood_emb.size > 0 else 0.0
 
     return cls(
       metadata_embedding=metadata_emb,
-      interior_embedding=interior_emb,
-      exterior_embedding=exterior_emb,
+      interior_embedding=image_means.get('interior'),
+      exterior_embedding=image_means.get('exterior'),
       neighbourhood_embedding=neighbourhood_emb,
       metadata_confidence=metadata_conf,
       interior_confidence=interior_conf,
       exterior_confidence=exterior_conf,
-      neighbourhood_confidence=neighbourhood_conf
+      neighbourhood_confidence=neighbourhood_conf,
+      attributes=attributes
     )
 
   @staticmethod
@@ -69,5 +95,8 @@ class PropertyEmbedding:
 
   @staticmethod
   def compute_image_confidence(images: List[np.ndarray], max_images: int) -> float:
-    n = len(images)
+    return PropertyEmbedding.image_count_confidence(len(images), max_images)
+
+  @staticmethod
+  def image_count_confidence(n: int, max_images: int) -> float:
     return math.log(n + 1) / math.log(max_images + 1) if max_images > 0 else 0.0
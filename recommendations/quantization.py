@@ -0,0 +1,84 @@
+import numpy as np
+from typing import Optional
+
+PRECISIONS = ("float32", "float16", "int8")
+
+
+class QuantizedMatrix:
+  """Reduced-precision copy of a matrix of L2-normalised rows.
+
+  float16 halves the memory of float32. int8 stores every row as codes in
+  [-127, 127] with its own float32 scale, max|x| / 127, so a row costs a
+  quarter of its float32 size plus four bytes. Dot products dequantize
+  `block_size` rows at a time, so temporary memory stays
+  O(block_size * dim) however large the matrix is.
+  """
+
+  def __init__(self, precision: str, codes: np.ndarray, scales: Optional[np.ndarray] = None, block_size: int = 8192):
+    if precision not in PRECISIONS[1:]:
+      raise ValueError(f"Unknown quantized precision: {precision}")
+    self.precision = precision
+    self.codes = codes
+    # Per-row scales, int8 only
+    self.scales = scales if scales is not None else np.ones(len(codes), dtype=np.float32)
+    self.block_size = block_size
+
+  @classmethod
+  def quantize(cls, matrix: np.ndarray, precision: str, **kwargs) -> "QuantizedMatrix":
+    quantized = cls(precision, np.zeros(matrix.shape, dtype=np.float16 if precision == "float16" else np.int8),
+                    np.zeros(len(matrix), dtype=np.float32), **kwargs)
+    for start in range(0, len(matrix), quantized.block_size):
+      block = slice(start, start + quantized.block_size)
+      quantized._set_rows(block, np.asarray(matrix[block], dtype=np.float32))
+    return quantized
+
+  def __len__(self) -> int:
+    return len(self.codes)
+
+  @property
+  def nbytes(self) -> int:
+    return self.codes.nbytes + self.scales.nbytes
+
+  def _set_rows(self, rows, vectors: np.ndarray):
+    if self.precision == "float16":
+      self.codes[rows] = vectors
+      self.scales[rows] = 1
+      return
+    peaks = np.abs(vectors).max(axis=-1)
+    scales = np.where(peaks > 0, peaks / 127, 1).astype(np.float32)
+    self.codes[rows] = np.rint(vectors / scales[..., None]).astype(np.int8)
+    self.scales[rows] = scales
+
+  def copy(self) -> "QuantizedMatrix":
+    """A copy sharing the code and scale arrays, which `grow` replaces
+    rather than resizes."""
+    return QuantizedMatrix(self.precision, self.codes, self.scales, self.block_size)
+
+  def set_row(self, row: int, vector: np.ndarray):
+    self._set_rows(row, vector.astype(np.float32))
+
+  def grow(self, capacity: int):
+    missing = capacity - len(self.codes)
+    if missing > 0:
+      self.codes = np.concatenate([self.codes, np.zeros((missing, self.codes.shape[1]), dtype=self.codes.dtype)])
+      self.scales = np.concatenate([self.scales, np.ones(missing, dtype=np.float32)])
+
+  def dequantize(self, rows) -> np.ndarray:
+    vectors = self.codes[rows].astype(np.float32)
+    if self.precision == "int8":
+      vectors *= self.scales[rows][..., None]
+    return vectors
+
+  def dot(self, queries: np.ndarray, size: int, columns: Optional[np.ndarray] = None) -> np.ndarray:
+    """Approximate `queries @ matrix.T` against the first `size` rows, or
+    only against `columns`."""
+    n = size if columns is None else len(columns)
+    result = np.empty((len(queries), n), dtype=np.float32)
+    for start in range(0, n, self.block_size):
+      block = slice(start, min(start + self.block_size, n))
+      rows = block if columns is None else columns[block]
+      # Scales are applied to the small product, not the dequantized block
+      result[:, block] = queries @ self.codes[rows].astype(np.float32).T
+      if self.precision == "int8":
+        result[:, block] *= self.scales[rows]
+    return result
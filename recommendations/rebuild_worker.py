@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Callable, Optional
+from embedding_store import EmbeddingStore
+
+
+class IndexRebuilder:
+  """Rebuilds the engine's index on a background thread.
+
+  `request()` only schedules work, so webhook handlers return immediately.
+  Requests are debounced: a burst arriving within `delay` seconds of each
+  other triggers a single rebuild, and a steady stream still rebuilds at
+  least every `max_delay` seconds. A request that arrives while a rebuild
+  is running schedules one more rebuild after it.
+  """
+
+  def __init__(self,
+               engine,
+               load_embeddings: Callable[[], EmbeddingStore],
+               delay: float = 5.0,
+               max_delay: float = 60.0,
+               on_published: Optional[Callable[[], None]] = None):
+    self.engine = engine
+    self.load_embeddings = load_embeddings
+    self.delay = delay
+    self.max_delay = max_delay
+    self.on_published = on_published
+
+    self._condition = threading.Condition()
+    self._due: Optional[float] = None
+    self._deadline: Optional[float] = None
+    self._thread: Optional[threading.Thread] = None
+    self.rebuilds = 0
+
+  def start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name="index-rebuilder", daemon=True)
+      self._thread.start()
+
+  def request(self, delay: Optional[float] = None):
+    """Schedule a rebuild `delay` seconds from now, merging with pending requests."""
+    now = time.monotonic()
+    with self._condition:
+      if self._deadline is None:
+        self._deadline = now + self.max_delay
+      self._due = min(now + (self.delay if delay is None else delay), self._deadline)
+      self._condition.notify()
+
+  def rebuild_now(self):
+    """Rebuild synchronously on the calling thread."""
+    self.engine.rebuild(self.load_embeddings)
+    self.rebuilds += 1
+    if self.on_published:
+      self.on_published()
+
+  def _wait_until_due(self):
+    with self._condition:
+      while True:
+        if self._due is None:
+          self._condition.wait()
+          continue
+        remaining = self._due - time.monotonic()
+        if remaining <= 0:
+          self._due = self._deadline = None
+          return
+        self._condition.wait(remaining)
+
+  def _run(self):
+    while True:
+      self._wait_until_due()
+      try:
+        self.rebuild_now()
+      except Exception as e:
+        print(f"Index rebuild failed: {e}")
@@ -1,6 +1,43 @@
-from typing import Dict, List, Tuple, Optional
-from similarity_matrix import SimilarityMatrix
+import threading
+import uuid
+import numpy as np
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple, Optional, Union
+from similarity_matrix import SimilarityMatrix, rerank, select_top_k
+from ann_index import IVFIndex
+from aspect_components import AspectComponents
+from lazy_index import LazySimilarityIndex
+from coview import CoViewIndex
+from attribute_index import PropertyFilter
 from property_embedding import PropertyEmbedding
+from embedding_store import EmbeddingStore
+from metrics import phase
+
+
+@dataclass
+class EngineState:
+  """Everything a query reads, published as a single reference."""
+  embeddings: EmbeddingStore
+  similarity_matrix: Optional[SimilarityMatrix] = None
+  ann_index: Optional[IVFIndex] = None
+  lazy_index: Optional[LazySimilarityIndex] = None
+  components: Optional[AspectComponents] = None
+
+  def copy(self) -> "EngineState":
+    """A copy to apply an incremental update to while queries keep reading
+    this state. The store shares its row data; the indexes copy theirs."""
+    store = self.embeddings.copy()
+
+    def copy_index(index):
+      return index.copy(store) if index is not None else None
+
+    return EngineState(
+      store,
+      similarity_matrix=copy_index(self.similarity_matrix),
+      ann_index=copy_index(self.ann_index),
+      lazy_index=copy_index(self.lazy_index),
+      components=copy_index(self.components),
+    )
 
 
 class RecommendationEngine:
@@ -8,23 +45,484 @@ class RecommendationEngine:
                 metadata_weights: Dict[str, float],
                 max_images: Dict[str, int],
                 aspect_weights: Dict[str, float],
-                top_k: int = 10):
+                top_k: int = 10,
+                mode: str = "exact",
+                n_probe: int = 8,
+                aspect_candidates: int = 0,
+                precision: str = "float32",
+                lazy_rows: int = 50000,
+                spill_dir: Optional[str] = None):
+    if mode not in ("exact", "ann", "lazy"):
+      raise ValueError(f"Unknown index mode: {mode}")
+
     self.metadata_weights = metadata_weights
     self.max_images = max_images
     self.aspect_weights = aspect_weights
     self.top_k = top_k
-    self.embeddings: Dict[str, PropertyEmbedding] = {}
-    self.similarity_matrix: Optional[SimilarityMatrix] = None
+    # "exact" precomputes every top-k list, "ann" answers at query time from
+    # an IVF index; n_probe is its recall-vs-latency knob. "lazy" computes
+    # exact lists on first request and keeps up to lazy_rows of them.
+    self.mode = mode
+    self.n_probe = n_probe
+    self.lazy_rows = lazy_rows
+    # In exact mode, also keep per-aspect components of this many best
+    # candidates per aspect, so aspect weights can be changed without a
+    # rebuild. 0 disables them.
+    self.aspect_candidates = aspect_candidates
+    # Storage of the image aspects: "float16" and "int8" scan quantized
+    # copies and re-rank shortlists in float32, which are memory-mapped
+    # from files in spill_dir (the temp directory by default) once built
+    self.precision = precision
+    self.spill_dir = spill_dir
+    self.state = EngineState(EmbeddingStore(precision=precision))
+    # Behavioural co-view signal, blended into content scores on request.
+    # Lives outside EngineState: it is fed by views, not by catalog updates.
+    self.coview: Optional[CoViewIndex] = None
 
-  def build_similarity_index(self):
-    self.similarity_matrix = SimilarityMatrix(
-        embeddings=self.embeddings,
+    # Changes whenever the served recommendations may change. Unique per
+    # process, so two workers never label different results the same way.
+    self._generation_prefix = uuid.uuid4().hex[:12]
+    self._generation_counter = 0
+    self.generation = self._next_generation()
+    # Changes only when the whole state is replaced, not on incremental
+    # updates, e.g. to key caches that invalidate updated ids themselves
+    self.index_generation = self.generation
+
+    # Serialises writers. Readers never lock: they read `self.state` once.
+    self._lock = threading.Lock()
+    # Incremental updates made while a rebuild is in flight, replayed onto
+    # the new state before it is published
+    self._journal: Optional[List[Tuple[str, Optional[PropertyEmbedding]]]] = None
+
+  @property
+  def embeddings(self) -> EmbeddingStore:
+    return self.state.embeddings
+
+  @embeddings.setter
+  def embeddings(self, embeddings: EmbeddingStore):
+    self.state = EngineState(embeddings)
+    self.generation = self.index_generation = self._next_generation()
+
+  def _next_generation(self) -> str:
+    self._generation_counter += 1
+    return f"{self._generation_prefix}-{self._generation_counter}"
+
+  @property
+  def similarity_matrix(self) -> Optional[SimilarityMatrix]:
+    return self.state.similarity_matrix
+
+  @property
+  def ann_index(self) -> Optional[IVFIndex]:
+    return self.state.ann_index
+
+  @property
+  def index(self) -> Optional[Union[SimilarityMatrix, IVFIndex]]:
+    return self._index(self.state)
+
+  def _index(self, state: EngineState) -> Optional[Union[SimilarityMatrix, IVFIndex]]:
+    if self.mode == "ann":
+      return state.ann_index
+    if self.mode == "lazy":
+      return state.lazy_index
+    return state.similarity_matrix
+
+  def build_state(self, embeddings: Union[EmbeddingStore, Dict[str, PropertyEmbedding]]) -> EngineState:
+    """Build a complete index for `embeddings` without touching the live state."""
+    with phase("build"):
+      state = self._build_state(embeddings)
+    if state.embeddings.quantized:
+      state.embeddings.spill(self.spill_dir)
+    return state
+
+  def _build_state(self, embeddings: Union[EmbeddingStore, Dict[str, PropertyEmbedding]]) -> EngineState:
+    if isinstance(embeddings, dict):
+      embeddings = EmbeddingStore.from_embeddings(embeddings, precision=self.precision)
+
+    if self.mode == "ann":
+      return EngineState(embeddings, ann_index=IVFIndex(
+          embeddings=embeddings,
+          aspect_weights=self.aspect_weights,
+          top_k=self.top_k,
+          n_probe=self.n_probe
+      ))
+    if self.mode == "lazy":
+      return EngineState(embeddings, lazy_index=LazySimilarityIndex(
+          embeddings, self.aspect_weights, top_k=self.top_k, max_rows=self.lazy_rows
+      ))
+    if self.aspect_candidates >= self.top_k:
+      # The candidates include each row's exact combined top-k, so the
+      # matrix is read off the components instead of a second O(N^2) pass
+      components = AspectComponents(embeddings, self.aspect_weights, per_aspect=self.aspect_candidates)
+      neighbours, scores = components.recombine(self.aspect_weights, self.top_k)
+      return EngineState(embeddings, similarity_matrix=SimilarityMatrix(
+          embeddings=embeddings,
+          aspect_weights=self.aspect_weights,
+          top_k=self.top_k,
+          neighbours=neighbours,
+          scores=scores
+      ), components=components)
+
+    components = None
+    if self.aspect_candidates:
+      components = AspectComponents(embeddings, self.aspect_weights, per_aspect=self.aspect_candidates)
+    return EngineState(embeddings, similarity_matrix=SimilarityMatrix(
+        embeddings=embeddings,
         aspect_weights=self.aspect_weights,
         top_k=self.top_k
-    )
+    ), components=components)
+
+  def publish(self, state: EngineState, generation: Optional[str] = None):
+    """Swap in a new state. `generation` names it, e.g. after a snapshot
+    version, so processes serving the same snapshot agree on it.
+    """
+    with phase("swap"), self._lock:
+      self.state = state
+      self.generation = self.index_generation = generation or self._next_generation()
+
+  def build_similarity_index(self):
+    self.publish(self.build_state(self.embeddings))
+
+  def rebuild(self, load_embeddings: Callable[[], EmbeddingStore]):
+    """Load and index a fresh catalog off to the side, then swap it in.
 
-  def get_recommendations(self, property_id: str) -> List[Tuple[str, float]]:
-    if not self.similarity_matrix:
+    Incremental updates that arrive while building are applied to the live
+    state as usual and replayed onto the new state just before the swap.
+    """
+    with self._lock:
+      self._journal = []
+    try:
+      state = self.build_state(load_embeddings())
+      with phase("swap"), self._lock:
+        for property_id, embedding in self._journal:
+          self._apply(state, property_id, embedding)
+        self.state = state
+        self.generation = self.index_generation = self._next_generation()
+    finally:
+      with self._lock:
+        self._journal = None
+
+  def _apply(self,
+             state: EngineState,
+             property_id: str,
+             embedding: Optional[PropertyEmbedding]) -> Optional[List[str]]:
+    """Patch `state` in place and return the ids whose neighbour lists
+    changed, the property's own included. None means any may have: the
+    ann and lazy indexes search at query time and cannot tell.
+    """
+    index = self._index(state)
+    store = state.embeddings
+    if embedding is None:
+      row = store.remove(property_id)
+      if row is None:
+        return [property_id]
+      changed = index.remove_row(row) if index else []
+      if state.components is not None:
+        state.components.remove_row(row)
+    else:
+      old = store.rows.get(property_id)
+      row = store.upsert(property_id, embedding)
+      if old is not None and old != row:
+        for patched in (index, state.components):
+          if patched:
+            patched.move_row(old, row)
+      changed = index.update_row(row) if index else []
+      if state.components is not None:
+        state.components.update_row(row)
+    if changed is None:
+      return None
+    ids = [store.ids[r] for r in np.asarray(changed).tolist()]
+    return [property_id] + [pid for pid in ids if pid is not None and pid != property_id]
+
+  def _update(self, property_id: str, embedding: Optional[PropertyEmbedding]) -> Optional[List[str]]:
+    # Copy-on-write: readers keep the state they read until the patched
+    # copy is swapped in
+    with self._lock:
+      state = self.state.copy()
+      changed = self._apply(state, property_id, embedding)
+      self.state = state
+      self.generation = self._next_generation()
+      if self._journal is not None:
+        self._journal.append((property_id, embedding))
+    return changed
+
+  def upsert_property(self, property_id: str, embedding: PropertyEmbedding) -> Optional[List[str]]:
+    """Insert or overwrite a property. Returns the ids whose neighbour
+    lists changed, or None if any may have."""
+    return self._update(property_id, embedding)
+
+  def remove_property(self, property_id: str) -> Optional[List[str]]:
+    """Remove a property. Returns the ids whose neighbour lists changed,
+    or None if any may have."""
+    return self._update(property_id, None)
+
+  def get_recommendations(self,
+                          property_id: str,
+                          filters: Optional[PropertyFilter] = None) -> List[Tuple[str, float]]:
+    state = self.state
+    index = self._index(state)
+    if not index:
         raise Exception(
             "Similarity matrix not built. Call build_similarity_index() first.")
-    return self.similarity_matrix.get_similar_properties(property_id)
+    if not filters:
+      return index.get_similar_properties(property_id)
+    return self._filtered_recommendations(state, property_id, filters)
+
+  def get_blended_recommendations(self,
+                                  property_id: str,
+                                  coview_weight: float,
+                                  k: Optional[int] = None) -> List[Tuple[str, float]]:
+    """Recommendations scored (1 - coview_weight) * content + coview_weight * co-view,
+    with co-view scores divided by the candidates' highest.
+
+    Candidates are the property's content neighbours and its most co-viewed
+    indexed properties; both signals are computed exactly for every
+    candidate. Unknown ids have no recommendations, as in the unblended
+    lookup.
+    """
+    state = self.state
+    index = self._index(state)
+    if not index:
+        raise Exception(
+            "Similarity matrix not built. Call build_similarity_index() first.")
+    store = state.embeddings
+    row = store.rows.get(property_id)
+    if row is None:
+      return []
+    k = k or self.top_k
+
+    candidates, _ = index.get_similar_rows(np.array([row]), k)
+    candidates = candidates[0]
+    coview = self.coview
+    if coview is not None:
+      coviewed = [store.rows.get(pid, -1) for pid, _ in coview.get_similar_properties(property_id, k)]
+      candidates = np.concatenate([candidates, np.array(coviewed, dtype=candidates.dtype)])
+    candidates = np.unique(candidates[candidates >= 0])
+    candidates = candidates[store.active[candidates] & (candidates != row)]
+
+    content = store.score_rows(np.array([row]), self.aspect_weights, columns=candidates)[0]
+    behaviour = np.zeros(len(candidates), dtype=np.float32)
+    if coview is not None:
+      behaviour = coview.scores(property_id, [store.ids[col] for col in candidates])
+      # Co-view scores have no fixed scale; the most co-viewed candidate gets 1
+      if behaviour.max(initial=0) > 0:
+        behaviour = behaviour / behaviour.max()
+    scores = ((1 - coview_weight) * content + coview_weight * behaviour)[None, :]
+
+    top, top_scores = select_top_k(scores, k)
+    found = top[0] >= 0
+    return [(store.ids[candidates[col]], float(score)) for col, score in zip(top[0][found], top_scores[0][found])]
+
+  def rerank_recommendations(self,
+                             property_id: str,
+                             aspect_weights: Dict[str, float],
+                             k: Optional[int] = None) -> List[Tuple[str, float]]:
+    """Recommendations under different aspect weights, without a rebuild.
+
+    Candidates are the property's current neighbours plus, when kept, its
+    per-aspect candidates (exact mode) or the probed IVF lists (ann mode);
+    they are scored exactly under `aspect_weights`. Unknown ids have no
+    recommendations, as in the other lookups.
+    """
+    state = self.state
+    index = self._index(state)
+    if not index:
+        raise Exception(
+            "Similarity matrix not built. Call build_similarity_index() first.")
+    store = state.embeddings
+    row = store.rows.get(property_id)
+    if row is None:
+      return []
+    k = k or self.top_k
+
+    if self.mode == "ann":
+      rows, scores = index.search_row(row, k, aspect_weights=aspect_weights)
+      return [(store.ids[r], float(score)) for r, score in zip(rows, scores)]
+
+    candidates = index.get_similar_rows(np.array([row]))[0][0]
+    if state.components is not None:
+      candidates = np.concatenate([candidates, state.components.row_candidates(row)])
+    candidates = np.unique(candidates[(candidates >= 0) & (candidates != row)])
+
+    scores = store.score_rows(np.array([row]), aspect_weights, columns=candidates)
+    top, top_scores = select_top_k(scores, k)
+    found = top[0] >= 0
+    return [(store.ids[candidates[col]], float(score)) for col, score in zip(top[0][found], top_scores[0][found])]
+
+  def recombine(self, aspect_weights: Dict[str, float], k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbour rows and scores of every row under different aspect
+    weights, from the stored per-aspect components. Fast enough to grid
+    search weights offline.
+    """
+    components = self.state.components
+    if components is None:
+      raise ValueError("Aspect components are not kept; set aspect_candidates to enable them")
+    return components.recombine(aspect_weights, k or self.top_k)
+
+  def apply_aspect_weights(self, aspect_weights: Dict[str, float]):
+    """Serve with new aspect weights without an O(N^2) rebuild.
+
+    Exact mode recombines the lists from the stored components, so they
+    are limited to the kept candidates until the next full rebuild; ann
+    mode keeps its lists and only scores differently. Lazy mode starts an
+    empty cache under the new weights.
+    """
+    with self._lock:
+      state = self.state
+      store = state.embeddings
+      if self.mode == "ann":
+        index = state.ann_index
+        ann_index = IVFIndex(store, aspect_weights, top_k=self.top_k, n_probe=self.n_probe,
+                             centroids=index.centroids, assignments=index.assignments)
+        self.state = EngineState(store, ann_index=ann_index)
+      elif self.mode == "lazy":
+        self.state = EngineState(store, lazy_index=LazySimilarityIndex(
+          store, aspect_weights, top_k=self.top_k, max_rows=self.lazy_rows))
+      else:
+        if state.components is None:
+          raise ValueError("Aspect components are not kept; set aspect_candidates to enable them")
+        neighbours, scores = state.components.recombine(aspect_weights, self.top_k)
+        matrix = SimilarityMatrix(store, aspect_weights, top_k=self.top_k, neighbours=neighbours, scores=scores)
+        self.state = EngineState(store, similarity_matrix=matrix, components=state.components)
+      self.aspect_weights = aspect_weights
+      self.generation = self.index_generation = self._next_generation()
+
+  def get_batch_recommendations(self,
+                                property_ids: List[str],
+                                k: Optional[int] = None) -> Dict[str, List[str]]:
+    """Recommended ids for many properties with one gather over the index.
+
+    Unknown ids are left out of the result.
+    """
+    state = self.state
+    index = self._index(state)
+    if not index:
+        raise Exception(
+            "Similarity matrix not built. Call build_similarity_index() first.")
+
+    store = state.embeddings
+    known = [pid for pid in dict.fromkeys(property_ids) if pid in store.rows]
+    rows = np.array([store.rows[pid] for pid in known], dtype=np.int64)
+    neighbours, _ = index.get_similar_rows(rows, k or self.top_k)
+
+    ids = store.ids
+    return {
+      pid: [ids[col] for col in columns if col >= 0]
+      for pid, columns in zip(known, neighbours.tolist())
+    }
+
+  def _filtered_recommendations(self,
+                                state: EngineState,
+                                property_id: str,
+                                filters: PropertyFilter) -> List[Tuple[str, float]]:
+    """Exact top-k among the properties matching `filters`.
+
+    Unknown ids have no recommendations, like in the unfiltered lookup.
+    """
+    store = state.embeddings
+    row = store.rows.get(property_id)
+    if row is None:
+      return []
+    mask = store.attributes.mask(filters, store.size) & store.active
+    mask[row] = False
+
+    matrix = state.similarity_matrix
+    if matrix is not None:
+      # The precomputed list is the head of the full ranking, so when all of
+      # it passes the filter it already is the filtered top-k
+      neighbours = matrix.neighbours[row]
+      if (neighbours >= 0).all() and mask[neighbours].all():
+        return [(store.ids[col], float(score)) for col, score in zip(neighbours, matrix.scores[row])]
+
+    # Otherwise score only the matching columns
+    columns = np.flatnonzero(mask)
+    scores = store.score_rows(np.array([row]), self.aspect_weights, columns=columns, approximate=store.quantized)
+    if store.quantized:
+      shortlist, _ = select_top_k(scores, self.top_k * store.rerank_factor)
+      shortlist = np.where(shortlist >= 0, columns[np.maximum(shortlist, 0)], -1)
+      top, top_scores = rerank(store, np.array([row]), shortlist, self.aspect_weights, self.top_k)
+    else:
+      top, top_scores = select_top_k(scores, self.top_k)
+      top = np.where(top >= 0, columns[np.maximum(top, 0)], -1)
+    found = top[0] >= 0
+    return [(store.ids[col], float(score)) for col, score in zip(top[0][found], top_scores[0][found])]
+
+  def get_embedding_recommendations(self,
+                                    embedding: PropertyEmbedding,
+                                    k: Optional[int] = None,
+                                    exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+    """Recommendations for a property that is not indexed, e.g. a draft
+    listing, scored against the whole catalog in one vectorized pass. The
+    index is not touched. `exclude` is an id never returned, such as the
+    listing's own stale row.
+    """
+    store = self.state.embeddings
+    k = k or self.top_k
+    vectors, confidences = store.query(embedding)
+    scores = store.score(vectors, confidences, self.aspect_weights, approximate=store.quantized)
+    if exclude in store.rows:
+      scores[0, store.rows[exclude]] = -np.inf
+
+    top, top_scores = select_top_k(scores, k * store.rerank_factor if store.quantized else k)
+    if store.quantized:
+      # Re-rank the approximate shortlist exactly
+      shortlist = top[0][top[0] >= 0]
+      exact = store.score(vectors, confidences, self.aspect_weights, columns=shortlist)
+      columns, top_scores = select_top_k(exact, k)
+      # Padding columns of -1 pick the appended -1
+      top = np.append(shortlist, -1)[columns]
+    found = top[0] >= 0
+    return [(store.ids[row], float(score)) for row, score in zip(top[0][found], top_scores[0][found])]
+
+  def get_history_recommendations(self,
+                                  viewed_ids: List[str],
+                                  k: Optional[int] = None) -> List[Tuple[str, float]]:
+    """Rank the whole catalog against a recency-weighted profile of a history.
+
+    `viewed_ids` is ordered oldest to newest; the i-th most recent view is
+    weighted 1 / (i + 1). Each candidate's score is the weighted sum of its
+    similarity to every viewed property, computed in one vectorized pass.
+    Viewed and unknown ids are never returned.
+    """
+    store = self.state.embeddings
+    history = np.array([[store.rows.get(pid, -1) for pid in viewed_ids]], dtype=np.int64)
+    if not (history >= 0).any():
+      return []
+
+    neighbours, scores = self.get_history_rows(history, k, store=store)
+    found = neighbours[0] >= 0
+    return [(store.ids[row], float(score)) for row, score in zip(neighbours[0][found], scores[0][found])]
+
+  def get_history_rows(self,
+                       histories: np.ndarray,
+                       k: Optional[int] = None,
+                       block_size: int = 256,
+                       store: Optional[EmbeddingStore] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Batched from-history recommendations over store rows.
+
+    `histories` is (B, L), oldest to newest, with -1 for padding or unknown
+    properties; recency weights are as in get_history_recommendations.
+    Returns (B, k) neighbour rows and scores padded with -1 / -inf.
+    """
+    store = store or self.state.embeddings
+    k = k or self.top_k
+    length = histories.shape[1]
+    recency = (1 / (length - np.arange(length))).astype(np.float32)
+
+    neighbours = np.full((len(histories), k), -1, dtype=np.int32)
+    scores = np.full((len(histories), k), -np.inf, dtype=np.float32)
+    for start in range(0, len(histories), block_size):
+      block = histories[start:start + block_size]
+      valid = block >= 0
+      weights = np.broadcast_to(recency, block.shape)
+      block_scores = store.score_weighted_rows(block, weights, self.aspect_weights, approximate=store.quantized)
+      # Viewed properties are never recommended back
+      sets, positions = np.nonzero(valid)
+      block_scores[sets, block[sets, positions]] = -np.inf
+      block_scores[~valid.any(axis=1)] = -np.inf
+      if store.quantized:
+        shortlist, _ = select_top_k(block_scores, k * store.rerank_factor)
+        found = rerank(store, block, shortlist, self.aspect_weights, k, row_weights=weights)
+      else:
+        found = select_top_k(block_scores, k)
+      neighbours[start:start + block_size], scores[start:start + block_size] = found
+    return neighbours, scores
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, Optional, Set
+
+
+class ResponseCache:
+  """Thread-safe LRU cache of serialized responses.
+
+  Keys start with the index generation they were computed at, which only
+  changes when the whole index is replaced. The first entry of a newer
+  generation drops every older one; entries computed at an older generation
+  than `current_generation()` are not stored at all, so a slow request
+  cannot wipe newer entries.
+
+  Incremental updates keep the generation. Instead each entry records the
+  property ids whose neighbour lists it was read from, and `invalidate`
+  drops the entries of the ids whose lists an update changed. Entries
+  stored without ids depend on the whole index and are dropped by every
+  invalidation.
+  """
+
+  def __init__(self, max_entries: int = 10000, current_generation: Optional[Callable[[], Hashable]] = None):
+    self.max_entries = max_entries
+    self.current_generation = current_generation
+    self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+    # The None id stands for the whole index
+    self._keys_by_id: Dict[Optional[str], Set[Hashable]] = {}
+    self._ids_by_key: Dict[Hashable, Set[Optional[str]]] = {}
+    self._generation: Optional[Hashable] = None
+    # Bumped by every invalidation, so a response computed concurrently
+    # with one is not stored
+    self.version = 0
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key: tuple) -> Optional[bytes]:
+    with self._lock:
+      value = self._entries.get(key)
+      if value is None:
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return value
+
+  def put(self, key: tuple, value: bytes, ids: Optional[Iterable[str]] = None, version: Optional[int] = None):
+    """Store `value`, read from the lists of `ids` or, if None, from the
+    whole index. Nothing is stored if the generation is no longer current
+    or an invalidation happened since `version` was read."""
+    generation = key[0]
+    with self._lock:
+      if version is not None and version != self.version:
+        return
+      if self.current_generation is not None and generation != self.current_generation():
+        return
+      if generation != self._generation:
+        self._clear()
+        self._generation = generation
+      self._drop(key)
+      self._entries[key] = value
+      ids = {None} if ids is None else set(ids)
+      self._ids_by_key[key] = ids
+      for pid in ids:
+        self._keys_by_id.setdefault(pid, set()).add(key)
+      while len(self._entries) > self.max_entries:
+        self._drop(next(iter(self._entries)))
+
+  def invalidate(self, ids: Optional[Iterable[str]] = None):
+    """Drop the entries read from the lists of `ids`, and those read from
+    the whole index. With None, drop every entry."""
+    with self._lock:
+      self.version += 1
+      if ids is None:
+        self._clear()
+        return
+      for pid in [*ids, None]:
+        for key in list(self._keys_by_id.get(pid, ())):
+          self._drop(key)
+
+  def _drop(self, key: Hashable):
+    if self._entries.pop(key, None) is None:
+      return
+    for pid in self._ids_by_key.pop(key):
+      keys = self._keys_by_id[pid]
+      keys.discard(key)
+      if not keys:
+        del self._keys_by_id[pid]
+
+  def _clear(self):
+    self._entries.clear()
+    self._ids_by_key.clear()
+    self._keys_by_id.clear()
+
+  def __len__(self) -> int:
+    return len(self._entries)
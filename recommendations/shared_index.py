@@ -0,0 +1,154 @@
+"""One recommendation index shared by several worker processes.
+
+The workers coordinate through the snapshot directory. Whichever process
+holds an exclusive lock on it is the publisher: it loads the catalog,
+applies updates and writes snapshots. Every other worker is a follower that
+memory-maps the latest snapshot, so the page cache keeps one physical copy
+of the index for all processes, and re-attaches whenever the generation
+named in LATEST moves on. Followers forward the updates they receive to the
+publisher through a spool directory. If the publisher exits its lock is
+released, and the next follower to poll takes over.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional
+from snapshot import LATEST_FILE, load_snapshot, save_snapshot
+
+LOCK_FILE = "publisher.lock"
+UPDATES_DIR = "updates"
+
+
+class SharedIndex:
+  def __init__(self,
+               engine,
+               directory: str,
+               poll_interval: float = 1.0,
+               snapshot_interval: float = 10.0,
+               handle_update: Optional[Callable[[dict], None]] = None,
+               on_promoted: Optional[Callable[[], None]] = None):
+    self.engine = engine
+    self.directory = directory
+    self.poll_interval = poll_interval
+    # Minimum time between snapshots written for incremental updates
+    self.snapshot_interval = snapshot_interval
+    self.handle_update = handle_update
+    self.on_promoted = on_promoted
+
+    # Version of the snapshot being served; versions only ever increase
+    self.generation: Optional[str] = None
+    self.is_publisher = False
+    self._lock_file = None
+    self._dirty = False
+    self._last_snapshot = 0.0
+    self._thread: Optional[threading.Thread] = None
+    self._stopped = threading.Event()
+
+  def try_promote(self) -> bool:
+    """Become the publisher if no other process is."""
+    if self.is_publisher:
+      return True
+    os.makedirs(self.directory, exist_ok=True)
+    lock_file = open(os.path.join(self.directory, LOCK_FILE), "a")
+    try:
+      fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      lock_file.close()
+      return False
+    self._lock_file = lock_file
+    self.is_publisher = True
+    return True
+
+  def latest_generation(self) -> Optional[str]:
+    try:
+      with open(os.path.join(self.directory, LATEST_FILE)) as f:
+        return f.read().strip() or None
+    except FileNotFoundError:
+      return None
+
+  def attach(self) -> bool:
+    """Map the latest snapshot if it is newer than the one being served."""
+    latest = self.latest_generation()
+    if latest is None or latest == self.generation:
+      return False
+    path = load_snapshot(self.engine, self.directory)
+    if path is None:
+      return False
+    self.generation = os.path.basename(path)
+    return True
+
+  def publish(self) -> str:
+    """Write the engine's index as the next generation (publisher only)."""
+    self._dirty = False
+    path = save_snapshot(self.engine, self.directory)
+    self.generation = os.path.basename(path)
+    self._last_snapshot = time.monotonic()
+    return path
+
+  def mark_dirty(self):
+    """Note an incremental update that followers have not seen yet."""
+    self._dirty = True
+
+  def submit(self, update: dict):
+    """Forward an update to the publisher."""
+    spool = os.path.join(self.directory, UPDATES_DIR)
+    os.makedirs(spool, exist_ok=True)
+    name = f"{time.time_ns()}-{uuid.uuid4().hex}"
+    staging = os.path.join(spool, f".{name}.tmp")
+    with open(staging, "w") as f:
+      json.dump(update, f)
+    os.rename(staging, os.path.join(spool, f"{name}.json"))
+
+  def _drain(self) -> List[dict]:
+    spool = os.path.join(self.directory, UPDATES_DIR)
+    if not os.path.isdir(spool):
+      return []
+    updates = []
+    for name in sorted(name for name in os.listdir(spool) if name.endswith(".json")):
+      path = os.path.join(spool, name)
+      with open(path) as f:
+        updates.append(json.load(f))
+      os.remove(path)
+    return updates
+
+  def poll(self):
+    """One coordination step; the background thread runs this periodically."""
+    if not self.is_publisher and self.try_promote():
+      print("Promoted to index publisher")
+      if self.on_promoted:
+        self.on_promoted()
+
+    if not self.is_publisher:
+      self.attach()
+      return
+
+    for update in self._drain():
+      try:
+        self.handle_update(update)
+      except Exception as e:
+        print(f"Failed to apply forwarded update {update}: {e}")
+    if self._dirty and time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+      self.publish()
+
+  def start(self):
+    if self._thread is None:
+      self._thread = threading.Thread(target=self._run, name="shared-index", daemon=True)
+      self._thread.start()
+
+  def _run(self):
+    while not self._stopped.wait(self.poll_interval):
+      try:
+        self.poll()
+      except Exception as e:
+        print(f"Shared index poll failed: {e}")
+
+  def close(self):
+    """Stop polling and give up the publisher role."""
+    self._stopped.set()
+    if self._lock_file is not None:
+      self._lock_file.close()
+      self._lock_file = None
+    self.is_publisher = False
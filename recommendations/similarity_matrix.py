@@ -1,61 +1,245 @@
 import numpy as np
-import heapq
-from typing import Dict, List, Tuple
-from property_embedding import PropertyEmbedding
+from typing import Dict, List, Optional, Tuple
+from embedding_store import EmbeddingStore
+from property_embedding import ASPECTS
+
+
+def select_top_k(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+  """Partial selection of the top_k best columns per row, sorted descending.
+
+  Returns column indices and scores padded with -1 / -inf where a row has
+  fewer than top_k finite scores.
+  """
+  k = min(top_k, scores.shape[1])
+  neighbours = np.full((scores.shape[0], top_k), -1, dtype=np.int32)
+  neighbour_scores = np.full((scores.shape[0], top_k), -np.inf, dtype=np.float32)
+  if k == 0:
+    return neighbours, neighbour_scores
+
+  candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+  candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+  order = np.argsort(-candidate_scores, axis=1, kind="stable")
+  candidates = np.take_along_axis(candidates, order, axis=1)
+  candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+  valid = np.isfinite(candidate_scores)
+  neighbours[:, :k] = np.where(valid, candidates, -1)
+  neighbour_scores[:, :k] = candidate_scores
+  return neighbours, neighbour_scores
+
+
+def rerank(store: EmbeddingStore,
+           rows: np.ndarray,
+           candidates: np.ndarray,
+           aspect_weights: Dict[str, float],
+           top_k: int,
+           row_weights: Optional[np.ndarray] = None,
+           block_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+  """Exact float32 top-k of each row among its own (R, C) candidate rows,
+  padded with -1. Typically a shortlist found with approximate scores.
+
+  `rows` may also be (R, L) row sets with `row_weights`, scored as the
+  weighted sum over the set like EmbeddingStore.score_weighted_rows; rows
+  of -1 are ignored. Returns store rows and scores padded with -1 / -inf.
+  """
+  rows = rows[:, None] if rows.ndim == 1 else rows
+  row_weights = np.ones(rows.shape, dtype=np.float32) if row_weights is None else row_weights
+  row_weights = np.where(rows >= 0, row_weights, 0).astype(np.float32)
+  weights = np.array([aspect_weights.get(aspect, 0.0) for aspect in ASPECTS], dtype=np.float32)
+
+  scores = np.zeros(candidates.shape, dtype=np.float32)
+  # Blocks bound the (block, C, dim) gather of candidate vectors
+  for start in range(0, len(rows), block_size):
+    block = slice(start, start + block_size)
+    for position in range(rows.shape[1]):
+      components = store.pair_components(np.maximum(rows[block, position], 0), candidates[block])
+      scores[block] += row_weights[block, position, None] * (components @ weights)
+
+  valid = (candidates >= 0) & store.active[np.maximum(candidates, 0)]
+  scores[~valid] = -np.inf
+  columns, top_scores = select_top_k(scores, top_k)
+  found = np.take_along_axis(candidates, np.maximum(columns, 0), axis=1)
+  return np.where(columns >= 0, found, -1).astype(np.int32), top_scores
+
+
+def score_rows(store: EmbeddingStore,
+               rows: np.ndarray,
+               aspect_weights: Dict[str, float],
+               approximate: bool = False) -> np.ndarray:
+  """Scores of `rows` against every row; a property is never its own
+  recommendation."""
+  scores = store.score_rows(rows, aspect_weights, approximate=approximate)
+  scores[np.arange(len(rows)), rows] = -np.inf
+  return scores
+
+
+def top_k_rows(store: EmbeddingStore,
+               rows: np.ndarray,
+               aspect_weights: Dict[str, float],
+               k: int,
+               scores: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+  """Top-k of `rows` against the whole store. With a quantized store the
+  scan is approximate and its shortlist is re-ranked exactly; `scores` may
+  pass in an already computed scan.
+  """
+  if scores is None:
+    scores = score_rows(store, rows, aspect_weights, approximate=store.quantized)
+  if not store.quantized:
+    return select_top_k(scores, k)
+  shortlist, _ = select_top_k(scores, k * store.rerank_factor)
+  return rerank(store, rows, shortlist, aspect_weights, k)
 
 
 class SimilarityMatrix:
   def __init__(self,
-               embeddings: Dict[str, PropertyEmbedding],
+               embeddings: EmbeddingStore,
                aspect_weights: Dict[str, float],
-               top_k: int = 10):
+               top_k: int = 10,
+               block_size: int = 256,
+               neighbours: Optional[np.ndarray] = None,
+               scores: Optional[np.ndarray] = None):
     self.embeddings = embeddings
     self.aspect_weights = aspect_weights
     self.top_k = top_k
-    self.similarity_index = self._compute_similarity_matrix()
+    # Number of rows scored per matrix multiplication. Peak memory is
+    # O(block_size * N) instead of O(N^2).
+    self.block_size = block_size
+
+    # Top-k neighbour rows and scores per store row, padded with -1 / -inf.
+    # Previously computed arrays (e.g. from a snapshot) are used as-is.
+    if neighbours is not None and scores is not None:
+      self.neighbours, self.scores = neighbours, scores
+    else:
+      self.neighbours, self.scores = self._compute_similarity_matrix()
+
+  @property
+  def nbytes(self) -> int:
+    return self.neighbours.nbytes + self.scores.nbytes
+
+  def copy(self, embeddings: EmbeddingStore) -> "SimilarityMatrix":
+    """A copy over `embeddings` (a copy of this matrix's store) that can be
+    patched while readers keep using this one."""
+    return SimilarityMatrix(embeddings, self.aspect_weights, top_k=self.top_k, block_size=self.block_size,
+                            neighbours=self.neighbours.copy(), scores=self.scores.copy())
+
+  def _score_rows(self, rows: np.ndarray, approximate: bool = False) -> np.ndarray:
+    return score_rows(self.embeddings, rows, self.aspect_weights, approximate)
+
+  def _top_k_rows(self,
+                  rows: np.ndarray,
+                  k: Optional[int] = None,
+                  scores: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    return top_k_rows(self.embeddings, rows, self.aspect_weights, k or self.top_k, scores)
+
+  def _compute_similarity_matrix(self) -> Tuple[np.ndarray, np.ndarray]:
+    n = self.embeddings.size
+    neighbours = np.full((n, self.top_k), -1, dtype=np.int32)
+    scores = np.full((n, self.top_k), -np.inf, dtype=np.float32)
+
+    for start in range(0, n, self.block_size):
+      rows = np.arange(start, min(start + self.block_size, n))
+      neighbours[rows], scores[rows] = self._top_k_rows(rows)
+
+    return neighbours, scores
+
+  def _recompute_rows(self, rows: np.ndarray):
+    for start in range(0, len(rows), self.block_size):
+      block = rows[start:start + self.block_size]
+      self.neighbours[block], self.scores[block] = self._top_k_rows(block)
+
+  def _ensure_rows(self):
+    """Pad the neighbour arrays after rows were appended to the store."""
+    missing = self.embeddings.size - len(self.neighbours)
+    if missing > 0:
+      self.neighbours = np.vstack([self.neighbours, np.full((missing, self.top_k), -1, dtype=np.int32)])
+      self.scores = np.vstack([self.scores, np.full((missing, self.top_k), -np.inf, dtype=np.float32)])
+
+  def update_row(self, row: int) -> np.ndarray:
+    """Patch the index after a store row was inserted or overwritten, and
+    return the rows whose lists changed.
+
+    The row itself is recomputed. Every other row is only touched if the
+    property enters or leaves its top-k list; rows it leaves are recomputed
+    because their replacement candidate is unknown.
+    """
+    self._ensure_rows()
+    quantized = self.embeddings.quantized
+    scores = self._score_rows(np.array([row]), approximate=quantized)
+    self.neighbours[[row]], self.scores[[row]] = self._top_k_rows(np.array([row]), scores=scores)
+    scores = scores[0]
 
-  def _cosine_similarity(self, a: np.ndarray, b: np.ndarray) -> float:
-    if a is None or b is None or np.linalg.norm(a) == 0 or np.linalg.norm(b) == 0:
-      return 0.0
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    # Similarity is symmetric, so `scores` is also this property's score in
+    # every other row. The last column is each row's k-th (lowest) score.
+    listed = (self.neighbours == row).any(axis=1)
+    floors = self.scores[:, -1]
+    # Inactive rows have -inf floors but no list to patch
+    active = self.embeddings.active[:len(floors)]
+    enters = active & ~listed & (scores > floors)
+    stays = active & listed & (scores >= floors)
+    leaves = listed & ~stays
 
-  def _aspect_similarity(self, a: PropertyEmbedding, b: PropertyEmbedding) -> float:
-    total_score = 0.0
-    for aspect in ["metadata", "interior", "exterior", "neighbourhood"]:
-      emb_a = getattr(a, f"{aspect}_embedding")
-      emb_b = getattr(b, f"{aspect}_embedding")
-      conf_a = getattr(a, f"{aspect}_confidence")
-      conf_b = getattr(b, f"{aspect}_confidence")
+    patched = np.flatnonzero(enters | stays)
+    if patched.size and quantized:
+      # Listed scores are exact, so re-score the few patched rows
+      scores[patched] = self.embeddings.score_rows(np.array([row]), self.aspect_weights, columns=patched)[0]
+    if patched.size:
+      neighbours = self.neighbours[patched]
+      row_scores = self.scores[patched]
+      # Reuse the existing slot if already listed, otherwise evict the last
+      position = np.where(listed[patched], np.argmax(neighbours == row, axis=1), self.top_k - 1)
+      neighbours[np.arange(patched.size), position] = row
+      row_scores[np.arange(patched.size), position] = scores[patched]
 
-      aspect_weight = self.aspect_weights.get(aspect, 0.0)
-      confidence_weight = (conf_a + conf_b) / 2
+      order = np.argsort(-row_scores, axis=1, kind="stable")
+      self.neighbours[patched] = np.take_along_axis(neighbours, order, axis=1)
+      self.scores[patched] = np.take_along_axis(row_scores, order, axis=1)
 
-      sim = self._cosine_similarity(emb_a, emb_b)
-      weighted_sim = sim * confidence_weight * aspect_weight
+    self._recompute_rows(np.flatnonzero(leaves))
+    return np.union1d(np.flatnonzero(enters | stays | leaves), [row])
 
-      total_score += weighted_sim
+  def move_row(self, old: int, new: int):
+    """Point every list at a property's new store row before `update_row`
+    patches it, as if its old row had been overwritten."""
+    self._ensure_rows()
+    self.neighbours[self.neighbours == old] = new
+    self.neighbours[old] = -1
+    self.scores[old] = -np.inf
 
-    return float(total_score)
+  def remove_row(self, row: int) -> np.ndarray:
+    """Patch the index after a store row was deactivated, and return the
+    rows whose lists changed.
 
-  def _compute_similarity_matrix(self) -> Dict[str, List[Tuple[str, float]]]:
-    matrix = {}
-    ids = list(self.embeddings.keys())
+    Only the rows that listed the removed property are recomputed.
+    """
+    self.neighbours[row] = -1
+    self.scores[row] = -np.inf
+    listing = np.flatnonzero((self.neighbours == row).any(axis=1))
+    self._recompute_rows(listing)
+    return listing
 
-    for id_a in ids:
-      emb_a = self.embeddings[id_a]
-      heap = []
+  def get_similar_rows(self, rows: np.ndarray, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k neighbour rows and scores of many rows, padded with -1 / -inf.
 
-      for id_b in ids:
-        if id_a == id_b:
-          continue
-        emb_b = self.embeddings[id_b]
-        sim_score = self._aspect_similarity(emb_a, emb_b)
-        heapq.heappush(heap, (sim_score, id_b))
+    Up to top_k this is a gather from the precomputed arrays; longer lists
+    are scored on the fly.
+    """
+    k = k or self.top_k
+    if k <= self.top_k:
+      return self.neighbours[rows, :k], self.scores[rows, :k]
 
-      top_similar = heapq.nlargest(self.top_k, heap)
-      matrix[id_a] = [(id_b, score) for score, id_b in top_similar]
+    neighbours = np.full((len(rows), k), -1, dtype=np.int32)
+    scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+    for start in range(0, len(rows), self.block_size):
+      block = slice(start, start + self.block_size)
+      neighbours[block], scores[block] = self._top_k_rows(rows[block], k)
+    return neighbours, scores
 
-    return matrix
-  
   def get_similar_properties(self, property_id: str) -> List[Tuple[str, float]]:
-    return self.similarity_index.get(property_id, [])
+    row = self.embeddings.rows.get(property_id)
+    if row is None:
+      return []
+    ids = self.embeddings.ids
+    return [
+      (ids[col], float(score))
+      for col, score in zip(self.neighbours[row], self.scores[row]) if col >= 0
+    ]
@@ -0,0 +1,228 @@
+"""Versioned on-disk snapshots of the recommendation index.
+
+A snapshot is a directory of .npy files (aspect matrices and their
+quantized copies, norms, confidences, attribute columns, top-k arrays or
+IVF state) plus an ids.json, a categories.json and a manifest.json.
+Snapshots are written to a temporary directory and renamed into place, and
+the LATEST file is replaced atomically afterwards, so a crash never leaves
+a half-written snapshot behind the pointer. Loading memory-maps the
+arrays, so a restarted service can answer immediately and only pages in
+the rows it touches. Quantized copies are the exception: they are scanned
+in full, so they are read into memory.
+"""
+import json
+import os
+import shutil
+import time
+import numpy as np
+from typing import Optional
+from ann_index import IVFIndex
+from aspect_components import AspectComponents
+from attribute_index import CATEGORICAL_ATTRIBUTES, NUMERIC_ATTRIBUTES, AttributeIndex
+from embedding_store import EmbeddingStore
+from lazy_index import LazySimilarityIndex
+from property_embedding import ASPECTS, IMAGE_ASPECTS
+from quantization import QuantizedMatrix
+from recommendation_engine import EngineState
+from similarity_matrix import SimilarityMatrix
+
+SNAPSHOT_FORMAT = 2
+LATEST_FILE = "LATEST"
+
+
+def _manifest(engine, state: EngineState) -> dict:
+  return {
+    "format": SNAPSHOT_FORMAT,
+    "created_at": time.time(),
+    "mode": engine.mode,
+    "top_k": engine.top_k,
+    "aspect_weights": engine.aspect_weights,
+    "aspect_candidates": engine.aspect_candidates,
+    "precision": state.embeddings.precision,
+    "size": state.embeddings.size,
+  }
+
+
+def save_snapshot(engine, directory: str, keep: int = 2) -> str:
+  """Write the engine's current index to a new snapshot and return its path.
+
+  Only the `keep` most recent snapshots are retained.
+  """
+  # Read the published state once so a concurrent swap cannot mix versions
+  state = engine.state
+  store = state.embeddings
+  os.makedirs(directory, exist_ok=True)
+  version = f"{time.time_ns()}"
+  staging = os.path.join(directory, f".{version}.tmp")
+  os.makedirs(staging)
+
+  for aspect in ASPECTS:
+    np.save(os.path.join(staging, f"{aspect}_vectors.npy"), store.vectors(aspect))
+    np.save(os.path.join(staging, f"{aspect}_norms.npy"), store.norms(aspect))
+    np.save(os.path.join(staging, f"{aspect}_confidences.npy"), store.confidences(aspect))
+    quantized = store.quantized_vectors(aspect)
+    if quantized is not None:
+      np.save(os.path.join(staging, f"{aspect}_quantized.npy"), quantized.codes[:store.size])
+      np.save(os.path.join(staging, f"{aspect}_scales.npy"), quantized.scales[:store.size])
+  for name in CATEGORICAL_ATTRIBUTES:
+    np.save(os.path.join(staging, f"{name}_codes.npy"), store.attributes.codes(name)[:store.size])
+  for name in NUMERIC_ATTRIBUTES:
+    np.save(os.path.join(staging, f"{name}_values.npy"), store.attributes.numeric(name)[:store.size])
+
+  if engine.mode == "lazy":
+    # Lists are computed on demand; only the store is persisted
+    pass
+  elif engine.mode == "ann":
+    index = state.ann_index
+    np.save(os.path.join(staging, "assignments.npy"), index.assignments[:store.size])
+    for aspect, centroids in index.centroids.items():
+      np.save(os.path.join(staging, f"{aspect}_centroids.npy"), centroids)
+  else:
+    matrix = state.similarity_matrix
+    np.save(os.path.join(staging, "neighbours.npy"), matrix.neighbours[:store.size])
+    np.save(os.path.join(staging, "scores.npy"), matrix.scores[:store.size])
+    if state.components is not None:
+      np.save(os.path.join(staging, "candidates.npy"), state.components.candidates[:store.size])
+      np.save(os.path.join(staging, "components.npy"), state.components.components[:store.size])
+
+  with open(os.path.join(staging, "ids.json"), "w") as f:
+    json.dump(store.ids, f)
+  with open(os.path.join(staging, "categories.json"), "w") as f:
+    json.dump(store.attributes.categories, f)
+  # The manifest is written last; a snapshot without one is incomplete
+  with open(os.path.join(staging, "manifest.json"), "w") as f:
+    json.dump(_manifest(engine, state), f)
+
+  path = os.path.join(directory, version)
+  os.rename(staging, path)
+
+  pointer = os.path.join(directory, f".{LATEST_FILE}.tmp")
+  with open(pointer, "w") as f:
+    f.write(version)
+  os.replace(pointer, os.path.join(directory, LATEST_FILE))
+
+  for old in _versions(directory)[keep:]:
+    shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+  return path
+
+
+def _versions(directory: str):
+  """Snapshot versions in the directory, newest first."""
+  if not os.path.isdir(directory):
+    return []
+  versions = [name for name in os.listdir(directory) if name.isdigit()]
+  return sorted(versions, key=int, reverse=True)
+
+
+def _load(engine, path: str) -> bool:
+  with open(os.path.join(path, "manifest.json")) as f:
+    manifest = json.load(f)
+
+  # Snapshots built with different settings would serve the wrong lists
+  if (manifest["format"] != SNAPSHOT_FORMAT
+      or manifest["mode"] != engine.mode
+      or manifest["top_k"] != engine.top_k
+      or manifest["aspect_weights"] != engine.aspect_weights
+      or manifest.get("aspect_candidates", 0) != engine.aspect_candidates
+      or manifest.get("precision", "float32") != engine.precision):
+    return False
+
+  with open(os.path.join(path, "ids.json")) as f:
+    ids = json.load(f)
+  with open(os.path.join(path, "categories.json")) as f:
+    categories = json.load(f)
+  if len(ids) != manifest["size"]:
+    return False
+
+  def load(name):
+    # Copy-on-write, so incremental updates never write back to the file
+    array = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="c")
+    if len(array) != len(ids):
+      raise ValueError(f"{name}.npy has {len(array)} rows, expected {len(ids)}")
+    return array
+
+  quantized = {}
+  for aspect in IMAGE_ASPECTS:
+    if os.path.exists(os.path.join(path, f"{aspect}_quantized.npy")):
+      codes = np.load(os.path.join(path, f"{aspect}_quantized.npy"))
+      scales = np.load(os.path.join(path, f"{aspect}_scales.npy"))
+      if len(codes) != len(ids) or len(scales) != len(ids):
+        raise ValueError(f"{aspect} quantized vectors have {len(codes)} rows, expected {len(ids)}")
+      quantized[aspect] = QuantizedMatrix(engine.precision, codes, scales)
+
+  store = EmbeddingStore.from_arrays(
+    ids,
+    {aspect: load(f"{aspect}_vectors") for aspect in ASPECTS},
+    {aspect: load(f"{aspect}_norms") for aspect in ASPECTS},
+    {aspect: load(f"{aspect}_confidences") for aspect in ASPECTS},
+    AttributeIndex.from_columns(
+      {name: load(f"{name}_codes") for name in CATEGORICAL_ATTRIBUTES},
+      categories,
+      {name: load(f"{name}_values") for name in NUMERIC_ATTRIBUTES},
+    ),
+    precision=engine.precision,
+    quantized=quantized if engine.precision != "float32" else None
+  )
+  if store.quantized:
+    # Already mapped; this only sets where grown matrices are mapped
+    store.spill(engine.spill_dir)
+
+  if engine.mode == "lazy":
+    index = LazySimilarityIndex(store, engine.aspect_weights, top_k=engine.top_k, max_rows=engine.lazy_rows)
+    engine.publish(EngineState(store, lazy_index=index), generation=os.path.basename(path))
+  elif engine.mode == "ann":
+    centroids = {
+      aspect: np.load(os.path.join(path, f"{aspect}_centroids.npy"))
+      for aspect in ASPECTS if os.path.exists(os.path.join(path, f"{aspect}_centroids.npy"))
+    }
+    index = IVFIndex(store, engine.aspect_weights, top_k=engine.top_k, n_probe=engine.n_probe,
+                     centroids=centroids, assignments=load("assignments"))
+    engine.publish(EngineState(store, ann_index=index), generation=os.path.basename(path))
+  else:
+    matrix = SimilarityMatrix(store, engine.aspect_weights, top_k=engine.top_k,
+                              neighbours=load("neighbours"), scores=load("scores"))
+    components = None
+    if engine.aspect_candidates:
+      components = AspectComponents(store, engine.aspect_weights, per_aspect=engine.aspect_candidates,
+                                    candidates=load("candidates"), components=load("components"))
+    engine.publish(EngineState(store, similarity_matrix=matrix, components=components),
+                   generation=os.path.basename(path))
+  return True
+
+
+def latest_manifest(directory: str) -> Optional[dict]:
+  """Manifest of the snapshot named in LATEST, e.g. to configure an engine
+  that can load it. None if there is none."""
+  try:
+    with open(os.path.join(directory, LATEST_FILE)) as f:
+      latest = f.read().strip()
+    with open(os.path.join(directory, latest, "manifest.json")) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return None
+
+
+def load_snapshot(engine, directory: str) -> Optional[str]:
+  """Load the newest valid snapshot into the engine and return its path.
+
+  The version named in LATEST is tried first, then older versions. Returns
+  None if no usable snapshot exists.
+  """
+  candidates = _versions(directory)
+  try:
+    with open(os.path.join(directory, LATEST_FILE)) as f:
+      latest = f.read().strip()
+    if latest in candidates:
+      candidates.remove(latest)
+      candidates.insert(0, latest)
+  except FileNotFoundError:
+    pass
+
+  for version in candidates:
+    path = os.path.join(directory, version)
+    try:
+      if _load(engine, path):
+        return path
+    except (OSError, ValueError, KeyError) as e:
+      print(f"Skipping invalid snapshot {path}: {e}")
+  return None
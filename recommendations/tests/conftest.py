@@ -0,0 +1,26 @@
+import os
+import sys
+import pytest
+
+# The service's modules import each other by bare name, as they do when run
+# from this directory, so the tests can also be run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommendation_engine import RecommendationEngine  # noqa: E402
+from benchmarks.synthetic import ASPECT_WEIGHTS, make_catalog  # noqa: E402
+
+
+@pytest.fixture
+def make_engine():
+  """Factory for engines built over a synthetic catalog of `size` properties.
+
+  With `size=0` the engine is left empty, e.g. to load a snapshot into.
+  Other keyword arguments are passed to RecommendationEngine.
+  """
+  def make(size: int = 120, image_dim: int = 16, top_k: int = 5, **kwargs) -> RecommendationEngine:
+    engine = RecommendationEngine({}, {}, ASPECT_WEIGHTS, top_k=top_k, **kwargs)
+    if size:
+      engine.embeddings = make_catalog(size, precision=engine.precision, image_dim=image_dim, neighbourhood_dim=4)
+      engine.build_similarity_index()
+    return engine
+  return make
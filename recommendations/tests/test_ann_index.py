@@ -0,0 +1,40 @@
+import numpy as np
+from ann_index import IVFIndex
+from similarity_matrix import SimilarityMatrix
+from benchmarks.synthetic import ASPECT_WEIGHTS, make_catalog
+
+
+def test_probing_every_list_is_exact():
+  store = make_catalog(300, image_dim=32, neighbourhood_dim=8, seed=1)
+  exact = SimilarityMatrix(store, ASPECT_WEIGHTS, top_k=5)
+  index = IVFIndex(store, ASPECT_WEIGHTS, top_k=5, n_lists=10)
+
+  for row in range(0, 300, 7):
+    rows, scores = index.search_row(row, n_probe=10)
+    np.testing.assert_allclose(scores, exact.scores[row], rtol=1e-5, atol=1e-6)
+    assert row not in rows
+
+
+def test_update_and_remove_rows():
+  store = make_catalog(100, image_dim=32, neighbourhood_dim=8, seed=2)
+  index = IVFIndex(store, ASPECT_WEIGHTS, top_k=5, n_lists=4)
+
+  row = store.upsert("new", store.get("property-3"))
+  index.update_row(row)
+  assert index.get_similar_properties("property-3")[0][0] == "new"
+
+  index.remove_row(store.remove("new"))
+  assert "new" not in [pid for pid, _ in index.get_similar_properties("property-3")]
+  assert sum(len(rows) for rows in index.lists) == 100
+
+
+def test_engine_applies_partial_weights_in_ann_mode(make_engine):
+  engine = make_engine(200, mode="ann", n_probe=4)
+
+  # Aspects left out weigh nothing, as in exact mode and rerank
+  engine.apply_aspect_weights({"interior": 1.0})
+  exact = SimilarityMatrix(engine.embeddings, {"interior": 1.0}, top_k=5)
+  row = engine.embeddings.rows["property-3"]
+  scores = [score for _, score in engine.get_recommendations("property-3")]
+  assert scores and scores[0] <= exact.scores[row][0] + 1e-5
+  assert engine.rerank_recommendations("property-3", {"exterior": 1.0})
@@ -0,0 +1,67 @@
+import numpy as np
+from aspect_components import AspectComponents
+from similarity_matrix import SimilarityMatrix
+from benchmarks.synthetic import ASPECT_WEIGHTS, make_catalog
+
+TUNED_WEIGHTS = {"metadata": 0.1, "interior": 0.5, "exterior": 0.1, "neighbourhood": 0.3}
+
+
+def recall(found, truth):
+  hits = sum(len(np.intersect1d(f[f >= 0], t[t >= 0])) for f, t in zip(found, truth))
+  return hits / (truth >= 0).sum()
+
+
+def test_recombine_reproduces_and_approximates_exact_lists():
+  store = make_catalog(300, image_dim=16, neighbourhood_dim=4)
+  components = AspectComponents(store, ASPECT_WEIGHTS, per_aspect=10)
+
+  neighbours, scores = components.recombine(ASPECT_WEIGHTS, 5)
+  exact = SimilarityMatrix(store, ASPECT_WEIGHTS, top_k=5)
+  np.testing.assert_allclose(scores, exact.scores, rtol=1e-4)
+
+  tuned, _ = components.recombine(TUNED_WEIGHTS, 5)
+  assert recall(tuned, SimilarityMatrix(store, TUNED_WEIGHTS, top_k=5).neighbours) > 0.9
+
+
+def test_incremental_updates_refresh_listed_components():
+  store = make_catalog(120, image_dim=16, neighbourhood_dim=4)
+  components = AspectComponents(store, ASPECT_WEIGHTS, per_aspect=5)
+
+  row = store.upsert("property-4", store["property-9"])
+  components.update_row(row)
+  components.remove_row(store.remove("property-11"))
+
+  # References to removed rows go stale; recombine masks them
+  valid = (components.candidates >= 0) & store.active[np.maximum(components.candidates, 0)]
+  rows = np.arange(store.size)
+  fresh = store.pair_components(rows, components.candidates)
+  np.testing.assert_allclose(components.components[valid], fresh[valid], rtol=1e-4, atol=1e-6)
+
+  neighbours, _ = components.recombine(ASPECT_WEIGHTS, 5)
+  assert not (neighbours == store.size).any()
+  assert not (neighbours == 11).any()
+
+
+def test_engine_reranks_and_applies_new_weights(make_engine):
+  engine = make_engine(200, aspect_candidates=10)
+  store = engine.embeddings
+
+  exact = SimilarityMatrix(store, TUNED_WEIGHTS, top_k=5)
+  reranked = [
+    [store.rows[pid] for pid, _ in engine.rerank_recommendations(store.ids[row], TUNED_WEIGHTS)]
+    for row in range(store.size)
+  ]
+  assert recall(np.array(reranked), exact.neighbours) > 0.9
+
+  generation = engine.generation
+  engine.apply_aspect_weights(TUNED_WEIGHTS)
+  assert engine.generation != generation and engine.aspect_weights == TUNED_WEIGHTS
+  assert recall(engine.similarity_matrix.neighbours, exact.neighbours) > 0.9
+
+
+def test_matrix_read_off_components_matches_full_build(make_engine):
+  store = make_catalog(150, image_dim=16, neighbourhood_dim=4)
+  engine = make_engine(0, aspect_candidates=5)
+  state = engine.build_state(store)
+  exact = SimilarityMatrix(store, ASPECT_WEIGHTS, top_k=5)
+  np.testing.assert_allclose(state.similarity_matrix.scores, exact.scores, rtol=1e-4)
@@ -0,0 +1,46 @@
+import numpy as np
+from attribute_index import AttributeIndex, PropertyFilter
+
+
+def test_mask_combines_bitmaps_and_ranges():
+  index = AttributeIndex(capacity=2)
+  rows = [
+    {"status": "for_rent", "price": 900, "bedrooms": 2, "neighbourhood": "a"},
+    {"status": "for_sale", "price": 250000, "bedrooms": 3, "neighbourhood": "b"},
+    {"status": "for_rent", "price": 1500, "bedrooms": 3, "neighbourhood": "b"},
+    {"status": "for_rent", "price": None, "bedrooms": 1, "neighbourhood": None},
+  ]
+  index.grow(len(rows))
+  for row, attributes in enumerate(rows):
+    index.set(row, attributes)
+
+  def matches(**kwargs):
+    return np.flatnonzero(index.mask(PropertyFilter(**kwargs), len(rows))).tolist()
+
+  assert matches() == [0, 1, 2, 3]
+  assert matches(status=["for_rent"]) == [0, 2, 3]
+  assert matches(status=["for_rent", "for_sale"], neighbourhood=["b"]) == [1, 2]
+  assert matches(min_price=900, max_price=1500) == [0, 2]
+  assert matches(status=["for_rent"], min_bedrooms=2) == [0, 2]
+  assert matches(neighbourhood=["unknown"]) == []
+
+  # Writes update the bitmaps and invalidate the sorted columns
+  index.set(2, {"status": "for_sale", "price": 100, "bedrooms": 3, "neighbourhood": "b"})
+  index.clear(0)
+  assert matches(status=["for_rent"]) == [3]
+  assert matches(max_price=1500) == [2]
+  assert index.get(2) == {"status": "for_sale", "neighbourhood": "b", "price": 100.0, "bedrooms": 3.0}
+
+
+def test_from_columns_rebuilds_bitmaps():
+  index = AttributeIndex(capacity=3)
+  for row, status in enumerate(["for_sale", "for_rent", "for_sale"]):
+    index.set(row, {"status": status, "price": row})
+
+  restored = AttributeIndex.from_columns(
+    {name: index.codes(name) for name in ["status", "neighbourhood"]},
+    index.categories,
+    {name: index.numeric(name) for name in ["price", "bedrooms"]}
+  )
+  mask = restored.mask(PropertyFilter(status=["for_sale"], min_price=1), 3)
+  assert np.flatnonzero(mask).tolist() == [2]
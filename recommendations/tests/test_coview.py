@@ -0,0 +1,93 @@
+import numpy as np
+from coview import CoViewIndex
+from views import ViewLog
+from benchmarks.synthetic import ASPECT_WEIGHTS
+
+
+def random_views(n, users=30, properties=40, seed=0):
+  rng = np.random.default_rng(seed)
+  timestamps = np.sort(rng.uniform(0, 4 * 3600, n))
+  return [
+    (f"property-{rng.integers(properties)}", f"user-{rng.integers(users)}", float(t))
+    for t in timestamps
+  ]
+
+
+def test_appended_views_match_a_bulk_build():
+  records = random_views(2000)
+  bulk = CoViewIndex.from_views(ViewLog.from_records(records), window=3)
+
+  incremental = CoViewIndex(window=3, merge_every=500)
+  for property_id, user_id, timestamp in records:
+    incremental.add_view(property_id, user_id, timestamp)
+  assert incremental._pending_rows  # some pairs are still buffered
+
+  assert bulk.nnz > 0
+  for pid in bulk.ids:
+    expected = dict(bulk.get_similar_properties(pid, k=100))
+    found = dict(incremental.get_similar_properties(pid, k=100))
+    assert expected.keys() == found.keys()
+    np.testing.assert_allclose([found[p] for p in expected], list(expected.values()), rtol=1e-6)
+
+  incremental.merge()
+  assert not incremental._pending_rows
+  assert incremental.matrix.nnz == bulk.matrix.nnz
+
+
+def test_scores_are_counts_normalised_by_views():
+  index = CoViewIndex(window=2)
+  for pid, user, t in [("a", "u1", 0), ("b", "u1", 1), ("c", "u1", 2),
+                       ("a", "u2", 0), ("b", "u2", 1), ("a", None, 5)]:
+    index.add_view(pid, user, t)
+
+  # a and b co-viewed twice, each viewed twice by signed-in users
+  assert index.get_similar_properties("a", k=1) == [("b", 1.0)]
+  np.testing.assert_allclose(index.scores("a", ["b", "c", "missing"]), [1.0, 1 / np.sqrt(2), 0.0])
+  assert index.get_similar_properties("missing") == []
+
+
+def test_blended_recommendations(make_engine):
+  engine = make_engine(120)
+  store = engine.embeddings
+
+  content = engine.get_recommendations("property-3")
+  assert [pid for pid, _ in engine.get_blended_recommendations("property-3", 0.0)] == [p for p, _ in content]
+
+  # A property with no content similarity is pulled in by co-views alone
+  stranger = next(pid for pid in store.ids if pid not in dict(content) and pid != "property-3")
+  engine.coview = CoViewIndex.from_views(ViewLog.from_records(
+    [("property-3", f"user-{u}", 0.0) for u in range(3)] +
+    [(stranger, f"user-{u}", 1.0) for u in range(3)] +
+    [("unindexed", "user-0", 2.0)]
+  ))
+  blended = engine.get_blended_recommendations("property-3", 0.9)
+  assert blended[0][0] == stranger
+  assert "unindexed" not in dict(blended)
+
+  content_score = store.score_rows(np.array([store.rows["property-3"]]), ASPECT_WEIGHTS,
+                                   columns=np.array([store.rows[stranger]]))[0, 0]
+  np.testing.assert_allclose(blended[0][1], 0.1 * content_score + 0.9 * 1.0, rtol=1e-5)
+
+
+def test_blended_ranking_uses_coviews_relative_to_the_strongest(make_engine):
+  engine = make_engine(120)
+  store = engine.embeddings
+
+  # Weak co-views only: one shared user among many views each
+  content = [pid for pid, _ in engine.get_recommendations("property-3")]
+  weak, weaker = content[-1], content[-2]
+  records = [("property-3", f"user-{u}", 0.0) for u in range(8)]
+  records += [(weak, "user-0", 1.0)] + [(weak, f"other-{u}", 1.0) for u in range(3)]
+  records += [(weaker, "user-1", 1.0)] + [(weaker, f"other-{u}", 1.0) for u in range(15)]
+  engine.coview = CoViewIndex.from_views(ViewLog.from_records(records))
+
+  blended = engine.get_blended_recommendations("property-3", 0.5)
+  candidates = [pid for pid, _ in blended]
+  rows = np.array([store.rows[pid] for pid in candidates])
+  content_scores = store.score_rows(np.array([store.rows["property-3"]]), ASPECT_WEIGHTS, columns=rows)[0]
+  coview_scores = engine.coview.scores("property-3", candidates)
+  assert 0 < coview_scores.max() < 1
+  expected = 0.5 * content_scores + 0.5 * coview_scores / coview_scores.max()
+  np.testing.assert_allclose([s for _, s in blended], expected, rtol=1e-5)
+  assert candidates[0] == weak
+  assert candidates.index(weaker) < content.index(weaker)
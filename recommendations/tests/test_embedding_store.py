@@ -0,0 +1,45 @@
+import numpy as np
+from embedding_store import EmbeddingStore
+from property_embedding import PropertyEmbedding
+
+
+def make_embedding(seed, with_images=True):
+  rng = np.random.default_rng(seed)
+  return PropertyEmbedding(
+    metadata_embedding=rng.random(5).astype(np.float32),
+    interior_embedding=rng.random(16).astype(np.float32) if with_images else None,
+    exterior_embedding=None,
+    neighbourhood_embedding=np.array([0], dtype=np.float32),
+    metadata_confidence=0.8,
+    interior_confidence=0.5 if with_images else 0.0,
+    neighbourhood_confidence=1.0,
+  )
+
+
+def test_row_view_round_trip():
+  original = make_embedding(0)
+  store = EmbeddingStore.from_embeddings({"a": original, "b": make_embedding(1, with_images=False)})
+
+  view = store.get("a")
+  np.testing.assert_allclose(view.metadata_embedding, original.metadata_embedding, rtol=1e-6)
+  np.testing.assert_allclose(view.interior_embedding, original.interior_embedding, rtol=1e-6)
+  assert view.exterior_embedding is None
+  assert view.metadata_confidence == np.float32(0.8)
+  assert store["b"].interior_embedding is None
+  assert store.vectors("interior").dtype == np.float32
+  np.testing.assert_allclose(np.linalg.norm(store.vectors("interior")[0]), 1.0, rtol=1e-6)
+
+
+def test_growth_and_removal_keep_rows_stable():
+  store = EmbeddingStore()
+  rows = [store.upsert(f"p{i}", make_embedding(i)) for i in range(40)]
+  assert rows == list(range(40))
+
+  assert store.remove("p5") == 5
+  assert store.remove("p5") is None
+  assert "p5" not in store and len(store) == 39 and store.size == 40
+  assert store.upsert("p6", make_embedding(99)) == 6
+
+  scores = store.score_rows(np.array([0]), {"metadata": 1.0, "interior": 1.0})
+  assert scores.shape == (1, 40)
+  assert scores[0, 5] == -np.inf
@@ -0,0 +1,36 @@
+import numpy as np
+from evaluation import evaluate, score_lists
+from views import ViewLog
+
+
+def test_score_lists():
+  lists = np.array([[1, 2, 3], [4, 5, 6], [7, 8, -1]])
+  metrics = score_lists(lists, np.array([1, 6, 9]), catalog_size=10)
+  assert metrics["hit_rate"] == 2 / 3
+  assert np.isclose(metrics["mrr"], (1 + 1 / 3) / 3)
+  assert metrics["coverage"] == 0.8
+
+
+def test_replay_following_recommendations_hits_every_time(make_engine):
+  engine = make_engine(100)
+
+  # Each user clicks the top single-item and top from-history recommendation
+  records, t = [], 0.0
+  for user in range(20):
+    start = f"property-{user}"
+    single = engine.get_recommendations(start)[0][0]
+    history = engine.get_history_recommendations([start, single])[0][0]
+    for pid in [start, single, history]:
+      records.append((pid, f"user-{user}", t))
+      t += 10
+    records.append(("unknown", f"user-{user}", t))
+    t += 10
+  views = ViewLog.from_records(records)
+
+  report = evaluate(engine, views)
+  assert report["sessions"] == 20
+  # Views of unindexed properties are not events
+  assert report["single_item"]["events"] == report["from_history"]["events"] == 40
+  # Every second view is the previous view's top recommendation
+  assert report["single_item"]["hit_rate"] >= 0.5
+  assert report["from_history"]["hit_rate"] == report["from_history"]["mrr"] == 1.0
@@ -0,0 +1,62 @@
+import numpy as np
+from snapshot import load_snapshot, save_snapshot
+from benchmarks.synthetic import make_properties
+
+
+def test_lazy_rows_match_the_exact_matrix(make_engine):
+  exact, lazy = make_engine(), make_engine(mode="lazy", lazy_rows=20)
+  index = lazy.index
+  assert index.cached_rows == 0
+
+  rows = np.arange(40)
+  neighbours, scores = index.get_similar_rows(rows)
+  np.testing.assert_allclose(scores, exact.similarity_matrix.scores[rows], rtol=1e-6)
+  assert index.misses == 40 and index.cached_rows == 20
+
+  assert lazy.get_recommendations("property-39") == exact.get_recommendations("property-39")
+  assert index.hits == 1
+  lazy.get_recommendations("property-0")
+  assert index.misses == 41
+
+
+def test_updates_invalidate_affected_rows(make_engine):
+  exact, lazy = make_engine(), make_engine(mode="lazy", lazy_rows=20)
+  index = lazy.index
+  index.get_similar_rows(np.arange(20))
+
+  # A copy of property-3 enters its list; removing property-3 leaves others
+  copy = lazy.embeddings.get("property-3")
+  neighbour = exact.get_recommendations("property-3")[0][0]
+  for engine in (exact, lazy):
+    engine.upsert_property("copy", copy)
+    engine.remove_property(neighbour)
+  # Updates publish a patched copy; the old index keeps serving its readers
+  assert 3 in index._lists
+  index = lazy.index
+  assert 3 not in index._lists
+
+  rows = np.arange(20)
+  _, scores = index.get_similar_rows(rows)
+  np.testing.assert_allclose(scores, exact.similarity_matrix.scores[rows], rtol=1e-6)
+
+  _, embedding = next(make_properties(1, image_dim=16, neighbourhood_dim=4, seed=9))
+  for engine in (exact, lazy):
+    engine.upsert_property("property-3", embedding)
+  # property-3 moved to a fresh row, since the old one is still shared
+  index = lazy.index
+  store = lazy.embeddings
+  rows = np.array([store.rows[f"property-{i}"] for i in range(20) if f"property-{i}" in store.rows])
+  assert store.rows["property-3"] not in range(20)
+  _, scores = index.get_similar_rows(rows)
+  np.testing.assert_allclose(scores, exact.similarity_matrix.scores[rows], rtol=1e-6)
+
+
+def test_lazy_snapshot_keeps_only_the_store(make_engine, tmp_path):
+  lazy = make_engine(mode="lazy", lazy_rows=20)
+  lazy.get_recommendations("property-1")
+  path = save_snapshot(lazy, str(tmp_path))
+
+  restored = make_engine(0, mode="lazy")
+  assert load_snapshot(restored, str(tmp_path)) == path
+  assert restored.index.cached_rows == 0
+  assert restored.get_recommendations("property-1") == lazy.get_recommendations("property-1")
@@ -0,0 +1,108 @@
+import uuid
+import numpy as np
+from types import SimpleNamespace
+from loader import CatalogLoader
+
+
+class FakeQuery:
+  """Minimal PostgREST query builder over in-memory rows with a max-rows cap."""
+
+  def __init__(self, rows, max_rows):
+    self.rows = rows
+    self.max_rows = max_rows
+    self.filters = []
+    self.row_limit = None
+
+  def select(self, fields):
+    self.fields = fields.split(",")
+    return self
+
+  def order(self, column):
+    return self
+
+  def limit(self, n):
+    self.row_limit = n
+    return self
+
+  def _filter(self, predicate):
+    self.filters.append(predicate)
+    return self
+
+  def eq(self, column, value):
+    return self._filter(lambda row: row[column] == value)
+
+  def gt(self, column, value):
+    return self._filter(lambda row: row[column] > value)
+
+  def gte(self, column, value):
+    return self._filter(lambda row: row[column] >= value)
+
+  def lt(self, column, value):
+    return self._filter(lambda row: row[column] < value)
+
+  def in_(self, column, values):
+    return self._filter(lambda row: row[column] in values)
+
+  def execute(self):
+    rows = sorted((r for r in self.rows if all(f(r) for f in self.filters)), key=lambda r: r["id"])
+    rows = rows[:min(self.row_limit or self.max_rows, self.max_rows)]
+    return SimpleNamespace(data=[{k: r[k] for k in self.fields} for r in rows])
+
+
+class FakeClient:
+  def __init__(self, tables, max_rows):
+    self.tables = tables
+    self.max_rows = max_rows
+
+  def table(self, name):
+    return FakeQuery(self.tables[name], self.max_rows)
+
+
+def make_tables(n_properties=60, seed=0):
+  rng = np.random.default_rng(seed)
+  neighbourhood = str(uuid.UUID(int=0))
+  properties = [{
+    "id": str(uuid.UUID(int=int(rng.integers(1 << 62)) << 66)),
+    "bedrooms": 2, "bathrooms": 1, "price": 100, "interior_size_sqm": 50,
+    "status": "for_sale" if i % 5 else "sold",
+    "neighbourhood": neighbourhood,
+  } for i in range(n_properties)]
+  images = [{
+    "id": str(uuid.uuid4()),
+    "property_id": properties[i % n_properties]["id"],
+    "aspect": "interior" if i % 3 else "exterior",
+    "embedding": rng.random(4).tolist(),
+  } for i in range(5 * n_properties)]
+  neighbourhoods = [{"id": neighbourhood, "embeddings": [1.0, 0.0]}]
+  return {"properties": properties, "property_images": images, "neighbourhoods": neighbourhoods}
+
+
+def test_pages_past_row_cap_and_aggregates_images():
+  tables = make_tables()
+  loader = CatalogLoader(FakeClient(tables, max_rows=7), page_size=7, partitions=4, workers=3)
+  catalog = loader.load()
+
+  listed = [p["id"] for p in tables["properties"] if p["status"] != "sold"]
+  assert sorted(catalog.rows) == sorted(listed)
+  assert list(catalog.neighbourhoods) == [tables["neighbourhoods"][0]["id"]]
+
+  for pid in listed[:10]:
+    means, counts = catalog.images(catalog.rows[pid])
+    for aspect in ["interior", "exterior"]:
+      expected = [img["embedding"] for img in tables["property_images"]
+                  if img["property_id"] == pid and img["aspect"] == aspect]
+      assert counts[aspect] == len(expected)
+      if expected:
+        np.testing.assert_allclose(means[aspect], np.mean(expected, axis=0), rtol=1e-5)
+
+
+def test_load_property():
+  tables = make_tables()
+  loader = CatalogLoader(FakeClient(tables, max_rows=7))
+  pid = tables["properties"][1]["id"]
+
+  catalog = loader.load_property(pid)
+  means, counts = catalog.images(0)
+  assert catalog.properties[0]["id"] == pid
+  assert counts["interior"] + counts["exterior"] == 5
+  assert loader.load_property(str(uuid.uuid4())) is None
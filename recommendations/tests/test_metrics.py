@@ -0,0 +1,25 @@
+from prometheus_client import REGISTRY, CollectorRegistry
+from metrics import IndexCollector
+from response_cache import ResponseCache
+
+
+def test_index_gauges_and_phase_timings(make_engine):
+  builds = REGISTRY.get_sample_value("recommendations_phase_seconds_count", {"phase": "build"}) or 0
+
+  engine = make_engine(60, image_dim=8)
+  engine.remove_property("property-4")
+  assert REGISTRY.get_sample_value("recommendations_phase_seconds_count", {"phase": "build"}) == builds + 1
+
+  cache = ResponseCache()
+  cache.get(("generation", "key"))
+  registry = CollectorRegistry()
+  registry.register(IndexCollector(engine, cache))
+
+  store = engine.embeddings
+  assert registry.get_sample_value("recommendations_properties") == 59
+  assert registry.get_sample_value("recommendations_inactive_rows") == 1
+  missing = (store.active & (store.norms("interior") == 0)).sum()
+  assert registry.get_sample_value("recommendations_rows_missing_aspect", {"aspect": "interior"}) == missing
+  assert registry.get_sample_value("recommendations_index_bytes", {"part": "embeddings"}) == store.nbytes
+  assert registry.get_sample_value("recommendations_index_bytes", {"part": "similarity_matrix"}) > 0
+  assert registry.get_sample_value("recommendations_response_cache_lookups_total", {"result": "miss"}) == 1
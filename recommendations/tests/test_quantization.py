@@ -0,0 +1,69 @@
+import numpy as np
+from quantization import QuantizedMatrix
+from snapshot import load_snapshot, save_snapshot
+from benchmarks.synthetic import make_properties
+
+
+def test_quantized_dot_products_are_close():
+  rng = np.random.default_rng(0)
+  matrix = rng.normal(size=(50, 32)).astype(np.float32)
+  matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+  queries = matrix[:4]
+
+  for precision, tolerance in [("float16", 1e-3), ("int8", 2e-2)]:
+    quantized = QuantizedMatrix.quantize(matrix, precision, block_size=16)
+    np.testing.assert_allclose(quantized.dot(queries, 50), queries @ matrix.T, atol=tolerance)
+    columns = np.array([3, 40, 7])
+    np.testing.assert_allclose(quantized.dot(queries, 50, columns), queries @ matrix[columns].T, atol=tolerance)
+    assert quantized.nbytes < matrix.nbytes
+
+
+def test_quantized_index_reranks_to_the_exact_lists(make_engine):
+  for precision in ["float16", "int8"]:
+    exact = make_engine()
+    store = exact.embeddings
+    engine = make_engine(precision=precision)
+    np.testing.assert_allclose(engine.similarity_matrix.scores, exact.similarity_matrix.scores, rtol=1e-5)
+
+    history = ["property-3", "property-10", "property-42"]
+    np.testing.assert_allclose(
+      [s for _, s in engine.get_history_recommendations(history)],
+      [s for _, s in exact.get_history_recommendations(history)], rtol=1e-5)
+
+    # Incremental updates keep the quantized copies in sync
+    _, embedding = next(make_properties(1, image_dim=16, neighbourhood_dim=4, seed=7))
+    for target in (engine, exact):
+      target.upsert_property("new", embedding)
+      target.remove_property("property-5")
+    row = store.rows["property-0"]
+    np.testing.assert_allclose(engine.similarity_matrix.scores[row], exact.similarity_matrix.scores[row], rtol=1e-5)
+    assert "property-5" not in engine.embeddings.rows
+    assert "property-5" not in [pid for pid, _ in engine.get_recommendations("property-0")]
+
+
+def test_quantized_snapshot_round_trip(make_engine, tmp_path):
+  engine = make_engine(precision="int8")
+  save_snapshot(engine, str(tmp_path))
+
+  assert not load_snapshot(make_engine(0), str(tmp_path))
+  restored = make_engine(0, precision="int8")
+  assert load_snapshot(restored, str(tmp_path))
+  np.testing.assert_array_equal(
+    restored.embeddings.quantized_vectors("interior").codes,
+    engine.embeddings.quantized_vectors("interior").codes[:engine.embeddings.size])
+  assert restored.get_recommendations("property-9") == engine.get_recommendations("property-9")
+
+
+def test_quantized_stores_keep_only_the_codes_in_memory(make_engine, tmp_path):
+  sizes = {}
+  for precision in ["float32", "float16", "int8"]:
+    engine = make_engine(300, image_dim=128, precision=precision, spill_dir=str(tmp_path))
+    sizes[precision] = engine.embeddings.nbytes
+    if precision == "int8":
+      # Spilled matrices stay mapped as the store grows
+      _, embedding = next(make_properties(1, image_dim=128, neighbourhood_dim=4, seed=5))
+      for i in range(300):
+        engine.upsert_property(f"new-{i}", embedding)
+      assert isinstance(engine.embeddings.vectors("interior"), np.memmap)
+      assert engine.get_recommendations("new-0")
+  assert sizes["int8"] < sizes["float16"] < 0.6 * sizes["float32"]
@@ -0,0 +1,56 @@
+import threading
+import time
+from rebuild_worker import IndexRebuilder
+from benchmarks.synthetic import make_catalog
+
+
+def test_burst_of_requests_triggers_one_rebuild(make_engine):
+  engine = make_engine(50)
+  loads = []
+
+  def load():
+    loads.append(time.monotonic())
+    return make_catalog(50, image_dim=16, neighbourhood_dim=4, seed=1)
+
+  rebuilder = IndexRebuilder(engine, load, delay=0.05)
+  rebuilder.start()
+  old_state = engine.state
+  for _ in range(10):
+    rebuilder.request()
+    time.sleep(0.005)
+
+  deadline = time.monotonic() + 5
+  while rebuilder.rebuilds == 0 and time.monotonic() < deadline:
+    time.sleep(0.01)
+  time.sleep(0.1)
+
+  assert len(loads) == 1
+  assert engine.state is not old_state
+  assert engine.state.similarity_matrix.embeddings is engine.state.embeddings
+
+
+def test_updates_during_rebuild_are_replayed_onto_new_state(make_engine):
+  engine = make_engine(50)
+  started, release = threading.Event(), threading.Event()
+  replacement = make_catalog(50, image_dim=16, neighbourhood_dim=4, seed=2)
+  extra = replacement["property-1"]
+
+  def load():
+    started.set()
+    release.wait(5)
+    return replacement
+
+  worker = threading.Thread(target=engine.rebuild, args=(load,))
+  worker.start()
+  started.wait(5)
+
+  # Served from the old state while the rebuild is in flight
+  engine.upsert_property("new", extra)
+  engine.remove_property("property-2")
+  assert engine.get_recommendations("new")
+  release.set()
+  worker.join(5)
+
+  assert engine.embeddings is replacement
+  assert "new" in engine.embeddings and "property-2" not in engine.embeddings
+  assert "new" in [pid for pid, _ in engine.get_recommendations("property-1")]
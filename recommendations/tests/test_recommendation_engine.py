@@ -0,0 +1,178 @@
+import threading
+import numpy as np
+import pytest
+from attribute_index import PropertyFilter
+from benchmarks.synthetic import ASPECT_WEIGHTS, make_properties
+
+
+def test_history_profile_matches_weighted_sum_of_scores(make_engine):
+  engine = make_engine()
+  store = engine.embeddings
+  viewed = ["property-3", "unknown", "property-10", "property-42"]
+
+  recommendations = engine.get_history_recommendations(viewed, k=8)
+
+  rows = np.array([store.rows["property-42"], store.rows["property-10"], store.rows["property-3"]])
+  weights = np.array([1, 1 / 2, 1 / 4], dtype=np.float32)
+  expected = weights @ store.score_rows(rows, ASPECT_WEIGHTS)
+  expected[rows] = -np.inf
+  best = np.sort(expected)[::-1][:8]
+
+  # Near-ties may order differently, so compare each returned id's score
+  returned = np.array([expected[store.rows[pid]] for pid, _ in recommendations])
+  np.testing.assert_allclose(returned, best, rtol=1e-4)
+  np.testing.assert_allclose([s for _, s in recommendations], returned, rtol=1e-4)
+  assert not set(viewed) & {pid for pid, _ in recommendations}
+
+
+def test_history_of_unknown_ids_is_empty(make_engine):
+  engine = make_engine()
+  assert engine.get_history_recommendations(["missing"]) == []
+
+
+def test_filtered_recommendations_are_a_full_filtered_top_k(make_engine):
+  for mode in ["exact", "ann"]:
+    engine = make_engine(mode=mode)
+    store = engine.embeddings
+    filters = PropertyFilter(status=["for_rent"], min_bedrooms=2, max_bedrooms=4)
+
+    recommendations = engine.get_recommendations("property-5", filters)
+
+    row = store.rows["property-5"]
+    mask = store.attributes.mask(filters, store.size)
+    mask[row] = False
+    expected = store.score_rows(np.array([row]), ASPECT_WEIGHTS)[0]
+    expected[~mask] = -np.inf
+    best = np.sort(expected)[::-1][:engine.top_k]
+
+    assert len(recommendations) == engine.top_k
+    for pid, score in recommendations:
+      attributes = store[pid].attributes
+      assert attributes["status"] == "for_rent" and 2 <= attributes["bedrooms"] <= 4
+    np.testing.assert_allclose([score for _, score in recommendations], best, rtol=1e-4)
+
+
+def test_filter_matching_the_precomputed_list_uses_it(make_engine):
+  engine = make_engine()
+  unfiltered = engine.get_recommendations("property-5")
+  filters = PropertyFilter(neighbourhood=[engine.embeddings[pid].attributes["neighbourhood"] for pid, _ in unfiltered])
+  assert engine.get_recommendations("property-5", filters) == unfiltered
+
+
+def test_batch_matches_single_lookups(make_engine):
+  for mode in ["exact", "ann"]:
+    engine = make_engine(mode=mode)
+    ids = ["property-1", "missing", "property-7", "property-1"]
+
+    batch = engine.get_batch_recommendations(ids)
+    assert list(batch) == ["property-1", "property-7"]
+    for pid in batch:
+      assert batch[pid] == [rec for rec, _ in engine.get_recommendations(pid)]
+
+    # Lists longer than the precomputed top-k are scored on the fly
+    longer = engine.get_batch_recommendations(["property-1"], k=8)["property-1"]
+    assert len(longer) == 8
+    if mode == "exact":
+      assert longer[:engine.top_k] == batch["property-1"]
+
+
+def test_generation_changes_with_the_served_index(make_engine):
+  engine = make_engine()
+  generations = [engine.generation]
+
+  engine.upsert_property("property-1", engine.embeddings["property-2"])
+  generations.append(engine.generation)
+  engine.remove_property("property-3")
+  generations.append(engine.generation)
+  engine.build_similarity_index()
+  generations.append(engine.generation)
+
+  assert len(set(generations)) == len(generations)
+  # Another process never reuses this process's generation ids
+  assert make_engine().generation not in generations
+
+
+def test_updates_report_the_lists_they_change(make_engine):
+  engine = make_engine()
+  store = engine.embeddings
+
+  def lists():
+    return {pid: engine.get_recommendations(pid) for pid in engine.embeddings.ids if pid is not None}
+
+  before = lists()
+  changed = engine.upsert_property("clone", store["property-3"])
+  after = lists()
+  assert changed[0] == "clone" and "property-3" in changed
+  assert {pid for pid in before if before[pid] != after[pid]} <= set(changed)
+
+  before = after
+  changed = engine.remove_property("property-3")
+  after = lists()
+  assert "clone" in changed
+  assert {pid for pid in after if before[pid] != after[pid]} <= set(changed)
+
+  ann = make_engine(50, mode="ann")
+  assert ann.remove_property("property-3") is None
+
+
+def test_embedding_query_scores_like_an_indexed_property(make_engine):
+  for precision in ["float32", "int8"]:
+    engine = make_engine(precision=precision)
+    store = engine.embeddings
+
+    embedding = store.get("property-7")
+    recommendations = engine.get_embedding_recommendations(embedding, exclude="property-7")
+    expected = engine.get_recommendations("property-7")
+    np.testing.assert_allclose([s for _, s in recommendations], [s for _, s in expected], rtol=1e-5)
+    # Without the exclusion the property's own row competes too
+    best = store.score_rows(np.array([store.rows["property-7"]]), ASPECT_WEIGHTS).max()
+    np.testing.assert_allclose(engine.get_embedding_recommendations(embedding, k=1)[0][1], best, rtol=1e-5)
+
+    embedding.interior_embedding = np.ones(3, dtype=np.float32)
+    with pytest.raises(ValueError):
+      engine.get_embedding_recommendations(embedding)
+
+
+@pytest.mark.parametrize("mode", ["exact", "ann", "lazy"])
+def test_reads_stay_consistent_during_concurrent_updates(make_engine, mode):
+  engine = make_engine(mode=mode)
+  updates = list(make_properties(60, image_dim=16, neighbourhood_dim=4, seed=11))
+  filters = PropertyFilter(status=["for_rent"])
+  done = threading.Event()
+  errors = []
+
+  def write():
+    try:
+      for i, (_, embedding) in enumerate(updates):
+        # New ids grow the store; existing ids move to fresh rows
+        engine.upsert_property(f"new-{i}", embedding)
+        engine.upsert_property(f"property-{i}", embedding)
+        engine.remove_property(f"property-{60 + i}")
+    except Exception as e:
+      errors.append(e)
+    finally:
+      done.set()
+
+  def read():
+    try:
+      while not done.is_set():
+        for pid in ["property-0", "property-30", "property-90", "new-0"]:
+          for results in (engine.get_recommendations(pid),
+                          engine.get_recommendations(pid, filters),
+                          engine.get_history_recommendations([pid, "property-5"])):
+            assert all(isinstance(other, str) and other != pid for other, _ in results)
+    except Exception as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert not errors
+  assert engine.get_recommendations("property-0")
+  inactive = ~engine.embeddings.active
+  assert engine.embeddings.inactive_rows == inactive.sum() >= 60
+  if engine.similarity_matrix is not None:
+    assert (engine.similarity_matrix.neighbours[inactive] < 0).all()
+  assert not engine.get_recommendations("property-100")
@@ -0,0 +1,63 @@
+from response_cache import ResponseCache
+
+
+def test_lru_eviction_and_counters():
+  cache = ResponseCache(max_entries=2)
+  cache.put(("g1", "a"), b"a")
+  cache.put(("g1", "b"), b"b")
+  assert cache.get(("g1", "a")) == b"a"
+  cache.put(("g1", "c"), b"c")
+
+  # "b" was least recently used
+  assert cache.get(("g1", "b")) is None
+  assert cache.get(("g1", "a")) == b"a" and cache.get(("g1", "c")) == b"c"
+  assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_new_generation_drops_old_entries():
+  cache = ResponseCache()
+  cache.put(("g1", "a"), b"old")
+  cache.put(("g2", "a"), b"new")
+  assert len(cache) == 1
+  assert cache.get(("g1", "a")) is None
+  assert cache.get(("g2", "a")) == b"new"
+
+
+def test_stale_generations_are_not_stored():
+  current = ["g2"]
+  cache = ResponseCache(current_generation=lambda: current[0])
+  cache.put(("g2", "a"), b"new")
+  # A slow request computed at g1 neither wipes g2 entries nor is stored
+  cache.put(("g1", "b"), b"old")
+  assert len(cache) == 1 and cache.get(("g2", "a")) == b"new"
+
+  current[0] = "g3"
+  cache.put(("g3", "a"), b"newer")
+  assert len(cache) == 1 and cache.get(("g3", "a")) == b"newer"
+
+
+def test_invalidate_drops_entries_mentioning_the_ids():
+  cache = ResponseCache()
+  cache.put(("g1", "a"), b"a", ids=["p1", "p2"])
+  cache.put(("g1", "b"), b"b", ids=["p3"])
+  version = cache.version
+  cache.invalidate(["p2"])
+  assert cache.get(("g1", "a")) is None
+  assert cache.get(("g1", "b")) == b"b"
+
+  # Computed before the invalidation, so possibly stale
+  cache.put(("g1", "a"), b"a", ids=["p1"], version=version)
+  assert cache.get(("g1", "a")) is None
+
+
+def test_entries_without_ids_depend_on_every_property():
+  cache = ResponseCache()
+  cache.put(("g1", "list"), b"a", ids=["p1"])
+  cache.put(("g1", "scan"), b"b")
+  cache.invalidate(["p9"])
+  assert cache.get(("g1", "scan")) is None
+  assert cache.get(("g1", "list")) == b"a"
+
+  # None when the index cannot tell which lists changed
+  cache.invalidate(None)
+  assert len(cache) == 0
@@ -0,0 +1,113 @@
+import os
+import pytest
+from fastapi.testclient import TestClient
+from coview import CoViewIndex
+from benchmarks.synthetic import make_catalog
+
+# main creates its Supabase client at import; no request reaches it here
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_ANON_KEY", "test")
+import main
+
+
+@pytest.fixture
+def client():
+  main.engine.embeddings = make_catalog(60, image_dim=16, neighbourhood_dim=4)
+  main.engine.build_similarity_index()
+  main.engine.coview = None
+  # Without the context manager startup events, and so catalog loading, do not run
+  return TestClient(main.app)
+
+
+@pytest.mark.parametrize("query", ["", "?status=for_rent&min_price=0", "?coview_weight=0.5"])
+def test_unknown_ids_get_no_recommendations_on_every_path(client, query):
+  response = client.get(f"/recommendations/unknown{query}")
+  assert response.status_code == 200
+  assert response.json() == {"recommended_ids": []}
+
+  response = client.get(f"/recommendations/property-3{query}")
+  assert response.status_code == 200
+  assert response.json()["recommended_ids"]
+
+
+def test_rerank_of_unknown_ids_is_empty(client):
+  weights = {"interior": 1.0}
+  response = client.post("/recommendations/rerank", json={"property_id": "unknown", "aspect_weights": weights})
+  assert response.status_code == 200
+  assert response.json() == {"recommended_ids": []}
+
+  response = client.post("/recommendations/rerank", json={"property_id": "property-3", "aspect_weights": weights})
+  assert response.json()["recommended_ids"]
+
+  response = client.post("/recommendations/rerank", json={"property_id": "property-3", "aspect_weights": {"roof": 1.0}})
+  assert response.status_code == 400
+
+
+def test_cached_responses_survive_unrelated_updates(client):
+  first = client.get("/recommendations/property-3")
+  hits = main.response_cache.hits
+  recommended = first.json()["recommended_ids"]
+  unrelated = next(f"property-{i}" for i in range(4, 60) if f"property-{i}" not in recommended)
+
+  main.apply_update({"type": "remove", "property_id": unrelated})
+  response = client.get("/recommendations/property-3", headers={"If-None-Match": first.headers["ETag"]})
+  assert response.status_code == 304
+  assert main.response_cache.hits == hits + 1
+
+  # Removing a recommended property drops the entry and changes the ETag
+  main.apply_update({"type": "remove", "property_id": recommended[0]})
+  response = client.get("/recommendations/property-3", headers={"If-None-Match": first.headers["ETag"]})
+  assert response.status_code == 200
+  assert recommended[0] not in response.json()["recommended_ids"]
+
+
+def test_views_without_a_timestamp_are_recorded(client):
+  main.engine.coview = CoViewIndex(window=2)
+  for user in ["user-0", "user-1"]:
+    for pid in ["property-1", "property-2"]:
+      response = client.post("/on-properties-update/", json={
+        "type": "INSERT", "table": "property_views", "record": {"property_id": pid, "user_id": user}})
+      assert response.status_code == 200
+  assert main.engine.coview.get_similar_properties("property-1") == [("property-2", 1.0)]
+
+  response = client.post("/on-properties-update/", json={
+    "type": "INSERT", "table": "property_views",
+    "record": {"property_id": "property-1", "user_id": "user-0", "viewed_at": "yesterday"}})
+  assert response.status_code == 400
+
+
+def test_inactive_rows_schedule_a_rebuild(client, monkeypatch):
+  requests = []
+  monkeypatch.setattr(main.rebuilder, "request", lambda delay=None: requests.append(delay))
+  monkeypatch.setattr(main, "max_inactive_fraction", 0.1)
+  for i in range(6):
+    main.apply_update({"type": "remove", "property_id": f"property-{i}"})
+  assert not requests
+  main.apply_update({"type": "remove", "property_id": "property-6"})
+  assert requests
+
+
+def test_updates_refresh_the_lists_they_change(client, monkeypatch):
+  clone = main.engine.embeddings.get("property-3")
+  monkeypatch.setattr(main, "refresh_property", lambda pid: main.engine.upsert_property(pid, clone))
+  plain = client.get("/recommendations/property-3")
+  filtered = client.get("/recommendations/property-3?status=for_rent&status=for_sale")
+  merged = client.post("/recommendations/from-history", json={"viewed_ids": ["property-3"], "mode": "merge"})
+  other = next(pid for pid in main.engine.embeddings.ids if pid not in plain.json()["recommended_ids"]
+               and "property-3" not in dict(main.engine.get_recommendations(pid)) and pid != "property-3")
+  unrelated = client.get(f"/recommendations/{other}")
+
+  # A copy of property-3 enters its list, so every response read from it changes
+  main.apply_update({"type": "upsert", "property_id": "clone"})
+  assert main.engine.get_recommendations("property-3")[0][0] == "clone"
+  response = client.get("/recommendations/property-3", headers={"If-None-Match": plain.headers["ETag"]})
+  assert response.status_code == 200 and response.json()["recommended_ids"][0] == "clone"
+  response = client.get("/recommendations/property-3?status=for_rent&status=for_sale")
+  assert response.headers["ETag"] != filtered.headers["ETag"]
+  response = client.post("/recommendations/from-history", json={"viewed_ids": ["property-3"], "mode": "merge"})
+  assert response.json()["recommended_ids"][0] == "clone"
+
+  # Lists the clone did not enter stay cached
+  hits = main.response_cache.hits
+  assert client.get(f"/recommendations/{other}").headers["ETag"] == unrelated.headers["ETag"]
+  assert main.response_cache.hits == hits + 1
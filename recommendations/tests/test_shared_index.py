@@ -0,0 +1,38 @@
+from shared_index import SharedIndex
+
+
+def test_followers_attach_to_published_generations(make_engine, tmp_path):
+  directory = str(tmp_path)
+  publisher_engine = make_engine(60)
+
+  def handle_update(update):
+    publisher_engine.remove_property(update["property_id"])
+    publisher.mark_dirty()
+
+  publisher = SharedIndex(publisher_engine, directory, snapshot_interval=0, handle_update=handle_update)
+  follower_engine = make_engine(0)
+  promoted = []
+  follower = SharedIndex(follower_engine, directory, on_promoted=lambda: promoted.append(True))
+
+  assert publisher.try_promote()
+  assert not follower.try_promote()
+  publisher.publish()
+
+  follower.poll()
+  assert follower.generation == publisher.generation
+  assert follower_engine.get_recommendations("property-3") == publisher_engine.get_recommendations("property-3")
+
+  # Updates received by a follower are applied and republished by the publisher
+  follower.submit({"type": "remove", "property_id": "property-3"})
+  first = publisher.generation
+  publisher.poll()
+  assert publisher.generation != first
+  follower.poll()
+  assert follower.generation == publisher.generation
+  assert "property-3" not in follower_engine.embeddings
+
+  # A follower takes over once the publisher goes away
+  publisher.close()
+  follower.poll()
+  assert follower.is_publisher and promoted == [True]
+  follower.close()
@@ -0,0 +1,105 @@
+import numpy as np
+from property_embedding import PropertyEmbedding
+from embedding_store import EmbeddingStore
+from recommendation_engine import RecommendationEngine
+from similarity_matrix import SimilarityMatrix
+
+ASPECT_WEIGHTS = {"metadata": 0.4, "interior": 0.3, "exterior": 0.2, "neighbourhood": 0.1}
+
+
+def make_embeddings(n, seed=0):
+  rng = np.random.default_rng(seed)
+  embeddings = {}
+  for i in range(n):
+    embeddings[f"p{i}"] = PropertyEmbedding(
+      metadata_embedding=rng.random(5).astype(np.float32),
+      interior_embedding=rng.random(16).astype(np.float32) if i % 3 else None,
+      exterior_embedding=rng.random(16).astype(np.float32) if i % 4 else None,
+      neighbourhood_embedding=rng.random(8).astype(np.float32) if i % 5 else np.array([0], dtype=np.float32),
+      metadata_confidence=1.0,
+      interior_confidence=float(rng.random()),
+      exterior_confidence=float(rng.random()),
+      neighbourhood_confidence=1.0,
+    )
+  return embeddings
+
+
+def pairwise_score(a, b):
+  total = 0.0
+  for aspect, weight in ASPECT_WEIGHTS.items():
+    emb_a = getattr(a, f"{aspect}_embedding")
+    emb_b = getattr(b, f"{aspect}_embedding")
+    if emb_a is None or emb_b is None or not emb_a.any() or not emb_b.any():
+      continue
+    cos = np.dot(emb_a, emb_b) / (np.linalg.norm(emb_a) * np.linalg.norm(emb_b))
+    conf = (getattr(a, f"{aspect}_confidence") + getattr(b, f"{aspect}_confidence")) / 2
+    total += cos * conf * weight
+  return total
+
+
+def test_matches_pairwise_definition():
+  embeddings = make_embeddings(40)
+  matrix = SimilarityMatrix(EmbeddingStore.from_embeddings(embeddings), ASPECT_WEIGHTS, top_k=5, block_size=7)
+
+  for pid, emb in embeddings.items():
+    expected = sorted(
+      ((pairwise_score(emb, other), oid) for oid, other in embeddings.items() if oid != pid),
+      reverse=True
+    )[:5]
+    result = matrix.get_similar_properties(pid)
+    assert [score for _, score in result] == sorted([score for _, score in result], reverse=True)
+    np.testing.assert_allclose([s for _, s in result], [s for s, _ in expected], rtol=1e-5, atol=1e-6)
+    assert pid not in [rid for rid, _ in result]
+
+
+def test_top_k_larger_than_catalog():
+  embeddings = make_embeddings(3)
+  matrix = SimilarityMatrix(EmbeddingStore.from_embeddings(embeddings), ASPECT_WEIGHTS, top_k=10)
+  assert all(len(matrix.get_similar_properties(pid)) == 2 for pid in embeddings)
+  assert matrix.get_similar_properties("missing") == []
+
+
+def make_engine(embeddings, top_k):
+  engine = RecommendationEngine({}, {}, ASPECT_WEIGHTS, top_k=top_k)
+  engine.embeddings = dict(embeddings)
+  engine.build_similarity_index()
+  return engine
+
+
+def assert_same_index(engine, embeddings):
+  fresh = SimilarityMatrix(EmbeddingStore.from_embeddings(embeddings), ASPECT_WEIGHTS, top_k=engine.top_k)
+  for pid in embeddings:
+    np.testing.assert_allclose(
+      [s for _, s in engine.get_recommendations(pid)],
+      [s for _, s in fresh.get_similar_properties(pid)],
+      rtol=1e-5, atol=1e-6
+    )
+
+
+def test_incremental_upsert_and_remove_match_full_rebuild():
+  embeddings = make_embeddings(30)
+  engine = make_engine(embeddings, top_k=5)
+  replacements = make_embeddings(35, seed=1)
+
+  # Update existing properties, add new ones and remove some
+  for pid in ["p3", "p10", "p31", "p32", "p34"]:
+    embeddings[pid] = replacements[pid]
+    engine.upsert_property(pid, replacements[pid])
+  for pid in ["p0", "p32", "p17"]:
+    del embeddings[pid]
+    engine.remove_property(pid)
+
+  assert_same_index(engine, embeddings)
+  assert engine.get_recommendations("p0") == []
+  assert all("p0" not in [rid for rid, _ in engine.get_recommendations(pid)] for pid in embeddings)
+
+
+def test_upsert_into_small_catalog():
+  embeddings = make_embeddings(2)
+  engine = make_engine(embeddings, top_k=5)
+  extra = make_embeddings(4, seed=2)
+  embeddings["p2"] = extra["p2"]
+  engine.upsert_property("p2", extra["p2"])
+
+  assert len(engine.get_recommendations("p0")) == 2
+  assert_same_index(engine, embeddings)
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+from attribute_index import PropertyFilter
+from snapshot import load_snapshot, save_snapshot
+
+
+def test_round_trip_serves_same_recommendations(make_engine, tmp_path):
+  for mode in ["exact", "ann"]:
+    engine = make_engine(80, mode=mode)
+    engine.remove_property("property-7")
+    save_snapshot(engine, str(tmp_path / mode))
+
+    restored = make_engine(0, mode=mode)
+    assert load_snapshot(restored, str(tmp_path / mode))
+    assert "property-7" not in restored.embeddings
+    for pid in ["property-0", "property-40"]:
+      assert restored.get_recommendations(pid) == engine.get_recommendations(pid)
+      filters = PropertyFilter(status=["for_sale"], max_price=500000)
+      assert restored.get_recommendations(pid, filters) == engine.get_recommendations(pid, filters)
+
+    # Memory-mapped rows still accept incremental updates
+    restored.upsert_property("property-0", engine.embeddings["property-1"])
+    np.testing.assert_allclose(
+      restored.embeddings["property-0"].metadata_embedding,
+      engine.embeddings["property-1"].metadata_embedding, rtol=1e-6)
+
+
+def test_falls_back_to_older_valid_snapshot(make_engine, tmp_path):
+  engine = make_engine(80)
+  first = save_snapshot(engine, str(tmp_path))
+  second = save_snapshot(engine, str(tmp_path))
+  os.remove(os.path.join(second, "scores.npy"))
+
+  restored = make_engine(0)
+  assert load_snapshot(restored, str(tmp_path)) == first
+
+  mismatched = make_engine(0, top_k=3)
+  assert load_snapshot(mismatched, str(tmp_path)) is None
+
+
+def test_engines_loading_the_same_snapshot_share_a_generation(make_engine, tmp_path):
+  path = save_snapshot(make_engine(80), str(tmp_path))
+  first = make_engine(0)
+  second = make_engine(0)
+  load_snapshot(first, str(tmp_path))
+  load_snapshot(second, str(tmp_path))
+  assert first.generation == second.generation == os.path.basename(path)
+
+
+def test_round_trip_keeps_aspect_components(make_engine, tmp_path):
+  engine = make_engine(80, aspect_candidates=4)
+  save_snapshot(engine, str(tmp_path))
+
+  without = make_engine(0)
+  assert load_snapshot(without, str(tmp_path)) is None
+
+  restored = make_engine(0, aspect_candidates=4)
+  assert load_snapshot(restored, str(tmp_path))
+  weights = {"metadata": 1.0}
+  np.testing.assert_array_equal(restored.recombine(weights)[0], engine.recombine(weights)[0])
@@ -0,0 +1,39 @@
+import numpy as np
+from views import ViewLog, history_windows, load_views, parse_timestamp, sessionize
+
+
+def test_sessions_split_on_user_and_gap_and_collapse_repeats():
+  views = ViewLog.from_records([
+    ("a", "u1", 0), ("b", "u1", 60), ("b", "u1", 90), ("c", "u1", 120),
+    ("d", "u1", 120 + 3600),  # too long after the previous view
+    ("a", None, 10),          # anonymous
+    ("e", "u2", 30), ("a", "u2", 40),
+  ])
+  sessions = sessionize(views)
+
+  viewed = [views.property_ids[p] for p in views.properties[sessions.order]]
+  assert viewed == ["a", "b", "c", "d", "e", "a"]
+  assert sessions.session.tolist() == [0, 0, 0, 1, 2, 2]
+  assert sessions.position.tolist() == [0, 1, 2, 0, 0, 1]
+
+  windows = history_windows(sessions, np.arange(6), 2)
+  assert windows.tolist() == [[-1, -1], [-1, 0], [0, 1], [-1, -1], [-1, -1], [-1, 4]]
+
+
+def test_csv_and_npz_round_trip(tmp_path):
+  path = tmp_path / "views.csv"
+  path.write_text(
+    "id,property_id,user_id,viewed_at,created_at\n"
+    "1,p1,u1,2025-01-04 12:00:00+00,2025-01-04 12:00:00+00\n"
+    "2,p2,,2025-01-04 12:00:05.5+00,2025-01-04 12:00:05.5+00\n"
+  )
+  views = load_views(str(path))
+  assert views.property_ids == ["p1", "p2"]
+  assert views.users.tolist() == [0, -1]
+  assert views.timestamps[1] - views.timestamps[0] == 5.5
+  assert parse_timestamp("2025-01-04T14:00:00+02:00") == views.timestamps[0]
+
+  views.save(str(tmp_path / "views.npz"))
+  restored = load_views(str(tmp_path / "views.npz"))
+  assert restored.property_ids == views.property_ids
+  np.testing.assert_array_equal(restored.timestamps, views.timestamps)
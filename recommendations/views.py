@@ -0,0 +1,138 @@
+"""Loading and sessionizing exports of the property_views table.
+
+Exports are CSV files with at least property_id, user_id and viewed_at
+columns, as written by the Supabase table editor or
+`\\copy property_views to 'views.csv' csv header`. Parsing CSV dominates
+load time, so a parsed log can be saved as .npz and reloaded in
+milliseconds.
+"""
+import csv
+import re
+import numpy as np
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List
+
+# Views by the same user further apart than this start a new session
+SESSION_GAP = 30 * 60
+
+_TIMESTAMP = re.compile(r"^(?P<base>[^.+Z]+?)(?:\.(?P<fraction>\d+))?(?P<offset>Z|[+-]\d{2}(?::?\d{2})?)?$")
+
+
+def parse_timestamp(value: str) -> float:
+  """Seconds since the epoch of a Postgres timestamp(tz) string; naive values are UTC."""
+  match = _TIMESTAMP.match(value.strip().replace(" ", "T"))
+  if match is None:
+    raise ValueError(f"Invalid timestamp: {value!r}")
+  text = match["base"]
+  if match["fraction"]:
+    text += "." + match["fraction"][:6].ljust(6, "0")
+  offset = match["offset"]
+  if offset and offset != "Z":
+    # Python 3.10's fromisoformat needs the offset as +HH:MM
+    digits = offset[1:].replace(":", "")
+    text += f"{offset[0]}{digits[:2]}:{digits[2:4] or '00'}"
+  parsed = datetime.fromisoformat(text)
+  if parsed.tzinfo is None:
+    parsed = parsed.replace(tzinfo=timezone.utc)
+  return parsed.timestamp()
+
+
+@dataclass
+class ViewLog:
+  """Columnar view events; users and properties are integer codes."""
+  users: np.ndarray
+  properties: np.ndarray
+  timestamps: np.ndarray
+  property_ids: List[str]
+
+  def __len__(self) -> int:
+    return len(self.properties)
+
+  @classmethod
+  def from_records(cls, records) -> "ViewLog":
+    """Build from (property_id, user_id or None, epoch seconds) tuples.
+
+    Anonymous views get user code -1.
+    """
+    user_codes: Dict[str, int] = {}
+    property_codes: Dict[str, int] = {}
+    users, properties, timestamps = [], [], []
+    for property_id, user_id, timestamp in records:
+      users.append(-1 if not user_id else user_codes.setdefault(user_id, len(user_codes)))
+      properties.append(property_codes.setdefault(property_id, len(property_codes)))
+      timestamps.append(timestamp)
+    return cls(
+      np.array(users, dtype=np.int32),
+      np.array(properties, dtype=np.int32),
+      np.array(timestamps, dtype=np.float64),
+      list(property_codes)
+    )
+
+  def save(self, path: str):
+    np.savez(path, users=self.users, properties=self.properties,
+             timestamps=self.timestamps, property_ids=np.array(self.property_ids))
+
+  def property_rows(self, rows: Dict[str, int]) -> np.ndarray:
+    """Map each view's property to a store row, -1 where it is not indexed."""
+    lookup = np.array([rows.get(pid, -1) for pid in self.property_ids], dtype=np.int64)
+    return lookup[self.properties]
+
+
+def load_views(path: str) -> ViewLog:
+  """Load a property_views export from .csv or a ViewLog saved as .npz."""
+  if path.endswith(".npz"):
+    data = np.load(path)
+    return ViewLog(data["users"], data["properties"], data["timestamps"], data["property_ids"].tolist())
+
+  with open(path, newline="") as f:
+    return ViewLog.from_records(
+      (row["property_id"], row["user_id"], parse_timestamp(row["viewed_at"]))
+      for row in csv.DictReader(f)
+    )
+
+
+@dataclass
+class Sessions:
+  """Views of signed-in users grouped into sessions, in time order.
+
+  Consecutive repeat views of the same property are collapsed.
+  """
+  order: np.ndarray      # indices into the ViewLog
+  session: np.ndarray    # session number of each view
+  position: np.ndarray   # position of each view within its session
+
+  @property
+  def continues(self) -> np.ndarray:
+    """Whether each view follows an earlier one in the same session."""
+    return self.position > 0
+
+
+def sessionize(views: ViewLog, gap: float = SESSION_GAP) -> Sessions:
+  signed_in = np.flatnonzero(views.users >= 0)
+  order = signed_in[np.lexsort((views.timestamps[signed_in], views.users[signed_in]))]
+  users = views.users[order]
+  timestamps = views.timestamps[order]
+
+  starts = np.ones(len(order), dtype=bool)
+  starts[1:] = (users[1:] != users[:-1]) | (np.diff(timestamps) > gap)
+  repeats = np.zeros(len(order), dtype=bool)
+  repeats[1:] = ~starts[1:] & (views.properties[order][1:] == views.properties[order][:-1])
+  order, starts = order[~repeats], starts[~repeats]
+
+  session = np.cumsum(starts) - 1
+  first = np.flatnonzero(starts)
+  position = np.arange(len(order)) - first[session]
+  return Sessions(order, session, position)
+
+
+def history_windows(sessions: Sessions, values: np.ndarray, length: int) -> np.ndarray:
+  """For every view, the `length` preceding values in its session, oldest
+  first and left-padded with -1. `values` holds one value per view in
+  session order (aligned with `sessions.order`).
+  """
+  windows = np.full((len(sessions.order), length), -1, dtype=values.dtype)
+  for back in range(1, length + 1):
+    valid = sessions.position >= back
+    windows[valid, length - back] = values[np.flatnonzero(valid) - back]
+  return windows